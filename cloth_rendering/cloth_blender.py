@@ -15,6 +15,9 @@ captured (frame 120).
 To run this code from terminal:
     blender -b -P cloth_blender.py
 
+or, to render only some episodes (e.g. from generate_dataset_parallel.py):
+    blender -b -P cloth_blender.py -- --episodes 0 4 8 --seed 0
+
 This will generate files in:
     - pdc/logs_proto/shirt_hanging
     - pdc/logs_proto/shirt_table
@@ -32,11 +35,13 @@ import random
 import numpy as np
 from random import sample
 import math
+import argparse
 from contextlib import contextmanager
 
 sys.path.append(os.getcwd())
 
 import shirt_generation
+import dataset_fragments
 
 COLOR_BLACK = (0, 0, 0, 0)
 COLOR_WHITE = (1, 1, 1, 1)
@@ -326,6 +331,102 @@ def render_depth_rgb_multicamera(filenames, episode):
         bpy.ops.render.render(write_still=True)
 
 
+def matrix_vector_product(matrix, co):
+    """
+    matrix @ co for every point of co, computed as mathutils does: single precision
+    products, summed in double precision and rounded to single precision
+    :param matrix: numpy array (..., 4, 4) float32
+    :param co: numpy array (n_vertices, 3) float32
+    :return: numpy array (..., n_vertices, 3) float32
+    """
+    products = matrix[..., None, :3, :3] * co[:, None, :]
+    dot = products[..., 0].astype(np.float64)
+    dot += products[..., 1]
+    dot += products[..., 2]
+    dot += matrix[..., None, :3, 3]
+    return dot.astype(np.float32)
+
+
+def get_annotated_vertices(cloth, num_annotations):
+    """
+    World coordinates of every num_annotations-th vertex of the deformed cloth,
+    the same values as cloth_deformed.matrix_world @ v.co
+    :return: numpy array (n_vertices, 3) float32
+    """
+    depsgraph = bpy.context.evaluated_depsgraph_get()
+    cloth_deformed = cloth.evaluated_get(depsgraph)
+    mesh_vertices = cloth_deformed.data.vertices
+    co = np.empty(3 * len(mesh_vertices), dtype=np.float32)
+    mesh_vertices.foreach_get('co', co)
+    co = co.reshape(-1, 3)[::num_annotations]
+    return matrix_vector_product(np.array(cloth_deformed.matrix_world, dtype=np.float32), co)
+
+
+def world_to_camera_view(scene, camera_objs, vertices):
+    """
+    Vectorized bpy_extras.object_utils.world_to_camera_view, for all the cameras at once.
+    Every step has the precision of the bpy_extras one (single precision mathutils
+    vectors, double precision python floats), so that the rounded pixels and depths
+    are the same, see compare_with_bpy_extras()
+    :param camera_objs: list of camera objects
+    :param vertices: numpy array (n_vertices, 3) of world coordinates
+    :return: numpy array (n_cameras, n_vertices, 3) float32 of normalized camera coordinates
+    (x, y in [0, 1] inside the view, z distance point-camera)
+    """
+    world_to_camera = np.stack([np.array(cam.matrix_world.normalized().inverted(), dtype=np.float32)
+                                for cam in camera_objs])
+    # view frame corners: top-right, bottom-right, bottom-left
+    frames = np.array([[list(v) for v in cam.data.view_frame(scene=scene)[:3]] for cam in camera_objs],
+                      dtype=np.float32)
+    is_ortho = np.array([cam.data.type == 'ORTHO' for cam in camera_objs])[:, None]
+
+    co_local = matrix_vector_product(world_to_camera, np.asarray(vertices, dtype=np.float32))
+    z = -co_local[..., 2]
+
+    # perspective cameras: frame = [-(v / (v.z / z)) for v in frame], v.z / z is a python
+    # float, rounded to single precision by the vector division, which multiplies by 1.0f / scalar
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        scalar = (frames[:, None, :, 2].astype(np.float64) / z[..., None]).astype(np.float32)
+        scaled_frames = -(frames[:, None] * (np.float32(1.0) / scalar)[..., None])
+        frame = np.where(is_ortho[..., None, None], frames[:, None], scaled_frames).astype(np.float64)
+
+        # python floats from here
+        min_x, max_x = frame[..., 2, 0], frame[..., 1, 0]
+        min_y, max_y = frame[..., 1, 1], frame[..., 0, 1]
+        x = (co_local[..., 0] - min_x) / (max_x - min_x)
+        y = (co_local[..., 1] - min_y) / (max_y - min_y)
+    camera_coords = np.stack([x, y, z.astype(np.float64)], axis=-1).astype(np.float32)
+    camera_coords[~is_ortho & (z == 0.0)] = (0.5, 0.5, 0.0)
+    return camera_coords
+
+
+def compare_with_bpy_extras(cloth, num_annotations, render_size):
+    """
+    Equivalence check of get_annotated_vertices() and world_to_camera_view() with the
+    per-vertex mathutils / bpy_extras code, on the current frame of the scene. To run it
+    from the Blender python console, once the cloth has been simulated:
+        cloth_blender.compare_with_bpy_extras(bpy.data.objects['Cloth'], 50, (960, 720))
+    :return: number of annotations, number of them with a different pixel or depth
+    """
+    scene = bpy.context.scene
+    camera_objs = list(bpy.data.collections['Cameras'].all_objects)
+    camera_coords = world_to_camera_view(scene, camera_objs, get_annotated_vertices(cloth, num_annotations))
+
+    def to_annotation(x, y, z):
+        return [round(x * render_size[0]), round(render_size[1] - y * render_size[1]), round(z, 4)]
+
+    cloth_deformed = cloth.evaluated_get(bpy.context.evaluated_depsgraph_get())
+    vertices = [cloth_deformed.matrix_world @ v.co for v in
+                list(cloth_deformed.data.vertices)[::num_annotations]]
+    num_annotations, num_different = 0, 0
+    for k, camera_obj in enumerate(camera_objs):
+        for i, v in enumerate(vertices):
+            expected = bpy_extras.object_utils.world_to_camera_view(scene, camera_obj, v)
+            num_annotations += 1
+            num_different += to_annotation(*expected) != to_annotation(*camera_coords[k, i].tolist())
+    return num_annotations, num_different
+
+
 def annotate(cloth, episode, frame, mapping, num_annotations, render_size):
     """Gets num_annotations annotations of cloth image at provided frame #, adds to mapping
     :param cloth: cloth object
@@ -337,26 +438,18 @@ def annotate(cloth, episode, frame, mapping, num_annotations, render_size):
     :return: dictionary with the pixelwise coordinates of the annotated points
     """
     scene = bpy.context.scene
-    depsgraph = bpy.context.evaluated_depsgraph_get()
-    cloth_deformed = cloth.evaluated_get(depsgraph)
-    vertices = [cloth_deformed.matrix_world @ v.co for v in
-                list(cloth_deformed.data.vertices)[::num_annotations]]
-
-    for k, camera_obj in enumerate(
-            bpy.data.collections['Cameras'].all_objects):
-        pixels = []
-
-        for i in range(len(vertices)):
-            v = vertices[i]
-            camera_coord = bpy_extras.object_utils.world_to_camera_view(scene,
-                                                                        camera_obj,
-                                                                        v)
-            pixel = [
-                round(camera_coord.x * render_size[0]),                     # horizontal pixelwise coordinate
-                round(render_size[1] - camera_coord.y * render_size[1]),    # vertical pixelwise coordinate
-                round(camera_coord.z, 4)                                    # distance point-camera
-            ]
-            pixels.append(pixel)
+    camera_objs = list(bpy.data.collections['Cameras'].all_objects)
+    vertices = get_annotated_vertices(cloth, num_annotations)
+    camera_coords = world_to_camera_view(scene, camera_objs, vertices)
+
+    for k in range(len(camera_objs)):
+        pixels = [
+            [
+                round(x * render_size[0]),                     # horizontal pixelwise coordinate
+                round(render_size[1] - y * render_size[1]),    # vertical pixelwise coordinate
+                round(z, 4)                                    # distance point-camera
+            ] for x, y, z in camera_coords[k].tolist()
+        ]
         mapping["cam%s-%d-%d" % (k, episode, max(frame - 1, 0))] = pixels
     return mapping
 
@@ -412,7 +505,8 @@ def generate_dataset(num_episodes, filenames_table, filenames_hanging,
                      num_annotations, obj_dir, canonical_shirt_name,
                      random_sized_shirt_name, textures_dir, canonical_texture,
                      random_sizes=False, random_textures=False,
-                     render_width=640, render_height=480, n_cameras=1):
+                     render_width=640, render_height=480, n_cameras=1,
+                     episodes=None, seed=None):
     """
     Generate the whole dataset of images of shirts over a table and shirts hanging
 
@@ -432,7 +526,16 @@ def generate_dataset(num_episodes, filenames_table, filenames_hanging,
     :param render_width: rendered image width in pixels
     :param render_height: rendered image height in pixels
     :param n_cameras: number of cameras in the scene
+    :param episodes: (optional) episode numbers to render, range(num_episodes) if None
+    :param seed: (optional) the random generators are seeded with seed + episode at
+    the start of each episode, so that an episode is the same whatever the process
+    rendering it
+    If the filename formats have a 'fragment' entry, the annotations of each episode
+    are also written to its fragment file once the episode is rendered, see
+    dataset_fragments.py
     """
+    episodes = list(range(num_episodes)) if episodes is None else list(episodes)
+
     # Remove anything in scene
     scene = bpy.context.scene
     scene.render.resolution_percentage = 100
@@ -450,7 +553,10 @@ def generate_dataset(num_episodes, filenames_table, filenames_hanging,
 
     annot_table = {}
     annot_hanging = {}
-    for episode in range(num_episodes):
+    for i, episode in enumerate(episodes):
+        if seed is not None:
+            random.seed(seed + episode)
+            np.random.seed(seed + episode)
 
         obj_name = random_sized_shirt_name % random.randrange(0, 3) if random_sizes else canonical_shirt_name
         cloth = make_cloth(obj_dir, obj_name)
@@ -463,16 +569,25 @@ def generate_dataset(num_episodes, filenames_table, filenames_hanging,
         cloth = generate_cloth_state(cloth, n_pined=1)
         set_up_cameras()
         with stdout_redirected():
-            annot_table, annot_hanging = render(filenames_table,
-                                                filenames_hanging, engine,
-                                                episode, cloth, render_size,
-                                                annotations_table=annot_table,
-                                                annotations_hanging=annot_hanging,
-                                                num_annotations=num_annotations)
-
-        print("Rendered {}/{}".format(episode + 1, num_episodes))
-        if num_episodes > 1:
+            episode_table, episode_hanging = render(filenames_table,
+                                                    filenames_hanging, engine,
+                                                    episode, cloth, render_size,
+                                                    annotations_table={},
+                                                    annotations_hanging={},
+                                                    num_annotations=num_annotations)
+        annot_table.update(episode_table)
+        annot_hanging.update(episode_hanging)
+        if 'fragment' in filenames_table:
+            dataset_fragments.write_fragment(filenames_table, episode, episode_table)
+        if 'fragment' in filenames_hanging:
+            dataset_fragments.write_fragment(filenames_hanging, episode, episode_hanging)
+
+        print("Rendered episode {} ({}/{})".format(episode, i + 1, len(episodes)))
+        if len(episodes) > 1:
             bpy.ops.object.delete()
+    if 'fragment' in filenames_table:
+        # the knots files are merged from all the fragments by generate_dataset_parallel.py
+        return
     with open(filenames_table['knots'], 'w') as outfile:
         json.dump(annot_table, outfile, sort_keys=True, indent=2)
     with open(filenames_hanging['knots'], 'w') as outfile:
@@ -481,30 +596,29 @@ def generate_dataset(num_episodes, filenames_table, filenames_hanging,
 
 if __name__ == '__main__':
 
-    scene_table = 'shirt_table'
-    scene_hanging = 'shirt_hanging'
+    # blender passes the arguments after "--" to the script
+    argv = sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else []
+    argParser = argparse.ArgumentParser()
+    argParser.add_argument("--episodes", type=int, nargs='*', default=None,
+                           help="episodes to render, writes per-episode annotation fragments")
+    argParser.add_argument("--num_episodes", type=int, default=1)
+    argParser.add_argument("--seed", type=int, default=None)
+    argParser.add_argument("--n_cameras", type=int, default=3)
+    args = argParser.parse_args(argv)
+
+    scene_table = dataset_fragments.SCENE_TABLE
+    scene_hanging = dataset_fragments.SCENE_HANGING
     filename_dict = {}
     for scene_name in [scene_table, scene_hanging]:
-        data_dir = 'pdc/logs_proto/%s/processed' % scene_name
-        images_dir = os.path.join(data_dir, 'images')
-        depth_val_dir = os.path.join(data_dir, 'depth_values')
-
-        os.makedirs(images_dir, exist_ok=True)
-        os.makedirs(depth_val_dir, exist_ok=True)
-
-        objects_dir = 'generated_shirts'
-        textures_dir = os.path.join(os.getcwd(), 'textures')
-
-        # filename format data_type-cam_name-episode-frame
-        filename_dict[scene_name] = {
-            'rgb': os.path.join(os.getcwd(), images_dir, "rgb-cam%s-%d-#.png"),
-            'depth': os.path.join(os.getcwd(), depth_val_dir, "depth-cam%s-%d-#.exr"),
-            'depth_img': os.path.join(os.getcwd(), images_dir, "depth-cam%s-%d-#.png"),
-            'knots': os.path.join(os.getcwd(), images_dir, "knots_info_pre.json")
-        }
-
-    episodes = 1
-    n_cameras = 3
+        filename_dict[scene_name] = dataset_fragments.get_scene_filenames(scene_name)
+        if args.episodes is None:
+            del filename_dict[scene_name]['fragment']
+
+    objects_dir = 'generated_shirts'
+    textures_dir = os.path.join(os.getcwd(), 'textures')
+
+    episodes = args.num_episodes
+    n_cameras = args.n_cameras
     num_annotations = 50
 
     # Render dataset
@@ -520,7 +634,8 @@ if __name__ == '__main__':
         textures_dir=textures_dir,
         canonical_texture='white.jpg',
         random_sizes=True, random_textures=True,
-        render_width=960, render_height=720, n_cameras=n_cameras
+        render_width=960, render_height=720, n_cameras=n_cameras,
+        episodes=args.episodes, seed=args.seed
     )
 
     print("Render time with {} cameras: {} seconds".format(n_cameras, time.time() - start))
@@ -62,26 +62,18 @@ def annotate_canonical(cloth, episode, frame, mapping, num_annotations,
     :return: dictionary with the pixelwise coordinates of the annotated points
     """
     scene = bpy.context.scene
-    depsgraph = bpy.context.evaluated_depsgraph_get()
-    cloth_deformed = cloth.evaluated_get(depsgraph)
-    vertices = [cloth_deformed.matrix_world @ v.co for v in
-                list(cloth_deformed.data.vertices)[::num_annotations]]
-
-    for k, camera_obj in enumerate(
-            bpy.data.collections['Cameras'].all_objects):
-        pixels = []
-
-        for i in range(len(vertices)):
-            v = vertices[i]
-            camera_coord = bpy_extras.object_utils.world_to_camera_view(scene,
-                                                                        camera_obj,
-                                                                        v)
-            pixel = [
-                round(camera_coord.x * render_size[0]),
-                round(render_size[1] - camera_coord.y * render_size[1]),
-                round(camera_coord.z, 4)
-            ]
-            pixels.append(pixel)
+    camera_objs = list(bpy.data.collections['Cameras'].all_objects)
+    vertices = cloth_blender.get_annotated_vertices(cloth, num_annotations)
+    camera_coords = cloth_blender.world_to_camera_view(scene, camera_objs, vertices)
+
+    for k in range(len(camera_objs)):
+        pixels = [
+            [
+                round(x * render_size[0]),
+                round(render_size[1] - y * render_size[1]),
+                round(z, 4)
+            ] for x, y, z in camera_coords[k].tolist()
+        ]
         mapping["cam%s-%d-%d" % (k, episode, max(frame - 1, 0))] = pixels
     return mapping
 
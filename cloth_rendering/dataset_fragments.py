@@ -0,0 +1,94 @@
+"""
+Per-episode annotation fragments of the rendered datasets.
+
+When the dataset is rendered by several Blender processes (see
+generate_dataset_parallel.py), each episode writes its annotations to its own
+fragment file
+
+    pdc/logs_proto/<scene_name>/processed/knots_fragments/knots-<episode>.json
+
+once all its images are rendered, so that a fragment marks a complete episode.
+merge_fragments() then writes the knots_info_pre.json file of the scene.
+
+This module does not use bpy, it is shared by the Blender workers and the driver.
+"""
+
+import os
+import json
+import glob
+
+SCENE_TABLE = 'shirt_table'
+SCENE_HANGING = 'shirt_hanging'
+SCENES = (SCENE_TABLE, SCENE_HANGING)
+
+FRAGMENTS_DIR_NAME = 'knots_fragments'
+
+
+def get_scene_filenames(scene_name, root_dir=None):
+    """
+    Filename formats of the images, depth values and annotations of a scene, as used
+    by cloth_blender.generate_dataset(). Creates the folders.
+
+    :param scene_name: name of the scene, e.g. shirt_hanging
+    :param root_dir: folder containing pdc/, the current folder if None
+    :return: dictionary with the filename formats data_type-cam_name-episode-frame
+    """
+    root_dir = os.getcwd() if root_dir is None else root_dir
+    data_dir = os.path.join(root_dir, 'pdc/logs_proto/%s/processed' % scene_name)
+    images_dir = os.path.join(data_dir, 'images')
+    depth_val_dir = os.path.join(data_dir, 'depth_values')
+    fragments_dir = os.path.join(data_dir, FRAGMENTS_DIR_NAME)
+    for folder in (images_dir, depth_val_dir, fragments_dir):
+        os.makedirs(folder, exist_ok=True)
+
+    return {
+        'rgb': os.path.join(images_dir, "rgb-cam%s-%d-#.png"),
+        'depth': os.path.join(depth_val_dir, "depth-cam%s-%d-#.exr"),
+        'depth_img': os.path.join(images_dir, "depth-cam%s-%d-#.png"),
+        'knots': os.path.join(images_dir, "knots_info_pre.json"),
+        'fragment': os.path.join(fragments_dir, "knots-%06d.json"),
+    }
+
+
+def write_fragment(filenames, episode, annotations):
+    """
+    Writes the annotations of an episode. The file is renamed into place, so that a
+    crashed worker never leaves a partial fragment
+    """
+    filename = filenames['fragment'] % episode
+    tmp_filename = filename + '.tmp'
+    with open(tmp_filename, 'w') as outfile:
+        json.dump(annotations, outfile, sort_keys=True, indent=2)
+    os.replace(tmp_filename, filename)
+
+
+def is_episode_complete(filenames, episode, n_cameras):
+    """ Whether the fragment and all the images of the episode exist """
+    if not os.path.isfile(filenames['fragment'] % episode):
+        return False
+    for data_type in ('rgb', 'depth', 'depth_img'):
+        for cam_idx in range(n_cameras):
+            if not glob.glob((filenames[data_type] % (cam_idx, episode)).replace('#', '*')):
+                return False
+    return True
+
+
+def merge_fragments(filenames, episodes=None):
+    """
+    Writes the knots_info_pre.json file of a scene from its fragments
+
+    :param episodes: episodes to merge, all the fragments if None
+    :return: number of merged fragments
+    """
+    if episodes is None:
+        fragment_filenames = sorted(glob.glob(filenames['fragment'].replace('%06d', '*')))
+    else:
+        fragment_filenames = [filenames['fragment'] % episode for episode in sorted(episodes)]
+
+    annotations = {}
+    for fragment_filename in fragment_filenames:
+        with open(fragment_filename, 'r') as infile:
+            annotations.update(json.load(infile))
+    with open(filenames['knots'], 'w') as outfile:
+        json.dump(annotations, outfile, sort_keys=True, indent=2)
+    return len(fragment_filenames)
@@ -0,0 +1,107 @@
+"""
+Parallel and resumable rendering of the dataset of cloth_blender.py.
+
+The episodes are split among num_workers Blender processes, each one rendering
+its own episodes with cpu_count / num_workers threads. Every episode is seeded
+with seed + episode, so that the dataset does not depend on the number of workers.
+A worker writes the annotations of an episode to a fragment file once all its
+images are rendered (see dataset_fragments.py): when the script is run again,
+the complete episodes are skipped and only the missing ones are rendered.
+Finally, the fragments are merged into the knots_info_pre.json file of each scene.
+
+To run this code from terminal (from cloth_rendering):
+    python3 generate_dataset_parallel.py --num_episodes 1000 --num_workers 4
+
+then run bash.sh as usual.
+"""
+
+import os
+import time
+import argparse
+import subprocess
+
+import dataset_fragments
+
+LOGS_DIR_NAME = 'blender_logs'
+
+
+def get_pending_episodes(num_episodes, n_cameras, root_dir=None):
+    """
+    Episodes for which any of the scenes is incomplete
+    """
+    filenames = [dataset_fragments.get_scene_filenames(scene_name, root_dir=root_dir)
+                 for scene_name in dataset_fragments.SCENES]
+    return [episode for episode in range(num_episodes)
+            if not all(dataset_fragments.is_episode_complete(f, episode, n_cameras) for f in filenames)]
+
+
+def split_episodes(episodes, num_workers):
+    """
+    Round-robin split, so that the workers finish at about the same time
+    """
+    shards = [episodes[i::num_workers] for i in range(num_workers)]
+    return [shard for shard in shards if shard]
+
+
+def launch_worker(worker_idx, episodes, seed, n_cameras, num_threads, blender='blender', root_dir=None):
+    """
+    Starts a Blender process rendering episodes, its output goes to blender_logs/worker-<idx>.log
+    :rtype: subprocess.Popen
+    """
+    root_dir = os.path.dirname(os.path.abspath(__file__)) if root_dir is None else root_dir
+    logs_dir = os.path.join(root_dir, LOGS_DIR_NAME)
+    os.makedirs(logs_dir, exist_ok=True)
+    log_filename = os.path.join(logs_dir, 'worker-%d.log' % worker_idx)
+
+    cmd = [blender, '-b', '-t', str(num_threads), '-P', 'cloth_blender.py', '--',
+           '--seed', str(seed), '--n_cameras', str(n_cameras),
+           '--episodes'] + [str(episode) for episode in episodes]
+    with open(log_filename, 'w') as log_file:
+        process = subprocess.Popen(cmd, cwd=root_dir, stdout=log_file, stderr=subprocess.STDOUT)
+    process.log_filename = log_filename
+    return process
+
+
+def generate_dataset_parallel(num_episodes, num_workers, seed=0, n_cameras=3, blender='blender'):
+    """
+    :return: episodes still incomplete after all the workers exited
+    :rtype: list
+    """
+    root_dir = os.path.dirname(os.path.abspath(__file__))
+    pending = get_pending_episodes(num_episodes, n_cameras, root_dir=root_dir)
+    print("%d/%d episodes to render" % (len(pending), num_episodes))
+
+    shards = split_episodes(pending, num_workers)
+    num_threads = max(1, (os.cpu_count() or 1) // max(1, len(shards)))
+    start = time.time()
+    processes = [launch_worker(i, shard, seed, n_cameras, num_threads, blender=blender, root_dir=root_dir)
+                 for i, shard in enumerate(shards)]
+    for i, process in enumerate(processes):
+        if process.wait() != 0:
+            print("worker %d failed (exit code %d), see %s" % (i, process.returncode, process.log_filename))
+    if processes:
+        print("Render time with %d workers: %.1f seconds" % (len(processes), time.time() - start))
+
+    missing = get_pending_episodes(num_episodes, n_cameras, root_dir=root_dir)
+    complete = sorted(set(range(num_episodes)) - set(missing))
+    for scene_name in dataset_fragments.SCENES:
+        filenames = dataset_fragments.get_scene_filenames(scene_name, root_dir=root_dir)
+        num_merged = dataset_fragments.merge_fragments(filenames, episodes=complete)
+        print("%s: merged %d episodes into %s" % (scene_name, num_merged, filenames['knots']))
+    if missing:
+        print("%d episodes are incomplete, run again to render them: %s" % (len(missing), missing))
+    return missing
+
+
+if __name__ == '__main__':
+    argParser = argparse.ArgumentParser()
+    argParser.add_argument("--num_episodes", type=int, required=True)
+    argParser.add_argument("--num_workers", type=int, default=max(1, (os.cpu_count() or 1) // 4))
+    argParser.add_argument("--seed", type=int, default=0)
+    argParser.add_argument("--n_cameras", type=int, default=3)
+    argParser.add_argument("--blender", default='blender', help="path to the blender executable")
+    args = argParser.parse_args()
+
+    missing = generate_dataset_parallel(args.num_episodes, args.num_workers, seed=args.seed,
+                                        n_cameras=args.n_cameras, blender=args.blender)
+    exit(1 if missing else 0)
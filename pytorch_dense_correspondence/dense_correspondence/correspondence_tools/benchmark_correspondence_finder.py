@@ -0,0 +1,127 @@
+"""
+Micro-benchmark of the correspondence finders on the shirt datasets.
+
+Compares the original list-based batch_find_pixel_correspondences() with the
+vectorized find_pixel_correspondences(), for single pairs, for batches of pairs
+and for pairs given by their row in preloaded knot tensors, and checks that all
+of them find the same correspondences.
+
+To run it from terminal (from pytorch_dense_correspondence/):
+    python dense_correspondence/correspondence_tools/benchmark_correspondence_finder.py
+"""
+
+import os
+import random
+import argparse
+import timeit
+import torch
+
+import dense_correspondence_manipulation.utils.utils as utils
+
+utils.add_dense_correspondence_to_python_path()
+import dense_correspondence.correspondence_tools.correspondence_finder as correspondence_finder
+from dense_correspondence.dataset.knots_table import KnotsTable
+
+
+def legacy_batch_find_pixel_correspondences(img_a_knots, img_b_knots):
+    """
+    batch_find_pixel_correspondences() as it was before being vectorized, used as reference
+    """
+    x_a, y_a = [], []
+    x_b, y_b = [], []
+
+    for pixel_a, pixel_b in zip(img_a_knots, img_b_knots):
+        if pixel_a[0] != -1 and pixel_b[0] != -1:
+            x_a.append(pixel_a[0])
+            y_a.append(pixel_a[1])
+            x_b.append(pixel_b[0])
+            y_b.append(pixel_b[1])
+
+    uv_a, uv_b = torch.Tensor([x_a, y_a]).type(torch.LongTensor), torch.Tensor([x_b, y_b]).type(torch.LongTensor)
+    uv_a, uv_b = (uv_a[0], uv_a[1]), (uv_b[0], uv_b[1])
+
+    uv_a_vec = (torch.ones(len(uv_a[0])).type(torch.LongTensor) * uv_a[0],
+                torch.ones(len(uv_a[1])).type(torch.LongTensor) * uv_a[1])
+    uv_b_vec = (torch.ones(len(uv_b[0])).type(torch.LongTensor) * uv_b[0],
+                torch.ones(len(uv_b[1])).type(torch.LongTensor) * uv_b[1])
+    return uv_a_vec, uv_b_vec
+
+
+def time_per_call(function, number):
+    return timeit.timeit(function, number=number) / number
+
+
+def run_benchmark(knots_filename_a, knots_filename_b, num_pairs=256, number=20, seed=0):
+    """
+    :param knots_filename_a: knots_info.json of the scene of the images a (e.g. shirt_hanging)
+    :param knots_filename_b: knots_info.json of the scene of the images b (e.g. shirt_canonical)
+    :param num_pairs: number of random pairs of images
+    :param number: number of repetitions of each measurement
+    """
+    random.seed(seed)
+    knots_info_a = utils.getDictFromJSONFilename(knots_filename_a)
+    knots_info_b = utils.getDictFromJSONFilename(knots_filename_b)
+    knots_table_a = KnotsTable.from_dict(knots_info_a)
+    knots_table_b = KnotsTable.from_dict(knots_info_b)
+    knots_tensor_a, valid_a = knots_table_a.as_tensors()
+    knots_tensor_b, valid_b = knots_table_b.as_tensors()
+
+    pairs = [(random.choice(list(knots_info_a.keys())), random.choice(list(knots_info_b.keys())))
+             for _ in range(num_pairs)]
+    rows_a = torch.LongTensor([knots_table_a.row(a) for a, _ in pairs])
+    rows_b = torch.LongTensor([knots_table_b.row(b) for _, b in pairs])
+
+    # check that all the finders agree
+    uv_a_batch, uv_b_batch, pair_idx = correspondence_finder.find_pixel_correspondences_by_index(
+        knots_tensor_a, valid_a, rows_a, knots_tensor_b, valid_b, rows_b)
+    for i, (a, b) in enumerate(pairs):
+        uv_a_ref, uv_b_ref = legacy_batch_find_pixel_correspondences(knots_info_a[a], knots_info_b[b])
+        uv_a, uv_b = correspondence_finder.find_pixel_correspondences(knots_info_a[a], knots_info_b[b])
+        in_pair = pair_idx == i
+        for reference, results in [(uv_a_ref, [uv_a, (uv_a_batch[0][in_pair], uv_a_batch[1][in_pair])]),
+                                   (uv_b_ref, [uv_b, (uv_b_batch[0][in_pair], uv_b_batch[1][in_pair])])]:
+            for result in results:
+                assert torch.equal(reference[0], result[0]) and torch.equal(reference[1], result[1])
+
+    def legacy():
+        for a, b in pairs:
+            legacy_batch_find_pixel_correspondences(knots_info_a[a], knots_info_b[b])
+
+    def vectorized_json_knots():
+        for a, b in pairs:
+            correspondence_finder.find_pixel_correspondences(knots_info_a[a], knots_info_b[b])
+
+    def vectorized_by_index():
+        for a, b in pairs:
+            correspondence_finder.find_pixel_correspondences_by_index(knots_tensor_a, valid_a, knots_table_a.row(a),
+                                                                      knots_tensor_b, valid_b, knots_table_b.row(b))
+
+    def vectorized_batch():
+        correspondence_finder.find_pixel_correspondences_by_index(knots_tensor_a, valid_a, rows_a,
+                                                                  knots_tensor_b, valid_b, rows_b)
+
+    print("%d pairs, %d knots per image" % (num_pairs, knots_table_a.num_knots))
+    reference_time = time_per_call(legacy, number)
+    for name, function in [("legacy batch_find_pixel_correspondences", legacy),
+                           ("find_pixel_correspondences (json knots)", vectorized_json_knots),
+                           ("find_pixel_correspondences_by_index (per pair)", vectorized_by_index),
+                           ("find_pixel_correspondences_by_index (batch)", vectorized_batch)]:
+        t = reference_time if function is legacy else time_per_call(function, number)
+        print("%-50s %8.3f ms per pair   x%.1f" % (name, 1e3 * t / num_pairs, reference_time / t))
+
+
+if __name__ == '__main__':
+    logs_root_path = os.path.join(utils.getDenseCorrespondenceSourceDir(), '..', 'cloth_rendering', 'pdc', 'logs_proto')
+    canonical_logs_root_path = os.path.join(utils.getDenseCorrespondenceSourceDir(), 'pdc', 'logs_proto')
+
+    argParser = argparse.ArgumentParser()
+    argParser.add_argument("-a", "--knots_a", help="knots_info.json of the images a",
+                           default=os.path.join(logs_root_path, 'shirt_hanging', 'processed', 'images',
+                                                'knots_info.json'))
+    argParser.add_argument("-b", "--knots_b", help="knots_info.json of the images b",
+                           default=os.path.join(canonical_logs_root_path, 'shirt_canonical', 'processed', 'images',
+                                                'knots_info.json'))
+    argParser.add_argument("-n", "--num_pairs", type=int, default=256)
+    args = argParser.parse_args()
+
+    run_benchmark(args.knots_a, args.knots_b, num_pairs=args.num_pairs)
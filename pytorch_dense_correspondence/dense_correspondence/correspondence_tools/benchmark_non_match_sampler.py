@@ -0,0 +1,151 @@
+"""
+Benchmark of the non-match sampling done for every sample of the dataset.
+
+Compares the original non-match generation of SpartanDataset.get_within_scene_data()
+(two create_non_correspondences() calls, create_non_matches() and the blind
+non-match sampling) against NonMatchSampler, in number of tensor allocations
+and in time per sample, on the masks and knots of the shirt datasets.
+
+To run it from terminal (from pytorch_dense_correspondence/):
+    python dense_correspondence/correspondence_tools/benchmark_non_match_sampler.py
+"""
+
+import os
+import random
+import argparse
+import timeit
+import numpy as np
+import torch
+from PIL import Image
+
+import dense_correspondence_manipulation.utils.utils as utils
+
+utils.add_dense_correspondence_to_python_path()
+import dense_correspondence.correspondence_tools.correspondence_finder as correspondence_finder
+from dense_correspondence.correspondence_tools.non_match_sampler import NonMatchSampler
+from dense_correspondence.dataset.knots_table import KnotsTable
+
+
+def flatten_uv_tensor(uv_tensor, image_width, image_height):
+    result = uv_tensor[1].long() * image_width + uv_tensor[0].long()
+    return torch.min(result, torch.ones_like(result).long() * ((image_width * image_height) - 1))
+
+
+def create_non_matches(uv_a, uv_b_non_matches, multiplier):
+    uv_a_long = (torch.t(uv_a[0].repeat(multiplier, 1)).contiguous().view(-1, 1),
+                 torch.t(uv_a[1].repeat(multiplier, 1)).contiguous().view(-1, 1))
+    uv_b_non_matches_long = (uv_b_non_matches[0].view(-1, 1), uv_b_non_matches[1].view(-1, 1))
+    return uv_a_long, uv_b_non_matches_long
+
+
+def legacy_non_matches(uv_a, uv_b, image_a_mask, image_b_mask, num_masked, num_background):
+    """
+    Non-match generation of get_within_scene_data() before NonMatchSampler, used as reference
+    """
+    image_b_mask_torch = torch.from_numpy(np.array(image_b_mask)).type(torch.FloatTensor)
+    image_height, image_width = image_b_mask_torch.shape
+    image_b_shape = (image_height, image_width)
+
+    uv_b_masked_non_matches = correspondence_finder.create_non_correspondences(
+        uv_b, image_b_shape, num_non_matches_per_match=num_masked, img_b_mask=image_b_mask_torch)
+    uv_b_background_non_matches = correspondence_finder.create_non_correspondences(
+        uv_b, image_b_shape, num_non_matches_per_match=num_background, img_b_mask=1 - image_b_mask_torch)
+
+    matches_a = flatten_uv_tensor(uv_a, image_width, image_height)
+
+    uv_a_masked_long, uv_b_masked_non_matches_long = create_non_matches(uv_a, uv_b_masked_non_matches, num_masked)
+    masked_non_matches_a = flatten_uv_tensor(uv_a_masked_long, image_width, image_height).squeeze(1)
+    masked_non_matches_b = flatten_uv_tensor(uv_b_masked_non_matches_long, image_width, image_height).squeeze(1)
+
+    uv_a_background_long, uv_b_background_non_matches_long = create_non_matches(uv_a, uv_b_background_non_matches,
+                                                                                num_background)
+    background_non_matches_a = flatten_uv_tensor(uv_a_background_long, image_width, image_height).squeeze(1)
+    background_non_matches_b = flatten_uv_tensor(uv_b_background_non_matches_long, image_width,
+                                                 image_height).squeeze(1)
+
+    matches_a_mask = torch.zeros(image_width * image_height).long()
+    matches_a_mask[matches_a] = 1
+    mask_a_flat = torch.from_numpy(np.array(image_a_mask)).long().view(-1, 1).squeeze(1)
+    blind_non_matches_a = (mask_a_flat - matches_a_mask).nonzero().squeeze(1)
+    blind_uv_b = correspondence_finder.random_sample_from_masked_image_torch(image_b_mask_torch,
+                                                                             blind_non_matches_a.size()[0])
+    blind_non_matches_b = utils.uv_to_flattened_pixel_locations(blind_uv_b, image_width)
+
+    return masked_non_matches_a, masked_non_matches_b, background_non_matches_a, background_non_matches_b, \
+        blind_non_matches_a, blind_non_matches_b
+
+
+def count_allocations(function):
+    """
+    :return: number of operators that allocate memory in one call to function
+    """
+    with torch.profiler.profile(activities=[torch.profiler.ProfilerActivity.CPU], profile_memory=True) as prof:
+        function()
+    return len([e for e in prof.events() if e.self_cpu_memory_usage > 0])
+
+
+def run_benchmark(scene_directory_a, scene_directory_b, num_masked=75, num_background=75, number=20):
+    """
+    :param scene_directory_a: processed folder of the scene of the images a (e.g. shirt_hanging)
+    :param scene_directory_b: processed folder of the scene of the images b (e.g. shirt_canonical)
+    """
+    knots_a = KnotsTable.from_json_file(os.path.join(scene_directory_a, 'images', 'knots_info.json'))
+    knots_b = KnotsTable.from_json_file(os.path.join(scene_directory_b, 'images', 'knots_info.json'))
+    image_a_id, image_b_id = random.choice(knots_a.keys()), random.choice(knots_b.keys())
+
+    mask_a = np.array(Image.open(os.path.join(scene_directory_a, 'image_masks', 'mask-%s.png' % image_a_id))
+                      .convert('L'))
+    mask_b = np.array(Image.open(os.path.join(scene_directory_b, 'image_masks', 'mask-%s.png' % image_b_id))
+                      .convert('L'))
+    image_height, image_width = mask_b.shape
+
+    uv_a, uv_b = knots_a.find_correspondences(image_a_id, knots_b, image_b_id)
+    uv_a = (torch.from_numpy(uv_a[0]), torch.from_numpy(uv_a[1]))
+    uv_b = (torch.from_numpy(uv_b[0]), torch.from_numpy(uv_b[1]))
+    matches_a = flatten_uv_tensor(uv_a, image_width, image_height)
+    matches_b = flatten_uv_tensor(uv_b, image_width, image_height)
+
+    sampler = NonMatchSampler(image_width, image_height, seed=0)
+
+    def legacy():
+        legacy_non_matches(uv_a, uv_b, mask_a, mask_b, num_masked, num_background)
+
+    def batched():
+        sampler.sample(matches_a, matches_b, mask_a, mask_b, num_masked, num_background,
+                       key_a=image_a_id, key_b=image_b_id)
+
+    # check that both produce non-matches of the same size and kind
+    reference = legacy_non_matches(uv_a, uv_b, mask_a, mask_b, num_masked, num_background)
+    result = sampler.sample(matches_a, matches_b, mask_a, mask_b, num_masked, num_background)
+    for r, s in zip(reference, result):
+        assert r.shape == s.shape
+    assert torch.equal(reference[0], result[0]) and torch.equal(reference[4], result[4])
+    assert (mask_b.reshape(-1)[result[1].numpy()] != 0).all()
+    assert (mask_b.reshape(-1)[result[3].numpy()] == 0).all()
+
+    batched()  # fills the mask cache, as after the first epoch
+
+    print("%d matches, %d masked and %d background non-matches per match, %d blind non-matches"
+          % (len(matches_a), num_masked, num_background, len(result[4])))
+    legacy_allocations, batched_allocations = count_allocations(legacy), count_allocations(batched)
+    legacy_time = timeit.timeit(legacy, number=number) / number
+    batched_time = timeit.timeit(batched, number=number) / number
+    print("%-20s %4d allocations   %8.3f ms" % ("legacy", legacy_allocations, 1e3 * legacy_time))
+    print("%-20s %4d allocations   %8.3f ms" % ("NonMatchSampler", batched_allocations, 1e3 * batched_time))
+    print("x%.1f fewer allocations, x%.1f faster" % (float(legacy_allocations) / batched_allocations,
+                                                     legacy_time / batched_time))
+
+
+if __name__ == '__main__':
+    source_dir = utils.getDenseCorrespondenceSourceDir()
+
+    argParser = argparse.ArgumentParser()
+    argParser.add_argument("-a", "--scene_a", help="processed folder of the scene of the images a",
+                           default=os.path.join(source_dir, '..', 'cloth_rendering', 'pdc', 'logs_proto',
+                                                'shirt_hanging', 'processed'))
+    argParser.add_argument("-b", "--scene_b", help="processed folder of the scene of the images b",
+                           default=os.path.join(source_dir, 'pdc', 'logs_proto', 'shirt_canonical', 'processed'))
+    args = argParser.parse_args()
+
+    random.seed(0)
+    run_benchmark(args.scene_a, args.scene_b)
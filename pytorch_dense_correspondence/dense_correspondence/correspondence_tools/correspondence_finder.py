@@ -356,33 +356,85 @@ def create_non_correspondences(uv_b_matches, img_b_shape, num_non_matches_per_ma
 
 
 def batch_find_pixel_correspondences(img_a_knots, img_b_knots, device='CPU'):
+    """
+    Finds the pixel correspondences between two images given by the knots visible in both of them.
+    Kept for backwards compatibility, see find_pixel_correspondences().
+
+    :param img_a_knots, img_b_knots: knots of each image, list (or array) of [u, v, depth] with
+        [-1, -1, -1] for the not visible knots
+    :param device: 'CPU' or 'GPU'
+    :return: uv_a, uv_b, each one a tuple of torch.LongTensor (u, v)
+    """
     # TODO: check self occlusion
-    global dtype_float
-    global dtype_long
-    if device == 'CPU':
-        dtype_float = torch.FloatTensor
-        dtype_long = torch.LongTensor
-    if device == 'GPU':
-        dtype_float = torch.cuda.FloatTensor
-        dtype_long = torch.cuda.LongTensor
-
-    x_a, y_a = [], []
-    x_b, y_b = [], []
-
-
-    for pixel_a, pixel_b in zip(img_a_knots, img_b_knots):
-        if pixel_a[0] != -1 and pixel_b[0] != -1:
-            x_a.append(pixel_a[0])
-            y_a.append(pixel_a[1])
-            x_b.append(pixel_b[0])
-            y_b.append(pixel_b[1])
-
-    uv_a, uv_b = torch.Tensor([x_a, y_a]).type(dtype_long), torch.Tensor([x_b, y_b]).type(dtype_long)
-    uv_a, uv_b = (uv_a[0], uv_a[1]), (uv_b[0], uv_b[1])
-
-    # finally, return matches in torch compatible format
-    uv_a_vec = (torch.ones(len(uv_a[0])).type(dtype_long) * uv_a[0],
-                torch.ones(len(uv_a[1])).type(dtype_long) * uv_a[1])
-    uv_b_vec = (torch.ones(len(uv_b[0])).type(dtype_long) * uv_b[0],
-                torch.ones(len(uv_b[1])).type(dtype_long) * uv_b[1])
-    return uv_a_vec, uv_b_vec
+    return find_pixel_correspondences(img_a_knots, img_b_knots,
+                                      device='cuda' if device == 'GPU' else 'cpu')
+
+
+def find_pixel_correspondences(knots_a, knots_b, valid_a=None, valid_b=None, device=None):
+    """
+    Vectorized correspondence finder. The correspondences of a pair of images are the knots
+    visible in both images, which are found with a single boolean-mask operation.
+
+    Works for a single pair of images or for a batch of N pairs at once. It doesn't modify
+    any global state, so it is safe to use inside the DataLoader workers.
+
+    :param knots_a, knots_b: knots (u, v, ...) of image a and image b. numpy.ndarray, torch.Tensor
+        or nested lists with shape [num_knots, >=2] or [N, num_knots, >=2] for a batch of pairs
+    :param valid_a, valid_b: (optional) bool masks of the visible knots with shape [num_knots] or
+        [N, num_knots]. If None, the knots with u == -1 are considered not visible
+    :param device: (optional) device where the results are returned
+    :return: uv_a, uv_b, each one a tuple of torch.LongTensor (u, v). For a batch of pairs, also
+        pair_idx, a torch.LongTensor with the pair each correspondence belongs to
+    """
+    knots_a = torch.as_tensor(np.asarray(knots_a) if isinstance(knots_a, list) else knots_a)
+    knots_b = torch.as_tensor(np.asarray(knots_b) if isinstance(knots_b, list) else knots_b)
+
+    batched = knots_a.dim() == 3
+    if not batched:
+        knots_a, knots_b = knots_a.unsqueeze(0), knots_b.unsqueeze(0)
+        valid_a = None if valid_a is None else torch.as_tensor(valid_a).unsqueeze(0)
+        valid_b = None if valid_b is None else torch.as_tensor(valid_b).unsqueeze(0)
+
+    # as zip() did, only the knots present in both images are compared
+    num_knots = min(knots_a.shape[1], knots_b.shape[1])
+    knots_a = knots_a[:, :num_knots]
+    knots_b = knots_b[:, :num_knots]
+
+    if valid_a is None:
+        valid_a = knots_a[:, :, 0] != -1
+    if valid_b is None:
+        valid_b = knots_b[:, :, 0] != -1
+    valid = torch.as_tensor(valid_a)[:, :num_knots] & torch.as_tensor(valid_b)[:, :num_knots]
+
+    pair_idx, knot_idx = valid.nonzero(as_tuple=True)
+    uv_a = knots_a[pair_idx, knot_idx, 0:2].long()
+    uv_b = knots_b[pair_idx, knot_idx, 0:2].long()
+
+    if device is not None:
+        uv_a, uv_b, pair_idx = uv_a.to(device), uv_b.to(device), pair_idx.to(device)
+
+    uv_a = (uv_a[:, 0], uv_a[:, 1])
+    uv_b = (uv_b[:, 0], uv_b[:, 1])
+    if not batched:
+        return uv_a, uv_b
+    return uv_a, uv_b, pair_idx
+
+
+def find_pixel_correspondences_by_index(knots_a, valid_a, rows_a, knots_b, valid_b, rows_b, device=None):
+    """
+    Same as find_pixel_correspondences() but for images given by their row in preloaded knot
+    tensors (e.g. KnotsTable.as_tensors()), which can live on any device.
+
+    :param knots_a, knots_b: torch.Tensor of shape [num_images, num_knots, >=2]
+    :param valid_a, valid_b: torch.BoolTensor of shape [num_images, num_knots]
+    :param rows_a, rows_b: int or torch.LongTensor of shape [N] with the rows of each pair
+    :return: see find_pixel_correspondences()
+    """
+    if isinstance(rows_a, int):
+        return find_pixel_correspondences(knots_a[rows_a], knots_b[rows_b],
+                                          valid_a=valid_a[rows_a], valid_b=valid_b[rows_b], device=device)
+
+    rows_a = torch.as_tensor(rows_a, dtype=torch.long, device=knots_a.device)
+    rows_b = torch.as_tensor(rows_b, dtype=torch.long, device=knots_b.device)
+    return find_pixel_correspondences(knots_a[rows_a], knots_b[rows_b],
+                                      valid_a=valid_a[rows_a], valid_b=valid_b[rows_b], device=device)
@@ -0,0 +1,226 @@
+"""
+Batched sampling of masked, background and blind non-matches.
+
+NonMatchSampler replaces the two create_non_correspondences() calls and the
+blind non-match sampling done for every sample in
+SpartanDataset.get_within_scene_data(). The flattened foreground/background
+pixel indices of the most recently used images are cached, and the random
+draws, the perturbation and the wraparound of all the non-matches of a batch
+of image pairs are done in one pass over a single flat tensor.
+
+All indices are in the "single index" format for pixels, n = u + image_width * v
+"""
+
+from collections import OrderedDict
+
+import torch
+import numpy as np
+
+DEFAULT_MAX_CACHED_MASKS = 256
+
+
+class NonMatchSampler(object):
+
+    def __init__(self, image_width, image_height, seed=None, perturb_too_close=False, num_pixels_too_close=1.0,
+                 perturb_std_dev=10, max_cached_masks=DEFAULT_MAX_CACHED_MASKS):
+        """
+        :param image_width, image_height: size of the images
+        :param seed: (optional) fixed seed, to get reproducible non-matches
+        :param perturb_too_close: perturb the non-matches closer than num_pixels_too_close to their match
+            (in u or v), as intended in create_non_correspondences(). Note that create_non_correspondences()
+            builds its perturbation mask from zeros, so it never perturbs any sample. The default keeps that
+            behaviour.
+        :type perturb_too_close: bool
+        :param max_cached_masks: number of masks kept by get_mask_indices(), the least recently
+            used ones are dropped. Each one takes about 2.7 MB for a 640x480 image, in every
+            DataLoader worker
+        """
+        self._image_width = image_width
+        self._image_height = image_height
+        self._num_pixels = image_width * image_height
+        self._perturb_too_close = perturb_too_close
+        self._num_pixels_too_close = num_pixels_too_close
+        self._perturb_std_dev = perturb_std_dev
+
+        self._generator = torch.Generator()
+        self.set_seed(seed)
+
+        self._all_pixels = torch.arange(self._num_pixels, dtype=torch.long)
+        self._max_cached_masks = max_cached_masks
+        self._mask_cache = OrderedDict()
+
+    def set_seed(self, seed=None):
+        """
+        :param seed: int, or None to draw a random seed
+        """
+        if seed is None:
+            self._generator.seed()
+        else:
+            self._generator.manual_seed(seed)
+
+    def clear_cache(self):
+        self._mask_cache = OrderedDict()
+
+    def get_mask_indices(self, mask, key=None):
+        """
+        Flattened foreground and background indices of a mask.
+        :param mask: [H, W] numpy.ndarray, torch.Tensor or PIL.Image.Image. Non-zero pixels are foreground
+        :param key: (optional) hashable id of the image, e.g. (scene_name, image_idx). If given, the
+            result is cached (up to max_cached_masks of them) and the mask is only read the first time
+        :return: foreground bool map [H*W], foreground indices, background indices (torch.LongTensor)
+        """
+        if key is not None and key in self._mask_cache:
+            self._mask_cache.move_to_end(key)
+            return self._mask_cache[key]
+
+        if isinstance(mask, torch.Tensor):
+            foreground = mask.reshape(-1).cpu() != 0
+        else:
+            foreground = torch.from_numpy(np.asarray(mask).reshape(-1) != 0)
+
+        result = (foreground, foreground.nonzero().squeeze(1), (~foreground).nonzero().squeeze(1))
+        if key is not None and self._max_cached_masks > 0:
+            self._mask_cache[key] = result
+            while len(self._mask_cache) > self._max_cached_masks:
+                self._mask_cache.popitem(last=False)
+        return result
+
+    def sample(self, matches_a, matches_b, mask_a, mask_b, num_masked_non_matches_per_match,
+               num_background_non_matches_per_match, use_image_b_mask_inv=True, key_a=None, key_b=None):
+        """
+        Non-matches of a single pair of images, see sample_batch()
+        :return: masked_non_matches_a, masked_non_matches_b, background_non_matches_a, background_non_matches_b,
+            blind_non_matches_a, blind_non_matches_b
+        """
+        return self.sample_batch([matches_a], [matches_b], [mask_a], [mask_b],
+                                 num_masked_non_matches_per_match, num_background_non_matches_per_match,
+                                 use_image_b_mask_inv=use_image_b_mask_inv,
+                                 keys_a=[key_a], keys_b=[key_b])[0]
+
+    def sample_batch(self, matches_a, matches_b, masks_a, masks_b, num_masked_non_matches_per_match,
+                     num_background_non_matches_per_match, use_image_b_mask_inv=True, keys_a=None, keys_b=None):
+        """
+        Samples the non-matches of N image pairs at once:
+            - masked non-matches: for each match, num_masked_non_matches_per_match pixels of mask b
+            - background non-matches: for each match, num_background_non_matches_per_match pixels outside
+              mask b (anywhere in image b if use_image_b_mask_inv is False)
+            - blind non-matches: the pixels of mask a without a match, each one paired with a random
+              pixel of mask b
+        Masked and background non-matches are perturbed and wrapped around exactly as
+        create_non_correspondences() does.
+
+        :param matches_a, matches_b: lists of N flat torch.LongTensor with the matches of each pair
+        :param masks_a, masks_b: lists of N masks, see get_mask_indices()
+        :param keys_a, keys_b: (optional) lists of N keys to cache the masks, see get_mask_indices()
+        :return: list of N tuples (masked_non_matches_a, masked_non_matches_b, background_non_matches_a,
+            background_non_matches_b, blind_non_matches_a, blind_non_matches_b) of flat torch.LongTensor.
+            If no blind non-matches are found both are torch.LongTensor([-1]), as
+            DenseCorrespondenceDataset.empty_tensor()
+        """
+        num_pairs = len(matches_a)
+        keys_a = [None] * num_pairs if keys_a is None else keys_a
+        keys_b = [None] * num_pairs if keys_b is None else keys_b
+
+        # candidate pools and number of samples of every segment, in the order
+        # [pair 0 masked, pair 0 background, pair 0 blind, pair 1 masked, ...]
+        pools = []
+        counts = []
+        blind_non_matches_a = []
+        for i in range(num_pairs):
+            foreground_a, _, _ = self.get_mask_indices(masks_a[i], keys_a[i])
+            _, foreground_b, background_b = self.get_mask_indices(masks_b[i], keys_b[i])
+            num_matches = len(matches_a[i])
+
+            # create_non_correspondences() samples in the whole image if the mask is empty
+            pools.append(foreground_b if len(foreground_b) > 0 else self._all_pixels)
+            counts.append(num_matches * num_masked_non_matches_per_match)
+
+            if use_image_b_mask_inv and len(background_b) > 0:
+                pools.append(background_b)
+            else:
+                pools.append(self._all_pixels)
+            counts.append(num_matches * num_background_non_matches_per_match)
+
+            # pixels of mask a without a match (or matches outside of mask a)
+            matched_a = torch.zeros(self._num_pixels, dtype=torch.bool)
+            matched_a[matches_a[i]] = True
+            blind_a = (foreground_a ^ matched_a).nonzero().squeeze(1)
+            if len(foreground_b) == 0:
+                blind_a = blind_a[:0]
+            blind_non_matches_a.append(blind_a)
+            pools.append(foreground_b)
+            counts.append(len(blind_a))
+
+        # one random draw for all the segments
+        pool_sizes = torch.LongTensor([len(pool) for pool in pools])
+        counts = torch.LongTensor(counts)
+        segment_sizes = torch.repeat_interleave(pool_sizes, counts)
+        samples_in_pool = (torch.rand(int(counts.sum()), generator=self._generator) * segment_sizes).long()
+        samples = torch.cat([pool[s] for pool, s in zip(pools, torch.split(samples_in_pool, counts.tolist()))])
+
+        # matches each sample is a non-match of
+        non_match_counts = counts.view(num_pairs, 3)
+        sample_sources_a = []
+        sample_sources_b = []
+        for i in range(num_pairs):
+            sample_sources_a += [matches_a[i].repeat_interleave(num_masked_non_matches_per_match),
+                                 matches_a[i].repeat_interleave(num_background_non_matches_per_match),
+                                 blind_non_matches_a[i]]
+            sample_sources_b += [matches_b[i].repeat_interleave(num_masked_non_matches_per_match),
+                                 matches_b[i].repeat_interleave(num_background_non_matches_per_match),
+                                 None]
+
+        if self._perturb_too_close:
+            samples = self._perturb(samples, sample_sources_b, counts)
+
+        results = []
+        samples_split = torch.split(samples, counts.tolist())
+        for i in range(num_pairs):
+            masked_b, background_b, blind_b = samples_split[3 * i:3 * i + 3]
+            masked_a, background_a, blind_a = sample_sources_a[3 * i:3 * i + 3]
+            if int(non_match_counts[i, 2]) == 0:
+                blind_a = blind_b = torch.LongTensor([-1])
+            results.append((masked_a, masked_b, background_a, background_b, blind_a, blind_b))
+        return results
+
+    def _perturb(self, samples, sample_sources_b, counts):
+        """
+        Moves the masked and background non-matches that are too close to their match in image b
+        by a random offset, wrapping around the image borders, as create_non_correspondences()
+        """
+        is_blind = torch.zeros(len(counts), dtype=torch.bool)
+        is_blind[2::3] = True
+        perturbable = torch.repeat_interleave(~is_blind, counts)
+        matches_b = torch.cat([s for s in sample_sources_b if s is not None])
+
+        width = self._image_width
+        samples_perturbable = samples[perturbable]
+        u = (samples_perturbable % width).float()
+        v = torch.div(samples_perturbable, width, rounding_mode="trunc").float()
+        u_match = (matches_b % width).float()
+        v_match = torch.div(matches_b, width, rounding_mode="trunc").float()
+
+        too_close = ((u_match - u).abs() < self._num_pixels_too_close) | \
+                    ((v_match - v).abs() < self._num_pixels_too_close)
+
+        num_samples = len(u)
+        minimal_perturb = self._num_pixels_too_close / 2
+        minimal_perturb_vector = (torch.rand(num_samples, generator=self._generator) * 2).floor() * \
+                                 (minimal_perturb * 2) - minimal_perturb
+        random_vector = torch.randn(num_samples, generator=self._generator) * self._perturb_std_dev + \
+                        minimal_perturb_vector
+        perturb_vector = too_close.float() * random_vector
+        u = u + perturb_vector
+        v = v + perturb_vector
+
+        # wrap around the non-matches that went out of bounds
+        upper_bound = width - 1.0
+        u = torch.where(u > upper_bound, u - upper_bound, u)
+        u = torch.where(u < 0, u + upper_bound, u)
+        upper_bound = self._image_height - 1.0
+        v = torch.where(v > upper_bound, v - upper_bound, v)
+        v = torch.where(v < 0, v + upper_bound, v)
+
+        samples = samples.clone()
+        samples[perturbable] = torch.clamp(v.long() * width + u.long(), max=self._num_pixels - 1)
+        return samples
@@ -0,0 +1,118 @@
+"""
+Pixel symmetry maps.
+
+A symmetric object (e.g. a shirt seen from the front) has, for every pixel, a
+symmetric pixel that is an equally good match. A PixelSymmetryMap gives that
+pixel as a tensor operation, on the device of its input:
+
+    - HorizontalMirror: (u, v) ---> (W - 1 - u, v), i.e. n ---> n - 2 * (n % W) + W - 1
+    - PermutationSymmetryMap: an arbitrary lookup table of H * W flat indices
+
+Flat indices are in the "single index" format for pixels, n = u + image_width * v,
+and may be offset by pair as in batch_collate.collate_image_pairs().
+"""
+
+import torch
+import numpy as np
+
+
+class PixelSymmetryMap(object):
+
+    def __init__(self, image_width, image_height=None):
+        self._image_width = image_width
+        self._image_height = image_height
+
+    @property
+    def image_width(self):
+        return self._image_width
+
+    @property
+    def image_height(self):
+        return self._image_height
+
+    def map_flat(self, indices):
+        """
+        :param indices: torch.LongTensor of flat pixel indices
+        :return: torch.LongTensor with the flat indices of the symmetric pixels, same shape and device
+        """
+        raise NotImplementedError
+
+    def map_uv(self, u, v):
+        """
+        :param u, v: int, numpy.ndarray or torch.Tensor pixel coordinates
+        :return: u, v of the symmetric pixels, of the same type
+        """
+        raise NotImplementedError
+
+    def __call__(self, indices):
+        return self.map_flat(indices)
+
+
+class HorizontalMirror(PixelSymmetryMap):
+    """
+    Mirror with respect to the vertical axis at the center of the image
+    """
+
+    def map_flat(self, indices):
+        return indices - 2 * (indices % self._image_width) + (self._image_width - 1)
+
+    def map_uv(self, u, v):
+        return self._image_width - 1 - u, v
+
+
+class PermutationSymmetryMap(PixelSymmetryMap):
+    """
+    Symmetry given by a lookup table: pixel n is symmetric to pixel lookup_table[n]
+    """
+
+    def __init__(self, lookup_table, image_width, image_height):
+        """
+        :param lookup_table: [H*W] or [H, W] flat indices, numpy.ndarray or torch.Tensor
+        """
+        super(PermutationSymmetryMap, self).__init__(image_width, image_height)
+        lookup_table = torch.as_tensor(np.asarray(lookup_table) if not isinstance(lookup_table, torch.Tensor)
+                                       else lookup_table).long().reshape(-1)
+        assert len(lookup_table) == image_width * image_height
+        self._lookup_tables = {str(lookup_table.device): lookup_table}
+        self._num_pixels = image_width * image_height
+
+    def get_lookup_table(self, device):
+        """
+        Lookup table on the given device, cached
+        """
+        device = str(device)
+        if device not in self._lookup_tables:
+            self._lookup_tables[device] = next(iter(self._lookup_tables.values())).to(device)
+        return self._lookup_tables[device]
+
+    def map_flat(self, indices):
+        lookup_table = self.get_lookup_table(indices.device)
+        offsets = indices - indices % self._num_pixels
+        return lookup_table[indices % self._num_pixels] + offsets
+
+    def map_uv(self, u, v):
+        if isinstance(u, torch.Tensor):
+            n = self.map_flat(v.long() * self._image_width + u.long())
+            return n % self._image_width, torch.div(n, self._image_width, rounding_mode="trunc")
+
+        lookup_table = self.get_lookup_table("cpu").numpy()
+        n = lookup_table[np.asarray(v, dtype=np.int64) * self._image_width + np.asarray(u, dtype=np.int64)]
+        if np.ndim(n) == 0:
+            n = int(n)
+        return n % self._image_width, n // self._image_width
+
+
+def get_symmetry_map(symmetry, image_width, image_height=None):
+    """
+    :param symmetry: False / None for no symmetry, True or "horizontal" for HorizontalMirror,
+        a PixelSymmetryMap, or a lookup table for PermutationSymmetryMap
+    :return: PixelSymmetryMap or None
+    :rtype: PixelSymmetryMap
+    """
+    if isinstance(symmetry, PixelSymmetryMap):
+        return symmetry
+    if isinstance(symmetry, (np.ndarray, torch.Tensor, list)):
+        return PermutationSymmetryMap(symmetry, image_width, image_height)
+    if not symmetry:
+        return None
+    return HorizontalMirror(image_width, image_height)
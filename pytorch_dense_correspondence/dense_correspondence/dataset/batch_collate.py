@@ -0,0 +1,88 @@
+"""
+Batching of image pairs with a different number of matches and non-matches.
+
+The default torch collate function can only stack tensors of the same size, which
+forced batch_size: 1. collate_image_pairs() stacks the images and masks of N
+pairs and concatenates all their matches and non-matches into flat index tensors.
+Each index is offset by its pair, i.e. for pair i
+
+    (u,v) ---> i * image_width * image_height + image_width * v + u
+
+so that they index the network output of the whole batch viewed as a single
+[1, N * H * W, D] image, see flatten_batch_descriptors(). With that, the pixelwise
+losses compute all the pairs of the batch in one call.
+"""
+
+import torch
+from torch.utils.data.dataloader import default_collate
+
+EMPTY_DATA = -1
+
+
+def empty_tensor():
+    """
+    Same placeholder as DenseCorrespondenceDataset.empty_tensor()
+    """
+    return torch.LongTensor([-1])
+
+
+def is_empty(tensor):
+    return (len(tensor) == 1) and (tensor[0] == -1)
+
+
+def collate_image_pairs(batch):
+    """
+    collate_fn for the torch DataLoader of a SpartanDataset, see module docstring.
+
+    :param batch: list of N tuples as returned by SpartanDataset.get_within_scene_data()
+    :return: same tuple as get_within_scene_data() with:
+        - match_type: torch.LongTensor [N]
+        - img_a, img_b: torch.FloatTensor [N, 3, H, W]
+        - img_a_mask, img_b_mask: torch.Tensor [N, H, W]
+        - matches and non-matches: flat torch.LongTensor, offset by pair. empty_tensor() if no pair has any
+        - metadata: dict, collated with the default collate function plus "num_matches", a
+          torch.LongTensor [N] with the number of matches of each pair
+    """
+    # pairs where no data could be sampled are dropped, unless all of them are empty
+    valid_batch = [sample for sample in batch if sample[0] != EMPTY_DATA]
+    if len(valid_batch) == 0:
+        return default_collate(batch)
+    batch = valid_batch
+
+    match_type = torch.LongTensor([int(sample[0]) for sample in batch])
+    img_a = torch.stack([sample[1] for sample in batch])
+    img_b = torch.stack([sample[2] for sample in batch])
+    img_a_mask = torch.stack([torch.as_tensor(sample[3]) for sample in batch])
+    img_b_mask = torch.stack([torch.as_tensor(sample[4]) for sample in batch])
+
+    image_height, image_width = img_a.shape[2:]
+    num_pixels = image_height * image_width
+
+    def concatenate(position):
+        indices = []
+        for i, sample in enumerate(batch):
+            pair_indices = sample[position]
+            if is_empty(pair_indices):
+                continue
+            indices.append(pair_indices + i * num_pixels)
+        if len(indices) == 0:
+            return empty_tensor()
+        return torch.cat(indices)
+
+    # matches, masked, background and blind non-matches, for a and b
+    indices = [concatenate(position) for position in range(5, 13)]
+
+    metadata = default_collate([sample[13] for sample in batch])
+    metadata["num_matches"] = torch.LongTensor([len(sample[5]) for sample in batch])
+
+    return (match_type, img_a, img_b, img_a_mask, img_b_mask) + tuple(indices) + (metadata,)
+
+
+def flatten_batch_descriptors(image_pred):
+    """
+    Views the network output of N images as the output of a single image, to be indexed
+    with the offset indices of collate_image_pairs()
+    :param image_pred: torch.Tensor [N, H*W, D]
+    :return: torch.Tensor [1, N*H*W, D]
+    """
+    return image_pred.reshape(1, -1, image_pred.shape[-1])
@@ -576,6 +576,9 @@ class DenseCorrespondenceDataset(data.Dataset):
 
         self._use_image_b_mask_inv = training_config["training"]["use_image_b_mask_inv"]
 
+        # fixed seed for the non-matches, None for random ones
+        self._non_match_sampler_seed = training_config["training"].get("non_match_sampler_seed", None)
+
         from spartan_dataset_masked import SpartanDatasetDataType
 
         self._data_load_types = []
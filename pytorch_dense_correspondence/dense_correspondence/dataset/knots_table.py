@@ -0,0 +1,218 @@
+"""
+Compiled, pre-indexed format of the knots annotations of a scene.
+
+knots_info.json is a dict of the form {image_id: [[u, v, depth], ...]} where
+the not visible knots are [-1, -1, -1]. KnotsTable holds the same information as
+
+    knots       int16 [num_images, num_knots, 3]   u, v, depth / DEPTH_SCALE
+    valid       bool  [num_images, num_knots]      stored as a bitmask
+    image_ids   str   [num_images]                 image_id --> row
+
+and is saved next to the json file as knots_info.npz. Finding the
+correspondences of a pair of images is then a single mask-and-gather.
+
+To convert the knots_info.json of a scene from terminal (from pytorch_dense_correspondence/):
+    python dense_correspondence/dataset/knots_table.py -s shirt_hanging
+"""
+
+import os
+import json
+import argparse
+import numpy as np
+
+KNOTS_JSON_FILENAME = 'knots_info.json'
+KNOTS_TABLE_FILENAME = 'knots_info.npz'
+
+# depth is stored in int16 as multiples of DEPTH_SCALE (i.e. up to 32.767)
+DEPTH_SCALE = 1e-3
+INVALID_KNOT = -1
+
+
+class KnotsTable(object):
+    """
+    Read-only, dict-like view of the knots of a scene: knots_table[image_id] returns
+    the [num_knots, 3] knots of that image, as knots_info.json did.
+    """
+
+    def __init__(self, knots, valid, image_ids, depth_scale=DEPTH_SCALE):
+        """
+        :param knots: int16 array of shape [num_images, num_knots, 3]
+        :param valid: bool array of shape [num_images, num_knots]
+        :param image_ids: list of str of length num_images
+        :param depth_scale: depth represented by one unit of knots[:, :, 2]
+        """
+        self._knots = knots
+        self._valid = valid
+        self._image_ids = [str(image_id) for image_id in image_ids]
+        self._row_from_image_id = {image_id: row for row, image_id in enumerate(self._image_ids)}
+        self._depth_scale = depth_scale
+        self._tensors = dict()
+
+    @staticmethod
+    def from_dict(knots_info):
+        """
+        :param knots_info: dict as read from knots_info.json
+        :type knots_info: dict()
+        :rtype: KnotsTable
+        """
+        image_ids = sorted(knots_info.keys())
+        num_knots = max([len(knots_info[image_id]) for image_id in image_ids]) if len(image_ids) > 0 else 0
+
+        knots = np.full((len(image_ids), num_knots, 3), INVALID_KNOT, dtype=np.int16)
+        valid = np.zeros((len(image_ids), num_knots), dtype=bool)
+        for row, image_id in enumerate(image_ids):
+            img_knots = np.array(knots_info[image_id], dtype=np.float64).reshape(-1, 3)
+            img_valid = img_knots[:, 0] != INVALID_KNOT
+            num_img_knots = len(img_knots)
+
+            valid[row, :num_img_knots] = img_valid
+            knots[row, :num_img_knots, 0:2][img_valid] = img_knots[img_valid, 0:2]
+            knots[row, :num_img_knots, 2][img_valid] = np.round(img_knots[img_valid, 2] / DEPTH_SCALE)
+
+        return KnotsTable(knots, valid, image_ids)
+
+    @staticmethod
+    def from_json_file(filename):
+        with open(filename, 'r') as f:
+            return KnotsTable.from_dict(json.load(f))
+
+    @staticmethod
+    def load(filename):
+        """
+        Loads a KnotsTable saved with save()
+        :rtype: KnotsTable
+        """
+        data = np.load(filename)
+        num_knots = data['knots'].shape[1]
+        valid = np.unpackbits(data['valid_bitmask'], axis=1)[:, :num_knots].astype(bool)
+        return KnotsTable(data['knots'], valid, list(data['image_ids']), float(data['depth_scale']))
+
+    def save(self, filename):
+        np.savez(filename,
+                 knots=self._knots,
+                 valid_bitmask=np.packbits(self._valid, axis=1),
+                 image_ids=np.array(self._image_ids),
+                 depth_scale=np.array(self._depth_scale))
+
+    @property
+    def knots(self):
+        return self._knots
+
+    @property
+    def valid(self):
+        return self._valid
+
+    @property
+    def image_ids(self):
+        return self._image_ids
+
+    @property
+    def num_knots(self):
+        return self._knots.shape[1]
+
+    def row(self, image_id):
+        """
+        :param image_id: e.g. cam0-0-0
+        :type image_id: str
+        :return: row of the image in the table
+        :rtype: int
+        """
+        return self._row_from_image_id[str(image_id)]
+
+    def keys(self):
+        return list(self._image_ids)
+
+    def __contains__(self, image_id):
+        return str(image_id) in self._row_from_image_id
+
+    def __iter__(self):
+        return iter(self._image_ids)
+
+    def __len__(self):
+        return len(self._image_ids)
+
+    def __getitem__(self, image_id):
+        """
+        :return: float array of shape [num_knots, 3] (u, v, depth), [-1, -1, -1] for not visible knots
+        """
+        row = self.row(image_id)
+        img_knots = self._knots[row].astype(np.float32)
+        img_knots[:, 2] *= self._depth_scale
+        img_knots[~self._valid[row]] = INVALID_KNOT
+        return img_knots
+
+    def get_uv(self, image_id):
+        """
+        :return: int16 array of shape [num_knots, 2] and bool validity array of shape [num_knots]
+        """
+        row = self.row(image_id)
+        return self._knots[row, :, 0:2], self._valid[row]
+
+    def as_tensors(self, device='cpu'):
+        """
+        The knots and validity mask as torch tensors, to be used with
+        correspondence_finder.find_pixel_correspondences_by_index(). Cached per device,
+        on the cpu they share memory with the numpy arrays.
+        :return: torch.ShortTensor [num_images, num_knots, 3], torch.BoolTensor [num_images, num_knots]
+        """
+        device = str(device)
+        if device not in self._tensors:
+            import torch
+            self._tensors[device] = (torch.from_numpy(np.ascontiguousarray(self._knots)).to(device),
+                                     torch.from_numpy(np.ascontiguousarray(self._valid)).to(device))
+        return self._tensors[device]
+
+    def find_correspondences(self, image_a_id, knots_table_b, image_b_id):
+        """
+        Knots visible in both image a (of this table) and image b (of knots_table_b).
+        Same result as correspondence_finder.batch_find_pixel_correspondences() on the json knots.
+        :return: uv_a, uv_b, each one a tuple of int64 arrays (u, v)
+        """
+        uv_a, valid_a = self.get_uv(image_a_id)
+        uv_b, valid_b = knots_table_b.get_uv(image_b_id)
+
+        num_knots = min(len(valid_a), len(valid_b))
+        valid = valid_a[:num_knots] & valid_b[:num_knots]
+        uv_a = uv_a[:num_knots][valid].astype(np.int64)
+        uv_b = uv_b[:num_knots][valid].astype(np.int64)
+        return (uv_a[:, 0], uv_a[:, 1]), (uv_b[:, 0], uv_b[:, 1])
+
+
+def get_knots_table_filename(scene_directory):
+    return os.path.join(scene_directory, 'images', KNOTS_TABLE_FILENAME)
+
+
+def load_knots_table(scene_directory):
+    """
+    Loads the knots of a scene, from the compiled knots_info.npz if there is one
+    and from knots_info.json otherwise.
+    :param scene_directory: full path to the processed folder of the scene
+    :rtype: KnotsTable
+    """
+    knots_table_filename = get_knots_table_filename(scene_directory)
+    if os.path.isfile(knots_table_filename):
+        return KnotsTable.load(knots_table_filename)
+    return KnotsTable.from_json_file(os.path.join(scene_directory, 'images', KNOTS_JSON_FILENAME))
+
+
+def convert_knots_info(scene_directory):
+    """
+    Compiles the knots_info.json of a scene into knots_info.npz
+    :param scene_directory: full path to the processed folder of the scene
+    :return: filename of the compiled knots
+    """
+    knots_table = KnotsTable.from_json_file(os.path.join(scene_directory, 'images', KNOTS_JSON_FILENAME))
+    knots_table_filename = get_knots_table_filename(scene_directory)
+    knots_table.save(knots_table_filename)
+    print("Knots of %d images compiled at %s" % (len(knots_table), knots_table_filename))
+    return knots_table_filename
+
+
+if __name__ == '__main__':
+    argParser = argparse.ArgumentParser()
+    argParser.add_argument("-s", "--scene_name", help="name of the scene")
+    argParser.add_argument("-l", "--logs_root_path", default='pdc/logs_proto',
+                           help="folder holding the scenes")
+    args = argParser.parse_args()
+
+    convert_knots_info(os.path.join(os.getcwd(), args.logs_root_path, args.scene_name, 'processed'))
@@ -0,0 +1,220 @@
+"""
+Packed, memory-mapped storage of the processed scenes.
+
+pack_scene() converts a logs_proto/<scene>/processed folder (rgb, image_masks,
+depth_values and knots_info.json) into a single folder
+
+    <scene>/processed/packed/
+        rgb.bin     uint8   [num_images, H, W, 3]
+        mask.bin    uint8   [num_images, H, W]
+        depth.bin   float16 [num_images, H, W(, C)]
+        index.json  image id --> row, shapes, dtypes and the knots info
+
+PackedScene then serves the images as zero-copy numpy views of the memory
+mapped files, so that the dataset does not need to decode any PNG/EXR file
+at training time.
+
+To pack a scene from terminal (from pytorch_dense_correspondence/):
+    python dense_correspondence/dataset/scene_store.py -s shirt_hanging
+"""
+
+import os
+import glob
+import json
+import argparse
+import numpy as np
+from PIL import Image
+
+os.environ["OPENCV_IO_ENABLE_OPENEXR"] = "1"
+
+PACKED_FOLDER_NAME = 'packed'
+INDEX_FILENAME = 'index.json'
+
+RGB_DTYPE = np.uint8
+MASK_DTYPE = np.uint8
+DEPTH_DTYPE = np.float16
+
+
+def get_packed_directory(scene_directory):
+    """
+    :param scene_directory: full path to the processed folder of the scene
+    :return: full path to the folder holding the packed scene
+    """
+    return os.path.join(scene_directory, PACKED_FOLDER_NAME)
+
+
+def is_packed(scene_directory):
+    return os.path.isfile(os.path.join(get_packed_directory(scene_directory), INDEX_FILENAME))
+
+
+def get_image_ids(scene_directory):
+    """
+    Image ids of a scene (e.g. cam0-0-0), taken from the rgb images
+    :param scene_directory: full path to the processed folder of the scene
+    :return: sorted list of str
+    """
+    rgb_filenames = glob.glob(os.path.join(scene_directory, 'images', 'rgb-*.png'))
+    return sorted([os.path.basename(f)[len('rgb-'):-len('.png')] for f in rgb_filenames])
+
+
+def pack_scene(scene_directory, verbose=True):
+    """
+    Packs all the images of a scene into memory-mapped files plus an index.
+
+    :param scene_directory: full path to the processed folder of the scene
+    :type scene_directory: str
+    :return: full path to the folder holding the packed scene
+    :rtype: str
+    """
+    import cv2
+
+    image_ids = get_image_ids(scene_directory)
+    if len(image_ids) == 0:
+        raise ValueError("no rgb images found in %s" % scene_directory)
+
+    def rgb_filename(image_id):
+        return os.path.join(scene_directory, 'images', 'rgb-%s.png' % image_id)
+
+    def mask_filename(image_id):
+        return os.path.join(scene_directory, 'image_masks', 'mask-%s.png' % image_id)
+
+    def depth_filename(image_id):
+        return os.path.join(scene_directory, 'depth_values', 'depth-%s.exr' % image_id)
+
+    def read_depth(image_id):
+        return cv2.imread(depth_filename(image_id), cv2.IMREAD_ANYCOLOR | cv2.IMREAD_ANYDEPTH)
+
+    num_images = len(image_ids)
+    height, width, _ = np.asarray(Image.open(rgb_filename(image_ids[0])).convert('RGB')).shape
+    depth_shape = read_depth(image_ids[0]).shape
+
+    packed_directory = get_packed_directory(scene_directory)
+    if not os.path.isdir(packed_directory):
+        os.makedirs(packed_directory)
+
+    # the index is written last, so a crashed packing never looks complete
+    index_filename = os.path.join(packed_directory, INDEX_FILENAME)
+    if os.path.isfile(index_filename):
+        os.remove(index_filename)
+
+    rgb = np.memmap(os.path.join(packed_directory, 'rgb.bin'), dtype=RGB_DTYPE, mode='w+',
+                    shape=(num_images, height, width, 3))
+    mask = np.memmap(os.path.join(packed_directory, 'mask.bin'), dtype=MASK_DTYPE, mode='w+',
+                     shape=(num_images, height, width))
+    depth = np.memmap(os.path.join(packed_directory, 'depth.bin'), dtype=DEPTH_DTYPE, mode='w+',
+                      shape=(num_images,) + depth_shape)
+
+    for row, image_id in enumerate(image_ids):
+        rgb[row] = np.asarray(Image.open(rgb_filename(image_id)).convert('RGB'))
+        mask[row] = np.asarray(Image.open(mask_filename(image_id)).convert('L'))
+        depth[row] = read_depth(image_id)
+        if verbose and row % 100 == 0:
+            print("Packed %d/%d images of %s" % (row + 1, num_images, scene_directory))
+
+    rgb.flush()
+    mask.flush()
+    depth.flush()
+
+    knots_info_filename = os.path.join(scene_directory, 'images', 'knots_info.json')
+    knots_info = None
+    if os.path.isfile(knots_info_filename):
+        with open(knots_info_filename, 'r') as f:
+            knots_info = json.load(f)
+
+    index = dict()
+    index['image_ids'] = image_ids
+    index['rgb_shape'] = [num_images, height, width, 3]
+    index['mask_shape'] = [num_images, height, width]
+    index['depth_shape'] = [num_images] + list(depth_shape)
+    index['rgb_dtype'] = np.dtype(RGB_DTYPE).name
+    index['mask_dtype'] = np.dtype(MASK_DTYPE).name
+    index['depth_dtype'] = np.dtype(DEPTH_DTYPE).name
+    index['knots_info'] = knots_info
+    with open(index_filename, 'w') as f:
+        json.dump(index, f)
+
+    if verbose:
+        print("Scene %s packed at %s" % (scene_directory, packed_directory))
+    return packed_directory
+
+
+class PackedScene(object):
+    """
+    Read-only access to a scene packed with pack_scene(). All the images are
+    returned as numpy views of the memory-mapped files (no copy, no decoding).
+    The files are mapped lazily so that every DataLoader worker maps its own.
+    """
+
+    def __init__(self, scene_directory):
+        self._packed_directory = get_packed_directory(scene_directory)
+        with open(os.path.join(self._packed_directory, INDEX_FILENAME), 'r') as f:
+            self._index = json.load(f)
+
+        self._image_ids = self._index['image_ids']
+        self._row_from_image_id = {image_id: row for row, image_id in enumerate(self._image_ids)}
+        self._rgb = None
+        self._mask = None
+        self._depth = None
+
+    def _open(self, name):
+        return np.memmap(os.path.join(self._packed_directory, '%s.bin' % name),
+                         dtype=np.dtype(self._index['%s_dtype' % name]), mode='r',
+                         shape=tuple(self._index['%s_shape' % name]))
+
+    @property
+    def image_ids(self):
+        return self._image_ids
+
+    @property
+    def knots_info(self):
+        return self._index['knots_info']
+
+    @property
+    def num_images(self):
+        return len(self._image_ids)
+
+    def row(self, img_idx):
+        """
+        :param img_idx: image id, e.g. cam0-0-0
+        :type img_idx: str or int
+        :return: row of the image in the packed arrays
+        :rtype: int
+        """
+        try:
+            return self._row_from_image_id[str(img_idx)]
+        except KeyError:
+            raise ValueError("image %s is not in packed scene %s" % (img_idx, self._packed_directory))
+
+    def get_rgb(self, img_idx):
+        """
+        :return: uint8 numpy array of shape [H, W, 3]
+        """
+        if self._rgb is None:
+            self._rgb = self._open('rgb')
+        return self._rgb[self.row(img_idx)]
+
+    def get_mask(self, img_idx):
+        """
+        :return: uint8 numpy array of shape [H, W]
+        """
+        if self._mask is None:
+            self._mask = self._open('mask')
+        return self._mask[self.row(img_idx)]
+
+    def get_depth(self, img_idx):
+        """
+        :return: float16 numpy array with the shape of the stored depth image
+        """
+        if self._depth is None:
+            self._depth = self._open('depth')
+        return self._depth[self.row(img_idx)]
+
+
+if __name__ == '__main__':
+    argParser = argparse.ArgumentParser()
+    argParser.add_argument("-s", "--scene_name", help="name of the scene")
+    argParser.add_argument("-l", "--logs_root_path", default='pdc/logs_proto',
+                           help="folder holding the scenes")
+    args = argParser.parse_args()
+
+    pack_scene(os.path.join(os.getcwd(), args.logs_root_path, args.scene_name, 'processed'))
@@ -14,6 +14,9 @@ from torchvision import transforms
 utils.add_dense_correspondence_to_python_path()
 import dense_correspondence.correspondence_tools.correspondence_finder as correspondence_finder
 import dense_correspondence.correspondence_tools.correspondence_augmentation as correspondence_augmentation
+import dense_correspondence.dataset.scene_store as scene_store
+from dense_correspondence.dataset.knots_table import KnotsTable, load_knots_table
+from dense_correspondence.correspondence_tools.non_match_sampler import NonMatchSampler
 
 
 class SpartanDatasetDataType:
@@ -24,8 +27,14 @@ class SpartanDatasetDataType:
     SYNTHETIC_MULTI_OBJECT = 4
 
 
+class SpartanDatasetStorageBackend:
+    FILES = "files"  # one png/exr file per image, see get_image_filename()
+    PACKED = "packed"  # memory-mapped scenes, see scene_store.pack_scene()
+
+
 class SpartanDataset(DenseCorrespondenceDataset):
     PADDED_STRING_WIDTH = 6
+    CANONICAL_SCENE_NAME = 'shirt_canonical'
 
     def __init__(self, debug=False, mode="train", config=None, config_expanded=None):
         """
@@ -73,7 +82,12 @@ class SpartanDataset(DenseCorrespondenceDataset):
 
         self._pose_data = dict()
         self._knots_info = dict()
+        self._packed_scenes = dict()
+        self._canonical_image_cache = dict()
+        self._non_match_sampler = None
+        self._non_match_sampler_seed = None
         self._image_index_sample_range = None
+        self.set_storage_backend(self._config.get("storage_backend", SpartanDatasetStorageBackend.FILES))
         self._initialize_rgb_image_to_tensor()
 
         if mode == "test":
@@ -158,6 +172,7 @@ class SpartanDataset(DenseCorrespondenceDataset):
         self._config["logs_root_path"] = config['logs_root_path']
         self._config["single_object"] = self._single_object_scene_dict
         self._config["multi_object"] = self._multi_object_scene_dict
+        self._config["storage_backend"] = config.get("storage_backend", SpartanDatasetStorageBackend.FILES)
 
         self._setup_data_load_types()
 
@@ -260,12 +275,37 @@ class SpartanDataset(DenseCorrespondenceDataset):
         return self._pose_data[scene_name]
 
     def get_knots_info(self, scene_name):
+        """
+        Checks if the knots of this scene have already been loaded, if not then loads them
+        (from knots_info.npz if the scene has one, otherwise from knots_info.json).
+        :type scene_name: str
+        :return: dict-like table, knots_info[image_idx] is a [num_knots, 3] array
+        :rtype: KnotsTable
+        """
+        if scene_name not in self._knots_info and self._storage_backend == SpartanDatasetStorageBackend.PACKED:
+            knots_info = self.get_packed_scene(scene_name).knots_info
+            if knots_info is not None:
+                self._knots_info[scene_name] = KnotsTable.from_dict(knots_info)
+
         if scene_name not in self._knots_info:
             logging.info("Loading knots info for scene %s" % (scene_name))
-            knots_info_filename = os.path.join(self.get_full_path_for_scene(scene_name), 'images', 'knots_info.json')
-            self._knots_info[scene_name] = utils.getDictFromJSONFilename(knots_info_filename)
+            self._knots_info[scene_name] = load_knots_table(self.get_full_path_for_scene(scene_name))
         return self._knots_info[scene_name]
 
+    def find_pixel_correspondences(self, scene_name_a, image_a_idx, scene_name_b, image_b_idx):
+        """
+        Pixel correspondences between two images given by the knots visible in both of them
+        :return: uv_a, uv_b, each one a tuple of torch.LongTensor (u, v)
+        """
+        knots_a = self.get_knots_info(scene_name_a)
+        knots_b = self.get_knots_info(scene_name_b)
+        knots_tensor_a, valid_a = knots_a.as_tensors()
+        knots_tensor_b, valid_b = knots_b.as_tensors()
+        return correspondence_finder.find_pixel_correspondences_by_index(knots_tensor_a, valid_a,
+                                                                         knots_a.row(image_a_idx),
+                                                                         knots_tensor_b, valid_b,
+                                                                         knots_b.row(image_b_idx))
+
     def get_pose_from_scene_name_and_idx(self, scene_name, idx):
         """
         :param scene_name: str
@@ -276,6 +316,81 @@ class SpartanDataset(DenseCorrespondenceDataset):
         pose_data = scene_pose_data[idx]['camera_to_world']
         return utils.homogenous_transform_from_dict(pose_data)
 
+    def set_storage_backend(self, storage_backend):
+        """
+        Selects where images are read from
+        :param storage_backend: one of SpartanDatasetStorageBackend. PACKED needs the scenes
+            to be packed beforehand with scene_store.pack_scene()
+        :type storage_backend: str
+        """
+        if storage_backend not in [SpartanDatasetStorageBackend.FILES, SpartanDatasetStorageBackend.PACKED]:
+            raise ValueError("unsupported storage backend %s" % storage_backend)
+        self._storage_backend = storage_backend
+
+    @property
+    def storage_backend(self):
+        return self._storage_backend
+
+    def get_packed_scene(self, scene_name):
+        """
+        Checks if the packed scene has already been opened, if not then opens it.
+        :type scene_name: str
+        :rtype: scene_store.PackedScene
+        """
+        if scene_name not in self._packed_scenes:
+            scene_directory = self.get_full_path_for_scene(scene_name)
+            if not scene_store.is_packed(scene_directory):
+                raise ValueError("scene_name = %s hasn't been packed, run scene_store.pack_scene() first"
+                                 % (scene_name))
+            self._packed_scenes[scene_name] = scene_store.PackedScene(scene_directory)
+        return self._packed_scenes[scene_name]
+
+    def get_rgbd_mask_pose(self, scene_name, img_idx):
+        """
+        Returns rgb image, depth image, mask and pose.
+        With the packed storage backend the images are read-only numpy views of the
+        memory-mapped scene instead of PIL images.
+        :rtype: PIL.Image.Image or np.ndarray (uint8 [H,W,3]), np.ndarray (depth),
+            PIL.Image.Image or np.ndarray (uint8 [H,W]), None
+        """
+        if self._storage_backend == SpartanDatasetStorageBackend.FILES:
+            return DenseCorrespondenceDataset.get_rgbd_mask_pose(self, scene_name, img_idx)
+
+        packed_scene = self.get_packed_scene(scene_name)
+        rgb = packed_scene.get_rgb(img_idx)
+        depth = packed_scene.get_depth(img_idx)
+        mask = packed_scene.get_mask(img_idx)
+        pose = None
+        return rgb, depth, mask, pose
+
+    def get_rgb_mask(self, scene_name, img_idx):
+        """
+        Returns rgb image and mask, see get_rgbd_mask_pose()
+        """
+        if self._storage_backend == SpartanDatasetStorageBackend.FILES:
+            return DenseCorrespondenceDataset.get_rgb_mask(self, scene_name, img_idx)
+
+        packed_scene = self.get_packed_scene(scene_name)
+        return packed_scene.get_rgb(img_idx), packed_scene.get_mask(img_idx)
+
+    def get_canonical_image_data(self, img_idx):
+        """
+        Decoded rgb image, rgb tensor and mask of an image of the canonical scene. They are
+        read once and kept in memory, since the images b of every canonical comparison
+        come from that scene.
+        :param img_idx: image index of the canonical scene
+        :return: rgb, rgb_tensor, mask
+        :rtype: PIL.Image.Image or np.ndarray, torch.FloatTensor [3,H,W], np.ndarray [H,W]
+        """
+        img_idx = str(img_idx)
+        if img_idx not in self._canonical_image_cache:
+            rgb, mask = self.get_rgb_mask(SpartanDataset.CANONICAL_SCENE_NAME, img_idx)
+            self._canonical_image_cache[img_idx] = (rgb, self.rgb_image_to_tensor(rgb), np.array(mask))
+        return self._canonical_image_cache[img_idx]
+
+    def clear_canonical_image_cache(self):
+        self._canonical_image_cache = dict()
+
     def get_image_filename(self, scene_name, img_index, image_type):
         """
         Get the image filename for that scene and image index
@@ -538,53 +653,41 @@ class SpartanDataset(DenseCorrespondenceDataset):
 
         image_a_idx = self.get_random_image_index(scene_name)
         image_a_rgb, image_a_mask = self.get_rgb_mask(scene_name, image_a_idx)
-        img_a_knots = self._knots_info[scene_name][str(image_a_idx)]
         
         if canonical_comparison:
-            image_b_idx = self.get_random_image_index('shirt_canonical')
-            image_b_rgb, image_b_mask = self.get_rgb_mask('shirt_canonical', image_b_idx)
-            img_b_knots = self._knots_info['shirt_canonical'][str(image_b_idx)]
+            scene_name_b = SpartanDataset.CANONICAL_SCENE_NAME
+        else:
+            scene_name_b = scene_name
+        image_b_idx = self.get_random_image_index(scene_name_b)
+        image_b_rgb_tensor = None
+        if canonical_comparison:
+            image_b_rgb, image_b_rgb_tensor, image_b_mask = self.get_canonical_image_data(image_b_idx)
         else:
-            image_b_idx = self.get_random_image_index(scene_name)
-            image_b_rgb, image_b_mask = self.get_rgb_mask(scene_name, image_b_idx)
-            img_b_knots = self._knots_info[scene_name][str(image_b_idx)]
+            image_b_rgb, image_b_mask = self.get_rgb_mask(scene_name_b, image_b_idx)
         metadata['image_b_idx'] = image_b_idx
 
         # find correspondences
-        uv_a, uv_b = correspondence_finder.batch_find_pixel_correspondences(img_a_knots, img_b_knots)
+        uv_a, uv_b = self.find_pixel_correspondences(scene_name, image_a_idx, scene_name_b, image_b_idx)
 
         # data augmentation
         # TODO (ASP): data augmentation
         if self._domain_randomize:
             image_a_rgb = correspondence_augmentation.random_domain_randomize_background(image_a_rgb, image_a_mask)
-            image_b_rgb = correspondence_augmentation.random_domain_randomize_background(image_b_rgb, image_b_mask)
+            image_b_rgb_randomized = correspondence_augmentation.random_domain_randomize_background(image_b_rgb,
+                                                                                                    image_b_mask)
+            if image_b_rgb_randomized is not image_b_rgb:
+                image_b_rgb, image_b_rgb_tensor = image_b_rgb_randomized, None
 
         # find non_correspondences
-        image_b_mask_torch = torch.from_numpy(np.array(image_b_mask)).type(torch.FloatTensor)
         image_height, image_width, _ = np.array(image_a_rgb).shape
-        image_b_shape = (image_height, image_width)
-        
-
-        uv_b_masked_non_matches = \
-            correspondence_finder.create_non_correspondences(uv_b, image_b_shape,
-                                                             num_non_matches_per_match=self.num_masked_non_matches_per_match,
-                                                             img_b_mask=image_b_mask_torch)
-
-        if self._use_image_b_mask_inv:
-            image_b_mask_inv = 1 - image_b_mask_torch
-        else:
-            image_b_mask_inv = None
-
-        uv_b_background_non_matches = \
-            correspondence_finder.create_non_correspondences(uv_b, image_b_shape,
-                                                             num_non_matches_per_match=self.num_background_non_matches_per_match,
-                                                             img_b_mask=image_b_mask_inv)
 
         # convert PIL.Image to torch.FloatTensor
         image_a_rgb_PIL = image_a_rgb
         image_b_rgb_PIL = image_b_rgb
         image_a_rgb = self.rgb_image_to_tensor(image_a_rgb)
-        image_b_rgb = self.rgb_image_to_tensor(image_b_rgb)
+        if image_b_rgb_tensor is None:
+            image_b_rgb_tensor = self.rgb_image_to_tensor(image_b_rgb)
+        image_b_rgb = image_b_rgb_tensor
         
         image_a_mask = np.array(image_a_mask)
         image_b_mask = np.array(image_b_mask)
@@ -592,72 +695,39 @@ class SpartanDataset(DenseCorrespondenceDataset):
         matches_a = SD.flatten_uv_tensor(uv_a, image_width, image_height)
         matches_b = SD.flatten_uv_tensor(uv_b, image_width, image_height)
 
-        # Masked non-matches
-        uv_a_masked_long, uv_b_masked_non_matches_long = \
-            self.create_non_matches(uv_a, uv_b_masked_non_matches, self.num_masked_non_matches_per_match)
-
-        masked_non_matches_a = SD.flatten_uv_tensor(uv_a_masked_long, image_width, image_height).squeeze(1)
-        masked_non_matches_b = SD.flatten_uv_tensor(uv_b_masked_non_matches_long, image_width, image_height).squeeze(1)
-
-        # Non-masked non-matches
-        uv_a_background_long, uv_b_background_non_matches_long = \
-            self.create_non_matches(uv_a, uv_b_background_non_matches, self.num_background_non_matches_per_match)
-
-        background_non_matches_a = SD.flatten_uv_tensor(uv_a_background_long, image_width, image_height).squeeze(1)
-        background_non_matches_b = SD.flatten_uv_tensor(uv_b_background_non_matches_long, image_width, image_height).squeeze(1)
-
-        # Blind non matches
-        matches_a_mask = SD.mask_image_from_uv_flat_tensor(matches_a, image_width, image_height)
-        image_a_mask_torch = torch.from_numpy(np.array(image_a_mask)).long()
-        mask_a_flat = image_a_mask_torch.view(-1, 1).squeeze(1)
-        blind_non_matches_a = (mask_a_flat - matches_a_mask).nonzero()
-
-        no_blind_matches_found = False
-        if len(blind_non_matches_a) == 0:
-            no_blind_matches_found = True
-        else:
-
-            blind_non_matches_a = blind_non_matches_a.squeeze(1)
-            num_blind_samples = blind_non_matches_a.size()[0]
-
-            if num_blind_samples > 0:
-                # blind_uv_b is a tuple of torch.LongTensor
-                # make sure we check that blind_uv_b is not None and that it is non-empty
-
-                blind_uv_b = correspondence_finder.random_sample_from_masked_image_torch(image_b_mask_torch,
-                                                                                         num_blind_samples)
-
-                if blind_uv_b[0] is None:
-                    no_blind_matches_found = True
-                elif len(blind_uv_b[0]) == 0:
-                    no_blind_matches_found = True
-                else:
-                    blind_non_matches_b = utils.uv_to_flattened_pixel_locations(blind_uv_b, image_width)
-
-                    if len(blind_non_matches_b) == 0:
-                        no_blind_matches_found = True
-            else:
-                no_blind_matches_found = True
-
-        if no_blind_matches_found:
-            blind_non_matches_a = blind_non_matches_b = SD.empty_tensor()
+        masked_non_matches_a, masked_non_matches_b, background_non_matches_a, background_non_matches_b, \
+        blind_non_matches_a, blind_non_matches_b = \
+            self.get_non_match_sampler(image_width, image_height).sample(
+                matches_a, matches_b, image_a_mask, image_b_mask,
+                self.num_masked_non_matches_per_match, self.num_background_non_matches_per_match,
+                use_image_b_mask_inv=self._use_image_b_mask_inv,
+                key_a=(scene_name, str(image_a_idx)), key_b=(scene_name_b, str(image_b_idx)))
 
         if self.debug:
             # downsample so can plot
             num_matches_to_plot = 7
             plot_uv_a, plot_uv_b = SD.subsample_tuple_pair(uv_a, uv_b, num_samples=num_matches_to_plot)
 
+            uv_a_masked_long = utils.flattened_pixel_locations_to_u_v(masked_non_matches_a, image_width)
+            uv_b_masked_non_matches_long = utils.flattened_pixel_locations_to_u_v(masked_non_matches_b, image_width)
             plot_uv_a_masked_long, plot_uv_b_masked_non_matches_long = SD.subsample_tuple_pair(uv_a_masked_long,
                                                                                                uv_b_masked_non_matches_long,
                                                                                                num_samples=num_matches_to_plot * 3)
 
+            uv_a_background_long = utils.flattened_pixel_locations_to_u_v(background_non_matches_a, image_width)
+            uv_b_background_non_matches_long = utils.flattened_pixel_locations_to_u_v(background_non_matches_b,
+                                                                                       image_width)
             plot_uv_a_background_long, plot_uv_b_background_non_matches_long = SD.subsample_tuple_pair(
                 uv_a_background_long, uv_b_background_non_matches_long, num_samples=num_matches_to_plot * 3)
 
             blind_uv_a = utils.flattened_pixel_locations_to_u_v(blind_non_matches_a, image_width)
+            blind_uv_b = utils.flattened_pixel_locations_to_u_v(blind_non_matches_b, image_width)
             plot_blind_uv_a, plot_blind_uv_b = SD.subsample_tuple_pair(blind_uv_a, blind_uv_b,
                                                                        num_samples=num_matches_to_plot * 10)
 
+            matches_a_mask = SD.mask_image_from_uv_flat_tensor(matches_a, image_width, image_height)
+            mask_a_flat = torch.from_numpy(image_a_mask).long().view(-1)
+
         if self.debug:
             # only want to bring in plotting code if in debug mode
             import dense_correspondence.correspondence_tools.correspondence_plotter as correspondence_plotter
@@ -715,6 +785,26 @@ class SpartanDataset(DenseCorrespondenceDataset):
                masked_non_matches_a, masked_non_matches_b, background_non_matches_a, background_non_matches_b, \
                blind_non_matches_a, blind_non_matches_b, metadata
 
+    def get_non_match_sampler(self, image_width, image_height):
+        """
+        Creates the non-match sampler the first time it is needed. It caches the
+        foreground/background pixels of every image it sees.
+        :rtype: NonMatchSampler
+        """
+        if self._non_match_sampler is None:
+            self._non_match_sampler = NonMatchSampler(image_width, image_height, seed=self._non_match_sampler_seed)
+        return self._non_match_sampler
+
+    def set_non_match_sampler_seed(self, seed):
+        """
+        Fixes the seed of the non-match sampling, to get reproducible non-matches.
+        Note that with num_workers > 0 every DataLoader worker starts from this same seed
+        :param seed: int, or None for random non-matches
+        """
+        self._non_match_sampler_seed = seed
+        if self._non_match_sampler is not None:
+            self._non_match_sampler.set_seed(seed)
+
     def create_non_matches(self, uv_a, uv_b_non_matches, multiplier):
         """
         Simple wrapper for repeated code
@@ -974,7 +1064,10 @@ class SpartanDataset(DenseCorrespondenceDataset):
         # data augmentation
         if self._domain_randomize:
             image_a_rgb = correspondence_augmentation.random_domain_randomize_background(image_a_rgb, image_a_mask)
-            image_b_rgb = correspondence_augmentation.random_domain_randomize_background(image_b_rgb, image_b_mask)
+            image_b_rgb_randomized = correspondence_augmentation.random_domain_randomize_background(image_b_rgb,
+                                                                                                    image_b_mask)
+            if image_b_rgb_randomized is not image_b_rgb:
+                image_b_rgb, image_b_rgb_tensor = image_b_rgb_randomized, None
 
         if not self.debug:
             [image_a_rgb, image_a_mask], blind_uv_a = correspondence_augmentation.random_image_and_indices_mutation(
@@ -1120,7 +1213,7 @@ class SpartanDataset(DenseCorrespondenceDataset):
         return uv_a_downsampled, uv_b_downsampled
     
     def mesh_distance(self, idx1, idx2, image_width, x_symmetry=False):
-        knots = self.get_knots_info('shirt_canonical')['cam3-0-0']
+        knots = self.get_knots_info(SpartanDataset.CANONICAL_SCENE_NAME)['cam3-0-0']
         p1 = np.array(knots[idx1])
         p2 = np.array(knots[idx2])
         if not x_symmetry:
@@ -0,0 +1,270 @@
+"""
+Frozen evaluation benchmark: image pairs, ground truth matches and masks sampled once.
+
+The evaluators used to draw random scenes, image pairs and matches on every call
+and to recompute the matches from the knots of the dataset. build_benchmark_set()
+samples them once, with a seed, as DenseCorrespondenceEvaluation.evaluate_network()
+does, and saves them in a single compressed .npz file:
+
+    scene_names, img_a_idxs, img_b_idxs   [P] the image pairs
+    row_a, row_b                          [P] rows of images a and b in masks / images
+    image_keys                            [U] "<scene_name>/<img_idx>" of the U distinct images
+    matches                               [M, 5] pair, u_a, v_a, u_b, v_b, uv_b clipped to the image
+    masks                                 [U, ceil(H * W / 8)] masks, bit-packed
+    images_filename                       (optional) name of the images file, see below
+
+The decoded images, if included, are stored uncompressed next to it, in
+<name>_images.npy ([U, H, W, 3] uint8 RGB), and memory-mapped when loaded, so that
+the processes of a checkpoint sweep share them instead of each one decompressing them.
+
+The evaluators (evaluate_network, evaluate_match_quality, get_random_scenes_and_image_pairs,
+checkpoint_sweep.run_sweep, ...) take a BenchmarkSet instead of sampling, so that all
+the runs are evaluated on the same matches.
+
+To build a benchmark set from terminal (from pytorch_dense_correspondence):
+    python dense_correspondence/evaluation/benchmark_set.py <model_folder> benchmark_test.npz --split test
+"""
+
+import os
+import random
+import argparse
+from collections import namedtuple
+
+import numpy as np
+
+import dense_correspondence_manipulation.utils.utils as utils
+
+utils.add_dense_correspondence_to_python_path()
+import dense_correspondence.correspondence_tools.correspondence_finder as correspondence_finder
+
+CANONICAL_SCENE_NAME = "shirt_canonical"
+
+BenchmarkPair = namedtuple("BenchmarkPair", ["pair_idx", "scene_name", "img_a_idx", "img_b_idx",
+                                             "row_a", "row_b", "uv_a", "uv_b"])
+
+
+def build_benchmark_set(dataset, filename, num_image_pairs=100, num_matches_per_image_pair=100, seed=1,
+                        include_images=False):
+    """
+    Samples the image pairs and their ground truth matches and saves them to filename
+
+    :type dataset: SpartanDataset
+    :param include_images: also store the decoded RGB images (in <filename>_images.npy), e.g.
+        for checkpoint sweeps
+    :return: the benchmark set
+    :rtype: BenchmarkSet
+    """
+    from dense_correspondence.evaluation.evaluation import DenseCorrespondenceEvaluation
+
+    DCE = DenseCorrespondenceEvaluation
+    random.seed(seed)
+    np.random.seed(seed)
+
+    image_keys, images, masks = [], [], []
+    image_rows = dict()
+
+    def get_image_row(scene_name, img_idx):
+        key = "%s/%s" % (scene_name, img_idx)
+        if key not in image_rows:
+            rgb, mask = dataset.get_rgb_mask(scene_name, img_idx)
+            image_rows[key] = len(image_keys)
+            image_keys.append(key)
+            masks.append(np.asarray(mask))
+            if include_images:
+                images.append(np.asarray(rgb, dtype=np.uint8))
+        return image_rows[key]
+
+    scene_names, img_a_idxs, img_b_idxs, rows_a, rows_b, matches = [], [], [], [], [], []
+    for _ in range(num_image_pairs):
+        scene_name = dataset.get_random_scene_name()
+        idx_pair = DCE.get_image_pair_random(dataset, scene_name)
+        if idx_pair is None:
+            continue
+        img_a_idx, img_b_idx = idx_pair
+        knots_a = dataset.get_knots_info(scene_name)[str(img_a_idx)]
+        knots_b = dataset.get_knots_info(CANONICAL_SCENE_NAME)[str(img_b_idx)]
+        uv_a_vec, uv_b_vec = correspondence_finder.find_pixel_correspondences(knots_a, knots_b)
+        if uv_a_vec is None or len(uv_a_vec[0]) == 0:
+            continue
+
+        pair_idx = len(scene_names)
+        rows_a.append(get_image_row(scene_name, img_a_idx))
+        rows_b.append(get_image_row(CANONICAL_SCENE_NAME, img_b_idx))
+        image_height, image_width = masks[rows_b[-1]].shape
+        total_num_matches = len(uv_a_vec[0])
+        match_list = random.sample(range(0, total_num_matches), min(num_matches_per_image_pair, total_num_matches))
+        for i in match_list:
+            u_b, v_b = DCE.clip_pixel_to_image_size_and_round(
+                (uv_b_vec[0][i], uv_b_vec[1][i]), image_width, image_height)
+            matches.append((pair_idx, int(uv_a_vec[0][i]), int(uv_a_vec[1][i]), u_b, v_b))
+        scene_names.append(scene_name)
+        img_a_idxs.append(img_a_idx)
+        img_b_idxs.append(img_b_idx)
+
+    if len(scene_names) == 0:
+        raise ValueError("no image pair with matches found in %d tries, no benchmark set to save"
+                         % (num_image_pairs))
+
+    mask_shape = masks[0].shape
+    arrays = dict(scene_names=np.asarray(scene_names), img_a_idxs=np.asarray(img_a_idxs),
+                  img_b_idxs=np.asarray(img_b_idxs), row_a=np.asarray(rows_a, dtype=np.int64),
+                  row_b=np.asarray(rows_b, dtype=np.int64), image_keys=np.asarray(image_keys),
+                  matches=np.asarray(matches, dtype=np.int64).reshape(-1, 5),
+                  masks=np.stack([np.packbits(np.asarray(mask).ravel() != 0) for mask in masks]),
+                  mask_shape=np.asarray(mask_shape, dtype=np.int64),
+                  seed=np.asarray(seed), num_matches_per_image_pair=np.asarray(num_matches_per_image_pair),
+                  image_mean=np.asarray(dataset.get_image_mean(), dtype=np.float64),
+                  image_std_dev=np.asarray(dataset.get_image_std_dev(), dtype=np.float64))
+
+    if not filename.endswith(".npz"):
+        filename += ".npz"
+    if not os.path.isdir(os.path.dirname(os.path.abspath(filename))):
+        os.makedirs(os.path.dirname(os.path.abspath(filename)))
+    if include_images:
+        images_filename = get_images_filename(filename)
+        np.save(images_filename, np.stack(images))
+        arrays["images_filename"] = np.asarray(os.path.basename(images_filename))
+    np.savez_compressed(filename, **arrays)
+    print("saved %d image pairs, %d images, %d matches in %s" % (len(scene_names), len(image_keys),
+                                                                len(matches), filename))
+    return BenchmarkSet(filename)
+
+
+def get_images_filename(filename):
+    """
+    :param filename: .npz file of the benchmark set
+    :return: the .npy file of its images
+    """
+    return os.path.splitext(filename)[0] + "_images.npy"
+
+
+class BenchmarkSet(object):
+
+    def __init__(self, filename):
+        """
+        :param filename: .npz file written by build_benchmark_set()
+        """
+        self._filename = filename
+        with np.load(filename) as data:
+            self._arrays = {key: data[key] for key in data.files}
+        matches = self._arrays["matches"]
+        # matches are sorted by pair
+        self._match_slices = np.searchsorted(matches[:, 0], np.arange(self.num_pairs + 1))
+        self._masks = dict()
+        self._images = None
+        if "images_filename" in self._arrays:
+            images_filename = os.path.join(os.path.dirname(filename), str(self._arrays["images_filename"]))
+            self._images = np.load(images_filename, mmap_mode="r")
+
+    @property
+    def filename(self):
+        return self._filename
+
+    @property
+    def num_pairs(self):
+        return len(self._arrays["scene_names"])
+
+    @property
+    def num_matches(self):
+        return len(self._arrays["matches"])
+
+    @property
+    def has_images(self):
+        return self._images is not None
+
+    @property
+    def image_mean(self):
+        return self._arrays["image_mean"].tolist()
+
+    @property
+    def image_std_dev(self):
+        return self._arrays["image_std_dev"].tolist()
+
+    def __len__(self):
+        return self.num_pairs
+
+    def get_pair(self, pair_idx):
+        """
+        :return: BenchmarkPair, uv_a and uv_b are [N, 2] (u, v) numpy.ndarray
+        :rtype: BenchmarkPair
+        """
+        a = self._arrays
+        matches = a["matches"][self._match_slices[pair_idx]:self._match_slices[pair_idx + 1]]
+        return BenchmarkPair(pair_idx=pair_idx, scene_name=str(a["scene_names"][pair_idx]),
+                             img_a_idx=a["img_a_idxs"][pair_idx].item(), img_b_idx=a["img_b_idxs"][pair_idx].item(),
+                             row_a=int(a["row_a"][pair_idx]), row_b=int(a["row_b"][pair_idx]),
+                             uv_a=matches[:, 1:3], uv_b=matches[:, 3:5])
+
+    def __iter__(self):
+        for pair_idx in range(self.num_pairs):
+            yield self.get_pair(pair_idx)
+
+    def get_mask(self, row):
+        """
+        :return: [H, W] uint8 mask (0 / 1) of image row
+        """
+        if row not in self._masks:
+            mask_shape = tuple(self._arrays["mask_shape"])
+            bits = np.unpackbits(self._arrays["masks"][row])[:mask_shape[0] * mask_shape[1]]
+            self._masks[row] = bits.reshape(mask_shape)
+        return self._masks[row]
+
+    def get_image(self, row):
+        """
+        :return: [H, W, 3] uint8 RGB of image row, None if the set has no images
+        """
+        if not self.has_images:
+            return None
+        return np.asarray(self._images[row])
+
+    def get_rgb_mask(self, dataset, scene_name, img_idx, row):
+        """
+        RGB image (from the set if it has images, decoded from dataset otherwise) and mask
+        """
+        rgb = self.get_image(row)
+        if rgb is None:
+            rgb, _ = dataset.get_rgb_mask(scene_name, img_idx)
+        return rgb, self.get_mask(row)
+
+    def get_scenes_and_image_pairs(self, num_pairs=None):
+        """
+        Same return values as DenseCorrespondenceEvaluation.get_random_scenes_and_image_pairs()
+        :return: scene_names, img_pairs
+        """
+        pairs = [self.get_pair(i) for i in range(self.num_pairs if num_pairs is None else
+                                                 min(num_pairs, self.num_pairs))]
+        return [p.scene_name for p in pairs], [[p.img_a_idx, p.img_b_idx] for p in pairs]
+
+
+def load_benchmark_set(benchmark_set):
+    """
+    :param benchmark_set: BenchmarkSet, .npz filename or None
+    :rtype: BenchmarkSet or None
+    """
+    if benchmark_set is None or isinstance(benchmark_set, BenchmarkSet):
+        return benchmark_set
+    return BenchmarkSet(utils.convert_to_absolute_path(benchmark_set))
+
+
+if __name__ == "__main__":
+    from dense_correspondence.network.dense_correspondence_network import DenseCorrespondenceNetwork
+
+    argParser = argparse.ArgumentParser()
+    argParser.add_argument("model_folder", help="model folder whose dataset.yaml is used")
+    argParser.add_argument("output", help=".npz file")
+    argParser.add_argument("--split", default="test", choices=("train", "test"))
+    argParser.add_argument("--num_image_pairs", type=int, default=100)
+    argParser.add_argument("--num_matches_per_image_pair", type=int, default=100)
+    argParser.add_argument("--seed", type=int, default=1)
+    argParser.add_argument("--include_images", action="store_true", help="store the decoded RGB images")
+    args = argParser.parse_args()
+
+    dcn = DenseCorrespondenceNetwork.from_model_folder(args.model_folder, load_stored_params=False)
+    dataset = dcn.load_training_dataset()
+    if args.split == "test":
+        dataset.set_test_mode()
+    else:
+        dataset.set_train_mode()
+    build_benchmark_set(dataset, args.output, num_image_pairs=args.num_image_pairs,
+                        num_matches_per_image_pair=args.num_matches_per_image_pair, seed=args.seed,
+                        include_images=args.include_images)
@@ -0,0 +1,220 @@
+"""
+Evaluation of all the checkpoints of one or more model folders on the same image pairs.
+
+The image pairs and their ground truth matches are a frozen benchmark set (see
+benchmark_set.py), sampled once with a seed, with the decoded images:
+
+    <sweep_dir>/benchmark.npz
+    <sweep_dir>/benchmark_images.npy
+
+unless a benchmark set is given. The checkpoints (003500.pth, ...) are then
+evaluated by a pool of processes, which all memory-map the same images. Each
+checkpoint writes the match statistics of match_statistics.compute_match_statistics() to
+
+    <sweep_dir>/checkpoints/<model_name>/003500.csv (+ .parquet)
+
+and the checkpoints which already have results are not evaluated again, so that the
+sweep can be run again as training writes new checkpoints. The results of all the
+checkpoints are written to <sweep_dir>/sweep.csv (+ .parquet).
+
+To run a sweep from terminal (from pytorch_dense_correspondence):
+    python dense_correspondence/evaluation/checkpoint_sweep.py <model_folder> --num_workers 2
+"""
+
+import os
+import time
+import fnmatch
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import torch
+
+import dense_correspondence_manipulation.utils.utils as utils
+
+utils.add_dense_correspondence_to_python_path()
+from dense_correspondence.evaluation.benchmark_set import (
+    CANONICAL_SCENE_NAME,
+    BenchmarkSet,
+    build_benchmark_set,
+)
+import dense_correspondence.evaluation.match_statistics as match_statistics
+import dense_correspondence.evaluation.metrics_accumulator as metrics_accumulator
+
+pd = utils.LazyModule("pandas")
+
+BENCHMARK_FILENAME = "benchmark.npz"
+CHECKPOINTS_FOLDER_NAME = "checkpoints"
+SWEEP_FILENAME = "sweep.csv"
+SWEEP_FOLDER_NAME = "sweep"
+
+RESULT_COLUMNS = ["iteration", "pair_idx", "scene_name", "img_a_idx", "img_b_idx"] + \
+    match_statistics.STATISTICS_COLUMNS
+
+
+def get_checkpoints(model_folder):
+    """
+    :return: the .pth files of model_folder, sorted by iteration
+    :rtype: list of str
+    """
+    model_folder = utils.convert_to_absolute_path(model_folder)
+    return [os.path.join(model_folder, f) for f in sorted(fnmatch.filter(os.listdir(model_folder), "*.pth"))]
+
+
+def get_checkpoint_result_file(sweep_dir, model_folder, model_param_file):
+    model_name = os.path.basename(os.path.normpath(model_folder))
+    iteration = os.path.splitext(os.path.basename(model_param_file))[0]
+    return os.path.join(sweep_dir, CHECKPOINTS_FOLDER_NAME, model_name, iteration + ".csv")
+
+
+def evaluate_checkpoint(sweep_dir, benchmark_file, model_folder, model_param_file, device="cuda",
+                        num_threads=None):
+    """
+    Match statistics of a checkpoint on the benchmark set, saved to its result file in sweep_dir.
+    Each image is run through the network once, e.g. the canonical image b of several pairs.
+
+    :return: result file
+    :rtype: str
+    """
+    from dense_correspondence.network.dense_correspondence_network import DenseCorrespondenceNetwork
+
+    if num_threads is not None:
+        torch.set_num_threads(num_threads)
+    start = time.time()
+    benchmark_set = BenchmarkSet(benchmark_file)
+    image_mean = torch.tensor(benchmark_set.image_mean, device=device).view(3, 1, 1)
+    image_std_dev = torch.tensor(benchmark_set.image_std_dev, device=device).view(3, 1, 1)
+
+    dcn = DenseCorrespondenceNetwork.from_model_folder(model_folder, model_param_file=model_param_file)
+    dcn.eval()
+    dcn.to(device)
+    dataset = None if benchmark_set.has_images else dcn.load_training_dataset()
+
+    def forward(scene_name, img_idx, row):
+        rgb, _ = benchmark_set.get_rgb_mask(dataset, scene_name, img_idx, row)
+        # same normalization as SpartanDataset.rgb_image_to_tensor()
+        img = torch.from_numpy(np.array(rgb, dtype=np.uint8)).to(device).permute(2, 0, 1).float() / 255.0
+        return dcn.forward_single_image_tensor((img - image_mean) / image_std_dev).data
+
+    accumulator = metrics_accumulator.MetricsAccumulator(RESULT_COLUMNS)
+    iteration = int(os.path.splitext(os.path.basename(model_param_file))[0])
+    row_b, res_b = None, None
+    with torch.no_grad():
+        for pair in sorted(benchmark_set, key=lambda p: p.row_b):
+            if len(pair.uv_a) == 0:
+                continue
+            if pair.row_b != row_b:
+                row_b = pair.row_b
+                res_b = forward(CANONICAL_SCENE_NAME, pair.img_b_idx, pair.row_b)
+            res_a = forward(pair.scene_name, pair.img_a_idx, pair.row_a)
+            statistics = match_statistics.compute_match_statistics(
+                pair.uv_a, pair.uv_b, res_a, res_b, benchmark_set.get_mask(pair.row_b))
+            accumulator.extend(iteration=iteration, pair_idx=pair.pair_idx, scene_name=pair.scene_name,
+                               img_a_idx=pair.img_a_idx, img_b_idx=pair.img_b_idx, **statistics)
+
+    result_file = get_checkpoint_result_file(sweep_dir, model_folder, model_param_file)
+    if not os.path.isdir(os.path.dirname(result_file)):
+        os.makedirs(os.path.dirname(result_file))
+    metrics_accumulator.save_dataframe(accumulator.to_dataframe(), result_file)
+    print("evaluated %s in %.1f s" % (model_param_file, time.time() - start))
+    return result_file
+
+
+def run_sweep(model_folders, sweep_dir=None, benchmark_file=None, num_workers=1, devices=None,
+              num_image_pairs=100, num_matches_per_image_pair=100, seed=1, split="test"):
+    """
+    Evaluates the checkpoints of model_folders which have no results yet in sweep_dir,
+    then writes the results of all of them to <sweep_dir>/sweep.csv
+
+    :param model_folders: model folders, absolute or relative to pdc/trained_models
+    :type model_folders: list of str
+    :param sweep_dir: <model_folder>/analysis/sweep of the first model folder if None
+    :param num_workers: number of processes, the checkpoints are evaluated in this process if 0
+    :param devices: devices of the workers, in turn. All the gpus (or the cpu) if None
+    :param benchmark_file: (optional) .npz benchmark set, <sweep_dir>/benchmark.npz if None
+    :param num_image_pairs, num_matches_per_image_pair, seed, split: benchmark set built
+        in sweep_dir if there is none yet
+    :return: results of all the checkpoints
+    :rtype: pandas.DataFrame
+    """
+    model_folders = [utils.convert_to_absolute_path(f) for f in model_folders]
+    if sweep_dir is None:
+        sweep_dir = os.path.join(model_folders[0], "analysis", SWEEP_FOLDER_NAME)
+    sweep_dir = utils.convert_to_absolute_path(sweep_dir)
+    if devices is None:
+        devices = ["cuda:%d" % i for i in range(torch.cuda.device_count())] or ["cpu"]
+
+    if benchmark_file is None:
+        benchmark_file = os.path.join(sweep_dir, BENCHMARK_FILENAME)
+    benchmark_file = utils.convert_to_absolute_path(benchmark_file)
+    if not os.path.isfile(benchmark_file):
+        from dense_correspondence.network.dense_correspondence_network import DenseCorrespondenceNetwork
+
+        dcn = DenseCorrespondenceNetwork.from_model_folder(model_folders[0], load_stored_params=False)
+        dataset = dcn.load_training_dataset()
+        if split == "test":
+            dataset.set_test_mode()
+        else:
+            dataset.set_train_mode()
+        build_benchmark_set(dataset, benchmark_file, num_image_pairs=num_image_pairs,
+                            num_matches_per_image_pair=num_matches_per_image_pair, seed=seed,
+                            include_images=True)
+
+    checkpoints = [(model_folder, model_param_file) for model_folder in model_folders
+                   for model_param_file in get_checkpoints(model_folder)]
+    todo = [c for c in checkpoints if not os.path.isfile(get_checkpoint_result_file(sweep_dir, *c))]
+    print("%d/%d checkpoints to evaluate" % (len(todo), len(checkpoints)))
+
+    if num_workers == 0:
+        for i, (model_folder, model_param_file) in enumerate(todo):
+            evaluate_checkpoint(sweep_dir, benchmark_file, model_folder, model_param_file,
+                                device=devices[i % len(devices)])
+    elif todo:
+        num_threads = max(1, (os.cpu_count() or 1) // num_workers)
+        # cuda can't be used in forked processes
+        with ProcessPoolExecutor(max_workers=num_workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            futures = [pool.submit(evaluate_checkpoint, sweep_dir, benchmark_file, model_folder, model_param_file,
+                                   device=devices[i % len(devices)], num_threads=num_threads)
+                       for i, (model_folder, model_param_file) in enumerate(todo)]
+            for future in futures:
+                future.result()
+
+    df_list = []
+    for model_folder, model_param_file in checkpoints:
+        df = metrics_accumulator.load_dataframe(get_checkpoint_result_file(sweep_dir, model_folder, model_param_file))
+        df.insert(0, "model_name", os.path.basename(os.path.normpath(model_folder)))
+        df_list.append(df)
+    df = pd.concat(df_list, ignore_index=True)
+    metrics_accumulator.save_dataframe(df, os.path.join(sweep_dir, SWEEP_FILENAME))
+    return df
+
+
+def summarize_sweep(df):
+    """
+    Mean and median pixel match errors of each checkpoint
+    :rtype: pandas.DataFrame
+    """
+    columns = ["pixel_match_error_l2", "pixel_match_error_l2_masked", "fraction_pixels_closer_than_ground_truth"]
+    return df.groupby(["model_name", "iteration"])[columns].agg(["mean", "median"])
+
+
+if __name__ == "__main__":
+    argParser = argparse.ArgumentParser()
+    argParser.add_argument("model_folders", nargs="+", help="model folders, absolute or relative to pdc/trained_models")
+    argParser.add_argument("--sweep_dir", default=None,
+                           help="<model_folder>/analysis/sweep of the first model folder if None")
+    argParser.add_argument("--benchmark", default=None,
+                           help=".npz benchmark set (see benchmark_set.py), <sweep_dir>/benchmark.npz if None")
+    argParser.add_argument("--num_workers", type=int, default=1)
+    argParser.add_argument("--devices", nargs="*", default=None, help="e.g. cuda:0 cuda:1, all the gpus if None")
+    argParser.add_argument("--num_image_pairs", type=int, default=100)
+    argParser.add_argument("--num_matches_per_image_pair", type=int, default=100)
+    argParser.add_argument("--seed", type=int, default=1)
+    argParser.add_argument("--split", default="test", choices=("train", "test"))
+    args = argParser.parse_args()
+
+    df = run_sweep(args.model_folders, sweep_dir=args.sweep_dir, benchmark_file=args.benchmark, num_workers=args.num_workers, devices=args.devices,
+                   num_image_pairs=args.num_image_pairs, num_matches_per_image_pair=args.num_matches_per_image_pair,
+                   seed=args.seed, split=args.split)
+    print(summarize_sweep(df))
@@ -0,0 +1,245 @@
+"""
+Long-lived correspondence service for the robot.
+
+correspondences_robot.correspondence_finder() loads the network and the training
+dataset on every query. CorrespondenceService loads the network once, keeps the
+descriptors of the reference (canonical) image, and answers queries
+
+    (rgb_b, [pixel_a, ...], mask_b) ---> [pixel_b, ...], [confidence, ...]
+
+either in-process (find_correspondences(), or submit() to a worker thread) or over
+a local socket (serve() and CorrespondenceClient). The confidence of a match is
+the probability of pixel_b under the softmax of the descriptor distances to
+pixel_a, as in correspondence_finder(). The analysis plots are optional, drawn
+and saved in a background thread.
+
+To start the service from terminal (from the root of the repository):
+    python pytorch_dense_correspondence/dense_correspondence/evaluation/correspondence_service.py
+"""
+
+import os
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.connection import Listener, Client
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+import numpy as np
+import torch
+from torchvision import transforms
+
+import dense_correspondence_manipulation.utils.utils as utils
+import dense_correspondence_manipulation.utils.constants as constants
+
+utils.add_dense_correspondence_to_python_path()
+from dense_correspondence.evaluation.evaluation import DenseCorrespondenceEvaluation
+import dense_correspondence.network.descriptor_matcher as descriptor_matcher
+
+DEFAULT_NETWORK_NAME = "shirt_hanging_d16_distributional_sym_rot"
+DEFAULT_ADDRESS = ("localhost", 6010)
+DEFAULT_AUTHKEY = b"dense_correspondence"
+
+
+def get_default_reference_image():
+    """
+    Canonical image of the shirt, see correspondences_robot.get_canonical_image()
+    """
+    from PIL import Image
+    rgb_filename = os.path.join(utils.getDenseCorrespondenceSourceDir(),
+                                "pdc/logs_proto/shirt_canonical/processed/images/rgb-cam1-0-0.png")
+    return np.array(Image.open(rgb_filename).convert("RGB"))
+
+
+class CorrespondenceService(object):
+
+    def __init__(self, network_name=DEFAULT_NETWORK_NAME, config_filename=None, rgb_a=None, device=None,
+                 plot_save_dir=None, max_pending_plots=4):
+        """
+        :param network_name: network of the evaluation config
+        :param config_filename: evaluation config, config/dense_correspondence/evaluation/evaluation.yaml if None
+        :param rgb_a: reference image [H,W,3], the canonical image if None
+        :param device: torch device of the network, cuda if available if None
+        :param plot_save_dir: (optional) folder where the analysis plots of every query are saved,
+            in a background thread. No plots if None
+        :param max_pending_plots: plots are skipped while this many are waiting, so that plotting
+            never slows down the queries
+        """
+        if config_filename is None:
+            config_filename = os.path.join(utils.getDenseCorrespondenceSourceDir(),
+                                           "config/dense_correspondence/evaluation/evaluation.yaml")
+        if device is None:
+            device = "cuda" if torch.cuda.is_available() else "cpu"
+        self._device = torch.device(device)
+
+        config = utils.getDictFromYamlFilename(config_filename)
+        self._dcn = DenseCorrespondenceEvaluation(config).load_network_from_config(network_name)
+        self._dcn.to(self._device)
+        self._dcn.eval()
+
+        # same normalization as SpartanDataset.rgb_image_to_tensor(), without loading the dataset
+        self._rgb_image_to_tensor = transforms.Compose(
+            [transforms.ToTensor(),
+             transforms.Normalize(constants.DEFAULT_IMAGE_MEAN, constants.DEFAULT_IMAGE_STD_DEV)])
+
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+        self._plot_save_dir = plot_save_dir
+        self._plot_queue = None
+        self._num_plots = 0
+        if plot_save_dir is not None:
+            self._plot_queue = queue.Queue(maxsize=max_pending_plots)
+            plot_thread = threading.Thread(target=self._plot_worker)
+            plot_thread.daemon = True
+            plot_thread.start()
+
+        self.set_reference_image(get_default_reference_image() if rgb_a is None else rgb_a)
+
+    @property
+    def dcn(self):
+        return self._dcn
+
+    def compute_descriptors(self, rgb):
+        """
+        :param rgb: numpy.ndarray [H,W,3] or PIL.Image.Image
+        :return: torch.FloatTensor [H,W,D] on the device of the network
+        """
+        rgb_tensor = self._rgb_image_to_tensor(rgb).to(self._device)
+        with torch.no_grad():
+            return self._dcn.forward_single_image_tensor(rgb_tensor).data
+
+    def set_reference_image(self, rgb_a):
+        """
+        Sets the image of the query pixels and computes its descriptors, once
+        """
+        with self._lock:
+            self._rgb_a = np.array(rgb_a)
+            self._res_a = self.compute_descriptors(self._rgb_a)
+
+    def find_correspondences(self, rgb_b, pixels_a, mask_b=None):
+        """
+        Best matches in rgb_b of pixels of the reference image.
+
+        :param rgb_b: numpy.ndarray [H,W,3]
+        :param pixels_a: list of (u,v) pixels of the reference image
+        :param mask_b: (optional) numpy.ndarray [H,W], the matches are searched in the mask only
+        :return: pixels_b list of (u,v), confidences list of float
+        """
+        with self._lock:
+            res_b = self.compute_descriptors(rgb_b)
+            matches = descriptor_matcher.find_best_matches_for_pixels(pixels_a, self._res_a, res_b, mask_b=mask_b,
+                                                                      return_norm_diffs=True)
+            if mask_b is not None:
+                uv_b, distance = matches.masked_uv, matches.masked_distance
+            else:
+                uv_b, distance = matches.uv, matches.distance
+
+            # probability of the match under the softmax over all the pixels of image b
+            norm_diffs = matches.norm_diffs.reshape(len(uv_b), -1)
+            log_p_b = -distance - torch.logsumexp(-norm_diffs, dim=1)
+            pixels_b = [tuple(uv) for uv in uv_b.tolist()]
+            confidences = log_p_b.exp().tolist()
+
+            if self._plot_queue is not None:
+                self._queue_plot(rgb_b, pixels_a, pixels_b, res_b, norm_diffs)
+
+        return pixels_b, confidences
+
+    def submit(self, rgb_b, pixels_a, mask_b=None):
+        """
+        find_correspondences() in the worker thread of the service
+        :rtype: concurrent.futures.Future
+        """
+        return self._executor.submit(self.find_correspondences, rgb_b, pixels_a, mask_b)
+
+    def _queue_plot(self, rgb_b, pixels_a, pixels_b, res_b, norm_diffs):
+        p_b = torch.softmax(-norm_diffs[0], dim=0).reshape(res_b.shape[:2]).cpu().numpy()
+        try:
+            self._plot_queue.put_nowait((np.array(rgb_b), pixels_a[0], pixels_b[0],
+                                         self._res_a.cpu().numpy(), res_b.cpu().numpy(), p_b))
+        except queue.Full:
+            pass
+
+    def _plot_worker(self):
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from dense_correspondence.evaluation.plotting import plot_correspondence_analysis
+
+        while True:
+            rgb_b, pixel_a, pixel_b, res_a, res_b, p_b = self._plot_queue.get()
+            fig = Figure(figsize=(14, 7))
+            FigureCanvasAgg(fig)
+            plot_correspondence_analysis(fig, self._rgb_a, rgb_b, pixel_a, pixel_b, res_a, res_b, p_b)
+            fig.savefig(os.path.join(self._plot_save_dir, "analysis_plots_%06d.png" % self._num_plots))
+            self._num_plots += 1
+
+    def serve(self, address=DEFAULT_ADDRESS, authkey=DEFAULT_AUTHKEY):
+        """
+        Answers the queries of CorrespondenceClient on a local socket, forever. Each message
+        is a dict with the arguments of find_correspondences(), None closes the connection.
+        """
+        listener = Listener(address, authkey=authkey)
+        print("CorrespondenceService listening on %s:%d" % address)
+        try:
+            while True:
+                connection = listener.accept()
+                try:
+                    while True:
+                        request = connection.recv()
+                        if request is None:
+                            break
+                        try:
+                            pixels_b, confidences = self.find_correspondences(request["rgb_b"], request["pixels_a"],
+                                                                              mask_b=request.get("mask_b", None))
+                            connection.send({"pixels_b": pixels_b, "confidences": confidences})
+                        except Exception as e:
+                            connection.send({"error": repr(e)})
+                except EOFError:
+                    pass
+                finally:
+                    connection.close()
+        finally:
+            listener.close()
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+
+class CorrespondenceClient(object):
+    """
+    Robot side of CorrespondenceService.serve()
+    """
+
+    def __init__(self, address=DEFAULT_ADDRESS, authkey=DEFAULT_AUTHKEY):
+        self._connection = Client(address, authkey=authkey)
+
+    def find_correspondences(self, rgb_b, pixels_a, mask_b=None):
+        """
+        See CorrespondenceService.find_correspondences()
+        :return: pixels_b, confidences
+        """
+        self._connection.send({"rgb_b": np.asarray(rgb_b), "pixels_a": [tuple(p) for p in pixels_a],
+                               "mask_b": None if mask_b is None else np.asarray(mask_b)})
+        response = self._connection.recv()
+        if "error" in response:
+            raise RuntimeError("CorrespondenceService error: %s" % response["error"])
+        return response["pixels_b"], response["confidences"]
+
+    def close(self):
+        self._connection.send(None)
+        self._connection.close()
+
+
+if __name__ == "__main__":
+    argParser = argparse.ArgumentParser()
+    argParser.add_argument("-n", "--network_name", default=DEFAULT_NETWORK_NAME)
+    argParser.add_argument("-p", "--port", type=int, default=DEFAULT_ADDRESS[1])
+    argParser.add_argument("--plot_save_dir", default=None, help="save the analysis plots of every query here")
+    args = argParser.parse_args()
+
+    service = CorrespondenceService(network_name=args.network_name, plot_save_dir=args.plot_save_dir)
+    service.serve(address=(DEFAULT_ADDRESS[0], args.port))
@@ -1,5 +1,5 @@
-import os
 import os, sys
+import hashlib
 
 # sys.path.append(os.getcwd() + "/../../modules")
 # sys.path.append(os.getcwd() + "/../../external")
@@ -12,19 +12,18 @@ sys.path.append(
     os.getcwd() + "/pytorch_dense_correspondence/dense_correspondence/dataset"
 )
 
-import cv2
 import numpy as np
-import random
-import matplotlib.pyplot as plt
 from PIL import Image
 
 import torch
 import torch.nn.functional as F
-from sklearn.decomposition import PCA
 
-import pytorch_dense_correspondence.modules.dense_correspondence_manipulation.utils.utils as utils
-import pytorch_dense_correspondence.dense_correspondence.evaluation.plotting as dc_plotting
-from pytorch_dense_correspondence.dense_correspondence.evaluation.evaluation import *
+import dense_correspondence_manipulation.utils.utils as utils
+from dense_correspondence.evaluation.evaluation import DenseCorrespondenceEvaluation
+from dense_correspondence.network.dense_correspondence_network import DenseCorrespondenceNetwork
+import dense_correspondence.network.descriptor_cache as descriptor_cache
+import dense_correspondence.evaluation.foreground_masking as foreground_masking
+from dense_correspondence.evaluation.foreground_masking import fill_gaps_mask, correct_mask_with_depth
 
 
 def set_up_model(network_name="shirt_hanging_d16_distributional_sym_rot"):
@@ -48,8 +47,14 @@ def get_canonical_image():
 
 
 def correspondence_finder(
-    rgb_a, rgb_b, pixel_a, mask_b=None, visualize=False, plot_save_dir=None
+    rgb_a, rgb_b, pixel_a, mask_b=None, visualize=False, plot_save_dir=None,
+    matcher_backend="numpy",
 ):
+    """
+    Best match in rgb_b of pixel_a of rgb_a. Loads the network on every call, see
+    correspondence_service.CorrespondenceService to keep it loaded across queries.
+    :return: pixel_b, confidence_level
+    """
     dataset, dcn = set_up_model()
 
     # transform to cv2.rgb_image to np.array
@@ -60,41 +65,26 @@ def correspondence_finder(
     rgb_a_tensor = dataset.rgb_image_to_tensor(rgb_a)
     rgb_b_tensor = dataset.rgb_image_to_tensor(rgb_b)
 
-    # these are Variables holding torch.FloatTensors, first grab the data, then convert to numpy
-    res_a = dcn.forward_single_image_tensor(rgb_a_tensor).data.cpu()
-    res_b = dcn.forward_single_image_tensor(rgb_b_tensor).data.cpu()
-
-    pixel_b, _, norm_diffs = DenseCorrespondenceNetwork.find_best_match(
-        pixel_a, res_a.numpy(), res_b.numpy(), mask_b=mask_b
+    # these are Variables holding torch.FloatTensors, first grab the data, then convert to numpy.
+    # Image a is usually the canonical image (see get_canonical_image()), its descriptors
+    # are cached by image content
+    res_a = descriptor_cache.get_default_cache().get_descriptors(
+        dcn, hashlib.sha1(rgb_a_array.tobytes()).hexdigest(), rgb_a_tensor
     )
-
-    fig, ax = plt.subplots(2, 3, figsize=(14, 7))
-    # Plot original images
-    rgb_a = cv2.circle(rgb_a, pixel_a, 10, (255, 0, 0), -1)
-    rgb_b = cv2.circle(rgb_b, pixel_b, 10, (255, 0, 0), -1)
-    ax[0, 0].imshow(rgb_a)
-    ax[0, 0].set_title("Img A")
-    ax[0, 1].imshow(rgb_b)
-    ax[0, 1].set_title("Img B")
-
-    # PCA plots
-    d = res_a.shape[-1]
-    res_shape = res_a.shape
-    pca = PCA(n_components=3)
-
-    res_b_pc = pca.fit_transform(res_b.reshape((-1, d)))
-    res_b_pc = res_b_pc.reshape(res_shape[0], res_shape[1], -1)
-    res_b_pc = dc_plotting.normalize_descriptor(res_b_pc)
-    ax[1, 1].imshow(res_b_pc)
-    ax[1, 1].set_title("Img B: PCA plot DOD")
-
-    res_a_pc = pca.transform(res_a.reshape((-1, d)))
-    res_a_pc = res_a_pc.reshape(res_shape[0], res_shape[1], -1)
-    res_a_pc = dc_plotting.normalize_descriptor(res_a_pc)
-    ax[1, 0].imshow(res_a_pc)
-    ax[1, 0].set_title("Img A: PCA plot DOD")
-
-    # Heatmap plots
+    res_b = dcn.forward_single_image_tensor(rgb_b_tensor).data
+    if matcher_backend == "torch":
+        # the torch matcher runs on the device of the descriptors
+        pixel_b, _, norm_diffs = DenseCorrespondenceNetwork.find_best_match(
+            pixel_a, res_a.to(res_b.device), res_b, mask_b=mask_b, backend="torch"
+        )
+        res_b = res_b.cpu()
+    else:
+        res_b = res_b.cpu()
+        pixel_b, _, norm_diffs = DenseCorrespondenceNetwork.find_best_match(
+            pixel_a, res_a.numpy(), res_b.numpy(), mask_b=mask_b, backend="numpy"
+        )
+
+    # Heatmap
     norm_diffs = torch.tensor(norm_diffs)
     p_b = F.softmax(
         -1 * norm_diffs.ravel(), dim=0
@@ -102,53 +92,33 @@ def correspondence_finder(
     p_b = p_b.reshape(rgb_b_tensor.shape[1:]).numpy()
     confidence_level = p_b[pixel_b[1], pixel_b[0]]
 
-    data_sorted = np.sort(p_b.ravel())
-    p = 1.0 * np.arange(len(p_b.ravel())) / (len(p_b.ravel()) - 1)
-    ax[1, 2].plot(p, data_sorted)
-    ax[1, 2].set_ylabel("Probability across pixels")
-    ax[1, 2].set_xlabel("Percentage of image pixels")
+    if visualize or plot_save_dir:
+        import matplotlib.pyplot as plt
+        import dense_correspondence.evaluation.plotting as dc_plotting
 
-    im1 = ax[0, 2].imshow(p_b, cmap="jet", alpha=0.95)  # , vmin=0, vmax=0.005)
-    im2 = ax[0, 2].imshow(rgb_b_array, alpha=0.15)
-    plt.colorbar(im1, ax=ax[0, 2], fraction=0.046, pad=0.04)
-    ax[0, 2].set_title("Img B: Best match heatmap")
-
-    plt.tight_layout()
-    if plot_save_dir:
-        plt.savefig(os.path.join(plot_save_dir, "analysis_plots.png"))
-    if visualize:
-        plt.show()
+        fig = plt.figure(figsize=(14, 7))
+        dc_plotting.plot_correspondence_analysis(
+            fig, rgb_a_array, rgb_b_array, pixel_a, pixel_b, res_a.numpy(), res_b.numpy(), p_b
+        )
+        if plot_save_dir:
+            fig.savefig(os.path.join(plot_save_dir, "analysis_plots.png"))
+        if visualize:
+            plt.show()
+        plt.close(fig)
 
     return pixel_b, confidence_level
 
 
-def fill_gaps_mask(mask):
-    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (10, 10))
-    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel)
-    return mask
-
-
-def masking(camera_color_img):
-    input_filename = "/home/gelsight/Desktop/camera_img.png"
-    output_filename = "/home/gelsight/Desktop/masked_img.png"
-    cv2.imwrite(input_filename, camera_color_img)
-    os.system("backgroundremover -i %s -o %s" % (input_filename, output_filename))
-    camera_color_img_masked = cv2.imread(output_filename)
-
-    mask = (camera_color_img_masked != [0, 0, 0])[:, :, 0].astype("uint8")
-    mask = fill_gaps_mask(mask)
-    return camera_color_img_masked, mask
-
+_default_masker = None
 
-def correct_mask_with_depth(original_mask, camera_depth_img):
-    # Delete from the original_mask those points with "infinite" depth
-    mask_depth = (camera_depth_img < 930).astype("uint8")
-    mask_depth *= (camera_depth_img > 500).astype("uint8")
 
-    # fig, ax = plt.subplots(2, 2)
-    # ax[0, 0].imshow(mask_depth)
-    # ax[0, 1].imshow(original_mask)
-    # ax[1, 0].imshow(original_mask * mask_depth)
-    # ax[1, 0].set_title("Final mask")
-    # plt.show()
-    return original_mask * mask_depth
+def masking(camera_color_img, camera_depth_img=None):
+    """
+    Foreground of the camera frame, with the learned masker of foreground_masking,
+    loaded on the first call. See foreground_masking for the other maskers.
+    :return: camera_color_img_masked, mask
+    """
+    global _default_masker
+    if _default_masker is None:
+        _default_masker = foreground_masking.LearnedMasker()
+    return _default_masker(camera_color_img, camera_depth_img)
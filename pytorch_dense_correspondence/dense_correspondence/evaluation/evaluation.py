@@ -2,31 +2,26 @@
 import logging
 import os
 import random
+from collections import OrderedDict
 
 import dense_correspondence_manipulation.utils.utils as utils
 
 utils.add_dense_correspondence_to_python_path()
-import matplotlib.pyplot as plt
-import cv2
 import itertools
 import numpy as np
-import pandas as pd
-import random
-import scipy.stats as ss
-from scipy.ndimage import gaussian_filter
-from sklearn.decomposition import PCA
-from sklearn.metrics import (
-    accuracy_score,
-    confusion_matrix,
-    roc_auc_score,
-    roc_curve,
-    ConfusionMatrixDisplay,
-)
 
-import plotly
-import plotly.express as px
-import plotly.graph_objects as xgo
-import pandas as pd
+# plotting and analysis dependencies, only imported by the functions that use them,
+# so that loading a network through this module stays fast
+plt = utils.LazyModule("matplotlib.pyplot")
+cv2 = utils.LazyModule("cv2")
+pd = utils.LazyModule("pandas")
+ss = utils.LazyModule("scipy.stats")
+ndimage = utils.LazyModule("scipy.ndimage")
+sns = utils.LazyModule("seaborn")
+sklearn_decomposition = utils.LazyModule("sklearn.decomposition")
+sklearn_metrics = utils.LazyModule("sklearn.metrics")
+plotly_offline = utils.LazyModule("plotly.offline")
+px = utils.LazyModule("plotly.express")
 
 import torch
 from torch.autograd import Variable
@@ -35,24 +30,32 @@ import torch.nn.functional as F
 
 from dense_correspondence_manipulation.utils.constants import *
 from dense_correspondence.dataset.spartan_dataset_masked import SpartanDataset
-import dense_correspondence.correspondence_tools.correspondence_plotter as correspondence_plotter
 import dense_correspondence.correspondence_tools.correspondence_finder as correspondence_finder
+from dense_correspondence.correspondence_tools.pixel_symmetry import HorizontalMirror
 from dense_correspondence.network.dense_correspondence_network import (
     DenseCorrespondenceNetwork,
 )
+import dense_correspondence.network.descriptor_cache as descriptor_cache
+import dense_correspondence.network.descriptor_matcher as descriptor_matcher
+import dense_correspondence.evaluation.match_statistics as match_statistics
+import dense_correspondence.evaluation.metrics_accumulator as metrics_accumulator
+import dense_correspondence.evaluation.benchmark_set as benchmark_set_module
+import dense_correspondence.evaluation.shirt_zones as shirt_zones
 from dense_correspondence.loss_functions.pixelwise_contrastive_loss import (
     PixelwiseContrastiveLoss,
 )
 from dense_correspondence.loss_functions.pixelwise_distributional_loss import (
     PixelwiseDistributionalLoss,
 )
-
-import dense_correspondence.evaluation.plotting as dc_plotting
+import dense_correspondence.loss_functions.loss_composer as loss_composer
 
 from dense_correspondence.correspondence_tools.correspondence_finder import (
     random_sample_from_masked_image,
 )
 
+correspondence_plotter = utils.LazyModule("dense_correspondence.correspondence_tools.correspondence_plotter")
+dc_plotting = utils.LazyModule("dense_correspondence.evaluation.plotting")
+
 COLOR_BLUE = (0, 0, 200)
 COLOR_WHITE = (255, 255, 255)
 COLOR_RED = (255, 0, 0)
@@ -143,6 +146,19 @@ class DenseCorrespondenceEvaluation(object):
         self._config = config
         self._dataset = None
 
+        # "numpy" or "torch", backend of DenseCorrespondenceNetwork.find_best_match() given to the
+        # evaluations (backend=self.matcher_backend). DenseCorrespondenceNetwork.MATCHER_BACKEND if None
+        self._matcher_backend = self._config.get("params", dict()).get("matcher_backend")
+
+        # folder of the descriptors of the canonical images, kept in memory only if not set
+        if "descriptor_cache_dir" in self._config.get("params", dict()):
+            descriptor_cache.get_default_cache().cache_dir = utils.convert_to_absolute_path(
+                self._config["params"]["descriptor_cache_dir"])
+
+    @property
+    def matcher_backend(self):
+        return self._matcher_backend
+
     def load_network_from_config(self, name):
         """
         Loads a network from config file. Puts it in eval mode by default
@@ -231,13 +247,21 @@ class DenseCorrespondenceEvaluation(object):
 
     @staticmethod
     def evaluate_network(
-        dcn, dataset, num_image_pairs=25, num_matches_per_image_pair=100
+        dcn, dataset, num_image_pairs=25, num_matches_per_image_pair=100, batched=True,
+        benchmark_set=None, backend=None,
     ):
         """
         :param nn: A neural network DenseCorrespondenceNetwork
         :param test_dataset: DenseCorrespondenceDataset
             the dataset to draw samples from
-        :return:
+        :param batched: compute the match statistics of each image pair at once,
+            see compute_descriptor_match_statistics_batch()
+        :param benchmark_set: (optional) evaluate on the image pairs and matches of a frozen
+            benchmark set instead of sampling them, num_image_pairs and
+            num_matches_per_image_pair are then not used
+        :type benchmark_set: BenchmarkSet or str (.npz file)
+        :param backend: "numpy" or "torch", see DenseCorrespondenceNetwork.find_best_match()
+        :return: ([df], df), df has a row of DCNEvaluationPandaTemplate.columns per match
         """
         utils.reset_random_seed()
 
@@ -246,7 +270,23 @@ class DenseCorrespondenceEvaluation(object):
 
         logging_rate = 5
 
-        pd_dataframe_list = []
+        accumulator = metrics_accumulator.MetricsAccumulator(
+            DCNEvaluationPandaTemplate.columns
+        )
+        benchmark_set = benchmark_set_module.load_benchmark_set(benchmark_set)
+        if benchmark_set is not None:
+            for pair in benchmark_set:
+                if pair.pair_idx % logging_rate == 0:
+                    print(
+                        "computing statistics for image %d of %d, scene_name %s"
+                        % (pair.pair_idx, len(benchmark_set), pair.scene_name)
+                    )
+                DCE.benchmark_pair_quantitative_analysis(
+                    dcn, dataset, benchmark_set, pair, accumulator, batched=batched, backend=backend
+                )
+            df = accumulator.to_dataframe()
+            return [df], df
+
         for i in range(0, num_image_pairs):
 
             scene_name = dataset.get_random_scene_name()
@@ -267,7 +307,7 @@ class DenseCorrespondenceEvaluation(object):
 
             img_idx_a, img_idx_b = idx_pair
 
-            dataframe_list_temp = (
+            result = (
                 DCE.single_same_scene_image_pair_quantitative_analysis(
                     dcn,
                     dataset,
@@ -276,18 +316,18 @@ class DenseCorrespondenceEvaluation(object):
                     img_idx_b,
                     num_matches=num_matches_per_image_pair,
                     debug=False,
+                    batched=batched,
+                    accumulator=accumulator,
+                    backend=backend,
                 )
             )
 
-            if dataframe_list_temp is None:
+            if result is None:
                 print("no matches found, skipping")
                 continue
 
-            pd_dataframe_list += dataframe_list_temp
-            # pd_series_list.append(series_list_temp)
-
-        df = pd.concat(pd_dataframe_list)
-        return pd_dataframe_list, df
+        df = accumulator.to_dataframe()
+        return [df], df
 
     @staticmethod
     def plot_descriptor_colormaps(
@@ -389,7 +429,8 @@ class DenseCorrespondenceEvaluation(object):
 
     @staticmethod
     def single_same_scene_image_pair_quantitative_analysis(
-        dcn, dataset, scene_name, img_a_idx, img_b_idx, num_matches=100, debug=False
+        dcn, dataset, scene_name, img_a_idx, img_b_idx, num_matches=100, debug=False, batched=True,
+        accumulator=None, backend=None,
     ):
         """
         Quantitative analysis of a dcn on a pair of images from the same scene.
@@ -406,7 +447,14 @@ class DenseCorrespondenceEvaluation(object):
         :type img_b_idx: int
         :param camera_intrinsics_matrix: Optionally set camera intrinsics, otherwise will get it from the dataset
         :type camera_intrinsics_matrix: 3 x 3 numpy array
-        :return: Dict with relevant data
+        :param batched: compute the statistics of all the matches at once, on the device of
+            the descriptors. Not used with debug, which plots every match
+        :type batched: bool
+        :param accumulator: (optional) the rows are added to the accumulator instead of
+            being returned as DataFrames
+        :type accumulator: MetricsAccumulator
+        :param backend: "numpy" or "torch", see DenseCorrespondenceNetwork.find_best_match()
+        :return: list of DataFrames with the statistics of the matches, accumulator if given
         :rtype:
         """
 
@@ -426,12 +474,14 @@ class DenseCorrespondenceEvaluation(object):
         rgb_b_tensor = dataset.rgb_image_to_tensor(rgb_b)
 
         # these are Variables holding torch.FloatTensors, first grab the data, then convert to numpy
-        res_a = dcn.forward_single_image_tensor(rgb_a_tensor).data.cpu().numpy()
-        res_b = dcn.forward_single_image_tensor(rgb_b_tensor).data.cpu().numpy()
+        res_a, res_b = dcn.forward_single_image_tensor_pair(rgb_a_tensor, rgb_b_tensor)
+        res_a_tensor, res_b_tensor = res_a.data, res_b.data
+        res_a, res_b = res_a_tensor.cpu().numpy(), res_b_tensor.cpu().numpy()
 
         # find correspondences
-        (uv_a_vec, uv_b_vec) = correspondence_finder.batch_find_pixel_correspondences(
-            img_a_knots, img_b_knots, device="GPU"
+        # on the device of the descriptors, e.g. the cpu for a quantized network
+        (uv_a_vec, uv_b_vec) = correspondence_finder.find_pixel_correspondences(
+            img_a_knots, img_b_knots, device=res_a_tensor.device
         )
 
         if uv_a_vec is None:
@@ -455,6 +505,29 @@ class DenseCorrespondenceEvaluation(object):
 
         DCE = DenseCorrespondenceEvaluation
 
+        if batched and not debug:
+            match_idxs = torch.as_tensor(match_list, dtype=torch.long)
+            uv_a = torch.stack([torch.as_tensor(uv_a_vec[0])[match_idxs], torch.as_tensor(uv_a_vec[1])[match_idxs]], 1)
+            uv_b = torch.stack([torch.as_tensor(uv_b_vec[0])[match_idxs], torch.as_tensor(uv_b_vec[1])[match_idxs]], 1)
+            uv_b = torch.stack([uv_b[:, 0].long().clamp(max=image_width - 1),
+                                uv_b[:, 1].long().clamp(max=image_height - 1)], 1)
+            if accumulator is not None:
+                statistics = match_statistics.compute_match_statistics(
+                    uv_a, uv_b, res_a_tensor, res_b_tensor, mask_b
+                )
+                accumulator.extend(
+                    scene_name=scene_name, img_a_idx=img_a_idx, img_b_idx=img_b_idx, **statistics
+                )
+                return accumulator
+
+            df = DCE.compute_descriptor_match_statistics_batch(
+                mask_a, mask_b, uv_a, uv_b, res_a_tensor, res_b_tensor
+            )
+            df["scene_name"] = scene_name
+            df["img_a_idx"] = img_a_idx
+            df["img_b_idx"] = img_b_idx
+            return [df]
+
         for i in match_list:
             uv_a = (uv_a_vec[0][i], uv_a_vec[1][i])
             uv_b_raw = (uv_b_vec[0][i], uv_b_vec[1][i])
@@ -462,6 +535,16 @@ class DenseCorrespondenceEvaluation(object):
                 uv_b_raw, image_width, image_height
             )
 
+            if accumulator is not None:
+                statistics = DCE.compute_descriptor_match_statistics(
+                    mask_a, mask_b, uv_a, uv_b, res_a, res_b,
+                    rgb_a=rgb_a, rgb_b=rgb_b, debug=debug, as_dict=True, backend=backend,
+                )
+                accumulator.append(
+                    scene_name=scene_name, img_a_idx=img_a_idx, img_b_idx=img_b_idx, **statistics
+                )
+                continue
+
             pd_template = DCE.compute_descriptor_match_statistics(
                 mask_a,
                 mask_b,
@@ -472,6 +555,7 @@ class DenseCorrespondenceEvaluation(object):
                 rgb_a=rgb_a,
                 rgb_b=rgb_b,
                 debug=debug,
+                backend=backend,
             )
 
             pd_template.set_value("scene_name", scene_name)
@@ -480,8 +564,48 @@ class DenseCorrespondenceEvaluation(object):
 
             dataframe_list.append(pd_template.dataframe)
 
+        if accumulator is not None:
+            return accumulator
         return dataframe_list
 
+    @staticmethod
+    def benchmark_pair_quantitative_analysis(
+        dcn, dataset, benchmark_set, pair, accumulator, batched=True, backend=None
+    ):
+        """
+        single_same_scene_image_pair_quantitative_analysis() on an image pair of a benchmark
+        set, with its ground truth matches and masks
+
+        :type benchmark_set: BenchmarkSet
+        :type pair: BenchmarkPair
+        :type accumulator: MetricsAccumulator
+        :return: accumulator
+        """
+        DCE = DenseCorrespondenceEvaluation
+        rgb_a, _ = benchmark_set.get_rgb_mask(dataset, pair.scene_name, pair.img_a_idx, pair.row_a)
+        rgb_b, mask_b = benchmark_set.get_rgb_mask(
+            dataset, benchmark_set_module.CANONICAL_SCENE_NAME, pair.img_b_idx, pair.row_b
+        )
+        res_a, res_b = dcn.forward_single_image_tensor_pair(
+            dataset.rgb_image_to_tensor(rgb_a), dataset.rgb_image_to_tensor(rgb_b)
+        )
+        keys = dict(scene_name=pair.scene_name, img_a_idx=pair.img_a_idx, img_b_idx=pair.img_b_idx)
+
+        if batched:
+            statistics = match_statistics.compute_match_statistics(
+                pair.uv_a, pair.uv_b, res_a.data, res_b.data, mask_b
+            )
+            accumulator.extend(**dict(keys, **statistics))
+            return accumulator
+
+        res_a, res_b = res_a.data.cpu().numpy(), res_b.data.cpu().numpy()
+        for uv_a, uv_b in zip(pair.uv_a, pair.uv_b):
+            statistics = DCE.compute_descriptor_match_statistics(
+                None, mask_b, tuple(uv_a), tuple(uv_b), res_a, res_b, as_dict=True, backend=backend
+            )
+            accumulator.append(**dict(keys, **statistics))
+        return accumulator
+
     @staticmethod
     def compute_descriptor_match_statistics(
         mask_a,
@@ -494,21 +618,33 @@ class DenseCorrespondenceEvaluation(object):
         rgb_a=None,
         rgb_b=None,
         debug=False,
+        symmetry_map=None,
+        as_dict=False,
+        backend=None,
     ):
         """
         Computes statistics of descriptor pixelwise match.
+
+        :param symmetry_map: the pixel match errors are the minimum of those to uv_b and to its
+            symmetric pixel. HorizontalMirror if None
+        :type symmetry_map: PixelSymmetryMap
+        :param as_dict: return an OrderedDict of the statistics instead of a DCNEvaluationPandaTemplate
+        :type as_dict: bool
+        :param backend: "numpy" or "torch", see DenseCorrespondenceNetwork.find_best_match()
         """
 
         height, width, _ = res_a.shape
         DCE = DenseCorrespondenceEvaluation
         uv_a = (min(width - 1, uv_a[0]), min(height - 1, uv_a[1]))
-        uv_b_sym = (width - 1 - uv_b[0], uv_b[1])
+        if symmetry_map is None:
+            symmetry_map = HorizontalMirror(width, height)
+        uv_b_sym = symmetry_map.map_uv(uv_b[0], uv_b[1])
         # compute best match
         (
             uv_b_pred,
             best_match_diff,
             norm_diffs,
-        ) = DenseCorrespondenceNetwork.find_best_match(uv_a, res_a, res_b, debug=debug)
+        ) = DenseCorrespondenceNetwork.find_best_match(uv_a, res_a, res_b, debug=debug, backend=backend)
 
         # norm_diffs shape is (H,W)
 
@@ -613,40 +749,75 @@ class DenseCorrespondenceEvaluation(object):
                 circ_color="purple",
             )
 
+        statistics = OrderedDict(
+            [
+                ("pixel_match_error_l2", pixel_match_error_l2),
+                ("pixel_match_error_l2_masked", pixel_match_error_l2_masked),
+                ("pixel_match_error_l1", pixel_match_error_l1),
+                (
+                    "fraction_pixels_closer_than_ground_truth",
+                    fraction_pixels_closer_than_ground_truth,
+                ),
+                (
+                    "fraction_pixels_closer_than_ground_truth_masked",
+                    fraction_pixels_closer_than_ground_truth_masked,
+                ),
+                (
+                    "average_l2_distance_for_false_positives",
+                    average_l2_distance_for_false_positives,
+                ),
+                (
+                    "average_l2_distance_for_false_positives_masked",
+                    average_l2_distance_for_false_positives_masked,
+                ),
+            ]
+        )
+        if as_dict:
+            return statistics
+
         pd_template = DCNEvaluationPandaTemplate()
+        for key, value in statistics.items():
+            pd_template.set_value(key, value)
 
-        pd_template.set_value("pixel_match_error_l2", pixel_match_error_l2)
-        pd_template.set_value(
-            "pixel_match_error_l2_masked", pixel_match_error_l2_masked
-        )
-        pd_template.set_value("pixel_match_error_l1", pixel_match_error_l1)
+        return pd_template
 
-        pd_template.set_value(
-            "fraction_pixels_closer_than_ground_truth",
-            fraction_pixels_closer_than_ground_truth,
-        )
-        pd_template.set_value(
-            "fraction_pixels_closer_than_ground_truth_masked",
-            fraction_pixels_closer_than_ground_truth_masked,
-        )
-        pd_template.set_value(
-            "average_l2_distance_for_false_positives",
-            average_l2_distance_for_false_positives,
+    @staticmethod
+    def compute_descriptor_match_statistics_batch(
+        mask_a, mask_b, uv_a, uv_b, res_a, res_b, symmetry_map=None, device=None
+    ):
+        """
+        compute_descriptor_match_statistics() of all the matches of an image pair at once,
+        see match_statistics.compute_match_statistics()
+
+        :param uv_a: [N, 2] (u, v) pixels of image a
+        :param uv_b: [N, 2] (u, v) ground truth pixels of image b, clipped and rounded
+        :param res_a, res_b: descriptors, torch.Tensor (the statistics are computed on their
+            device) or numpy.ndarray
+        :return: the N rows of DCNEvaluationPandaTemplate, with the same (zero) index as
+            the concatenation of the per-match dataframes
+        :rtype: pandas.DataFrame
+        """
+        statistics = match_statistics.compute_match_statistics(
+            uv_a, uv_b, res_a, res_b, mask_b, symmetry_map=symmetry_map, device=device
         )
-        pd_template.set_value(
-            "average_l2_distance_for_false_positives_masked",
-            average_l2_distance_for_false_positives_masked,
+        num_matches = len(statistics["pixel_match_error_l2"])
+        df = pd.DataFrame(
+            np.nan, index=np.zeros(num_matches, dtype=np.int64),
+            columns=DCNEvaluationPandaTemplate.columns,
         )
-
-        return pd_template
+        for column, values in statistics.items():
+            df[column] = values
+        return df
 
     @staticmethod
-    def get_random_scenes_and_image_pairs(dataset, num_pairs=5):
+    def get_random_scenes_and_image_pairs(dataset, num_pairs=5, benchmark_set=None):
         """
         Given a dataset, chose a variety of random scenes and image pairs
 
         :param dataset: dataset from which to draw a scene and image pairs
         :type dataset: SpartanDataset
+        :param benchmark_set: (optional) the first num_pairs pairs of a benchmark set instead
+        :type benchmark_set: BenchmarkSet or str (.npz file)
 
         :return: scene_names, img_pairs
         :rtype: list[str], list of lists, where each of the lists are [img_a_idx, img_b_idx], for example:
@@ -654,6 +825,10 @@ class DenseCorrespondenceEvaluation(object):
              [114,225]]
         """
 
+        benchmark_set = benchmark_set_module.load_benchmark_set(benchmark_set)
+        if benchmark_set is not None:
+            return benchmark_set.get_scenes_and_image_pairs(num_pairs)
+
         scene_names = []
 
         img_pairs = []
@@ -671,87 +846,120 @@ class DenseCorrespondenceEvaluation(object):
         dcn,
         data_loader,
         loss_config,
+        symmetry=False,
         num_iterations=500,
     ):
         """
 
-        Computes the loss for the given number of iterations
+        Computes the contrastive loss for the given number of iterations
 
         :param dcn:
         :type dcn:
-        :param data_loader:
+        :param data_loader: DataLoader of a SpartanDataset with collate_fn=collate_image_pairs
         :type data_loader:
+        :param loss_config: loss_function section of the training config
+        :type loss_config: dict
+        :param symmetry: use the symmetric matches in the loss
+        :type symmetry: bool
         :param num_iterations:
         :type num_iterations:
-        :return:
+        :return: loss, match_loss, non_match_loss (masked + background + blind) averaged over the iterations
         :rtype:
         """
         dcn.eval()
 
-        # loss_vec = np.zeros(num_iterations)
         loss_vec = []
         match_loss_vec = []
         non_match_loss_vec = []
-        counter = 0
         pixelwise_contrastive_loss = PixelwiseContrastiveLoss(
             dcn.image_shape, config=loss_config
         )
 
-        batch_size = 1
-
         for i, data in enumerate(data_loader, 0):
 
             # get the inputs
             (
-                data_type,
+                match_type,
                 img_a,
                 img_b,
+                img_a_mask,
+                img_b_mask,
                 matches_a,
                 matches_b,
-                non_matches_a,
-                non_matches_b,
+                masked_non_matches_a,
+                masked_non_matches_b,
+                background_non_matches_a,
+                background_non_matches_b,
+                blind_non_matches_a,
+                blind_non_matches_b,
                 metadata,
             ) = data
-            data_type = data_type[0]
 
-            if len(matches_a[0]) == 0:
+            if (match_type == -1).all() or SpartanDataset.is_empty(matches_a):
                 print("didn't have any matches, continuing")
                 continue
 
             img_a = Variable(img_a.cuda(), requires_grad=False)
             img_b = Variable(img_b.cuda(), requires_grad=False)
 
-            if data_type == "matches":
-                matches_a = Variable(matches_a.cuda().squeeze(0), requires_grad=False)
-                matches_b = Variable(matches_b.cuda().squeeze(0), requires_grad=False)
-                non_matches_a = Variable(
-                    non_matches_a.cuda().squeeze(0), requires_grad=False
-                )
-                non_matches_b = Variable(
-                    non_matches_b.cuda().squeeze(0), requires_grad=False
+            (
+                matches_a,
+                matches_b,
+                masked_non_matches_a,
+                masked_non_matches_b,
+                background_non_matches_a,
+                background_non_matches_b,
+                blind_non_matches_a,
+                blind_non_matches_b,
+            ) = [
+                Variable(indices.cuda(), requires_grad=False)
+                for indices in (
+                    matches_a,
+                    matches_b,
+                    masked_non_matches_a,
+                    masked_non_matches_b,
+                    background_non_matches_a,
+                    background_non_matches_b,
+                    blind_non_matches_a,
+                    blind_non_matches_b,
                 )
+            ]
 
-            # run both images through the network
-            image_a_pred = dcn.forward(img_a)
-            image_a_pred = dcn.process_network_output(image_a_pred, batch_size)
+            with torch.no_grad():
+                # run both images through the network
+                image_a_pred, image_b_pred = dcn.forward_pair(img_a, img_b)
 
-            image_b_pred = dcn.forward(img_b)
-            image_b_pred = dcn.process_network_output(image_b_pred, batch_size)
-
-            # get loss
-            if data_type == "matches":
-                loss, match_loss, non_match_loss = pixelwise_contrastive_loss.get_loss(
+                # get loss
+                (
+                    loss,
+                    match_loss,
+                    masked_non_match_loss,
+                    background_non_match_loss,
+                    blind_non_match_loss,
+                ) = loss_composer.get_contrastive_loss(
+                    pixelwise_contrastive_loss,
+                    match_type,
+                    img_a,
+                    img_b,
                     image_a_pred,
                     image_b_pred,
                     matches_a,
                     matches_b,
-                    non_matches_a,
-                    non_matches_b,
+                    masked_non_matches_a,
+                    masked_non_matches_b,
+                    background_non_matches_a,
+                    background_non_matches_b,
+                    blind_non_matches_a,
+                    blind_non_matches_b,
+                    symmetry=symmetry,
                 )
+            non_match_loss = (
+                masked_non_match_loss + background_non_match_loss + blind_non_match_loss
+            )
 
-                loss_vec.append(loss.data[0])
-                non_match_loss_vec.append(non_match_loss.data[0])
-                match_loss_vec.append(match_loss.data[0])
+            loss_vec.append(loss.item())
+            non_match_loss_vec.append(non_match_loss.item())
+            match_loss_vec.append(match_loss.item())
 
             if i > num_iterations:
                 break
@@ -926,6 +1134,8 @@ class DenseCorrespondenceEvaluation(object):
         compute_descriptor_statistics=True,
         cross_scene=False,
         dataset=None,
+        benchmark_sets=None,
+        backend=None,
     ):
         """
         Runs all the quantitative evaluations on the model folder
@@ -940,6 +1150,10 @@ class DenseCorrespondenceEvaluation(object):
 
         :param model_folder:
         :type model_folder:
+        :param benchmark_sets: (optional) benchmark set (BenchmarkSet or .npz file) of the
+            train and / or test evaluation, e.g. dict(test="benchmark_test.npz")
+        :type benchmark_sets: dict
+        :param backend: "numpy" or "torch", see DenseCorrespondenceNetwork.find_best_match()
         :return:
         :rtype:
         """
@@ -947,6 +1161,8 @@ class DenseCorrespondenceEvaluation(object):
         utils.reset_random_seed()
 
         DCE = DenseCorrespondenceEvaluation
+        if benchmark_sets is None:
+            benchmark_sets = dict()
 
         model_folder = utils.convert_to_absolute_path(model_folder)
         print("got", model_folder)
@@ -995,10 +1211,12 @@ class DenseCorrespondenceEvaluation(object):
             dataset,
             num_image_pairs=num_image_pairs,
             num_matches_per_image_pair=num_matches_per_image_pair,
+            benchmark_set=benchmark_sets.get("train"),
+            backend=backend,
         )
 
         train_csv = os.path.join(train_output_dir, "data.csv")
-        df.to_csv(train_csv)
+        metrics_accumulator.save_dataframe(df, train_csv)
 
         logging.info("Evaluating network on test data")
         dataset.set_test_mode()
@@ -1007,16 +1225,18 @@ class DenseCorrespondenceEvaluation(object):
             dataset,
             num_image_pairs=num_image_pairs,
             num_matches_per_image_pair=num_matches_per_image_pair,
+            benchmark_set=benchmark_sets.get("test"),
+            backend=backend,
         )
 
         test_csv = os.path.join(test_output_dir, "data.csv")
-        df.to_csv(test_csv)
+        metrics_accumulator.save_dataframe(df, test_csv)
 
         if cross_scene:
             logging.info("Evaluating network on cross scene data")
             df = DCE.evaluate_network_cross_scene(dcn=dcn, dataset=dataset, save=False)
             cross_scene_csv = os.path.join(cross_scene_output_dir, "data.csv")
-            df.to_csv(cross_scene_csv)
+            metrics_accumulator.save_dataframe(df, cross_scene_csv)
 
         logging.info("Making plots")
         DCEP = DenseCorrespondenceEvaluationPlotter
@@ -1044,7 +1264,7 @@ class DenseCorrespondenceEvaluation(object):
             logging.info("Evaluating network on across object data")
             df = DCE.evaluate_network_across_objects(dcn=dcn, dataset=dataset)
             across_object_csv = os.path.join(across_object_output_dir, "data.csv")
-            df.to_csv(across_object_csv)
+            metrics_accumulator.save_dataframe(df, across_object_csv)
             DCEP.run_on_single_dataframe_across_objects(
                 across_object_csv, label="across_object", save=True
             )
@@ -1053,30 +1273,41 @@ class DenseCorrespondenceEvaluation(object):
 
     @staticmethod
     def evaluate_network_by_zones(
-        dcn, dataset, num_images=100, use_symmetry=False, num_matches=2000, sigma=3
+        dcn, dataset, num_images=100, use_symmetry=False, num_matches=2000, sigma=3, labeler=None, plot=True
     ):
+        """
+        Pixel match errors of random images of a scene, to a canonical image, by shirt zone
+        (see shirt_zones.py) of the ground truth pixel in the canonical image.
+        The matches of each image are found at once, the errors of all the images are then
+        reduced once: to the heatmap of the mean error per canonical pixel and by zone.
+
+        :param labeler: ZoneLabeler, shirt_zones.get_default_labeler() if None
+        :param plot: plot the heatmap
+        :return: count, mean and median pixel_match_error_l2 of each zone
+        :rtype: pandas.DataFrame
+        """
         dcn.eval()
+        if labeler is None:
+            labeler = shirt_zones.get_default_labeler()
 
         scene_name = dataset.get_random_scene_name()
-        scene_name_ref = "shirt_canonical"
-        ref_idx = dataset.get_random_image_index("shirt_canonical")
+        scene_name_ref = SpartanDataset.CANONICAL_SCENE_NAME
+        ref_idx = dataset.get_random_image_index(scene_name_ref)
 
-        # Get reference image
-        rgb_ref, _, mask_ref, _ = dataset.get_rgbd_mask_pose(scene_name_ref, ref_idx)
+        # Get reference image, its descriptors and zones are cached
+        rgb_ref, _, mask_ref = dataset.get_canonical_image_data(ref_idx)
         rgb_ref, mask_ref = (np.asarray(rgb_ref), np.asarray(mask_ref))
-        rgb_ref_tensor = dataset.rgb_image_to_tensor(rgb_ref)
-        res_ref = dcn.forward_single_image_tensor(rgb_ref_tensor).data.cpu().numpy()
+        res_ref = descriptor_cache.get_default_cache().get_canonical_descriptors(dcn, dataset, ref_idx)
+        zone_map = labeler.get_zone_map(mask_ref, key=(scene_name_ref, ref_idx))
 
-        img_width, img_height = mask_ref.shape
+        img_height, img_width = mask_ref.shape
+        symmetry_map = HorizontalMirror(img_width, img_height)
 
         # Get the knots for the canonical and evaluation datasets
         knots = dataset.get_knots_info(scene_name)
         knots_canonical = dataset.get_knots_info(scene_name_ref)
 
-        # Matrix of results
-        img_dists = np.zeros(rgb_ref.shape[:2])
-        counts = np.ones(rgb_ref.shape[:2])
-
+        uv_ref_list, errors_list = [], []
         img_idxs = random.sample(list(knots), num_images)
         for i, img_idx in enumerate(img_idxs):
             print(
@@ -1089,59 +1320,78 @@ class DenseCorrespondenceEvaluation(object):
             # Get evaluation image
             rgb_img, mask_img = dataset.get_rgb_mask(scene_name, img_idx)
             rgb_img_tensor = dataset.rgb_image_to_tensor(rgb_img)
-            res_img = dcn.forward_single_image_tensor(rgb_img_tensor).data.cpu().numpy()
+            res_img = dcn.forward_single_image_tensor(rgb_img_tensor).data
 
             (
                 uv_img_vec,
                 uv_ref_vec,
-            ) = correspondence_finder.batch_find_pixel_correspondences(
-                img_knots, ref_img_knots, device="GPU"
+            ) = correspondence_finder.find_pixel_correspondences(
+                img_knots, ref_img_knots, device="cuda"
             )
 
             total_num_matches = len(uv_img_vec[0])
-            num_matches = min(num_matches, total_num_matches)
-            match_list = random.sample(range(0, total_num_matches), num_matches)
+            match_list = random.sample(range(0, total_num_matches), min(num_matches, total_num_matches))
+            if len(match_list) == 0:
+                continue
 
-            for j in match_list:
-                uv_img = (uv_img_vec[0][j], uv_img_vec[1][j])
-                uv_ref = (uv_ref_vec[0][j].cpu(), uv_ref_vec[1][j].cpu())
-                uv_ref_sym = (img_width - 1 - uv_ref[0], uv_ref[1])
+            uv_img = torch.stack(tuple(uv_img_vec), 1)[match_list]
+            uv_ref = torch.stack(tuple(uv_ref_vec), 1)[match_list].cpu().long()
 
-                uv_ref_pred, _, _ = DenseCorrespondenceNetwork.find_best_match(
-                    uv_img, res_img, res_ref, mask_b=mask_img
-                )
+            # all the matches of the image at once, with the same mask as the per-match find_best_match()
+            matches = descriptor_matcher.find_best_matches_for_pixels(
+                uv_img, res_img, res_ref, mask_b=np.asarray(mask_img)
+            )
+            uv_ref_pred = matches.masked_uv.cpu()
+            u_ref_sym, v_ref_sym = symmetry_map.map_uv(uv_ref[:, 0], uv_ref[:, 1])
+            uv_ref_sym = torch.stack((u_ref_sym, v_ref_sym), 1)
+            pixel_match_error_l2 = torch.min(
+                (uv_ref - uv_ref_pred).double().norm(2, dim=1),
+                (uv_ref_sym - uv_ref_pred).double().norm(2, dim=1),
+            )
 
-                pixel_match_error_l2 = min(
-                    np.linalg.norm((np.array(uv_ref) - np.array(uv_ref_pred)), ord=2),
-                    np.linalg.norm(
-                        (np.array(uv_ref_sym) - np.array(uv_ref_pred)), ord=2
-                    ),
-                )
+            uv_ref_list.append(uv_ref.numpy())
+            errors_list.append(pixel_match_error_l2.numpy())
+
+        uv_ref = np.concatenate(uv_ref_list) if uv_ref_list else np.zeros((0, 2), dtype=np.int64)
+        errors = np.concatenate(errors_list) if errors_list else np.zeros(0)
+        u_ref, v_ref = uv_ref[:, 0], uv_ref[:, 1]
 
-                img_dists[int(uv_ref[1]), int(uv_ref[0])] += pixel_match_error_l2
-                counts[int(uv_ref[1]), int(uv_ref[0])] += 1
+        # Matrix of results
+        img_dists = np.zeros(rgb_ref.shape[:2])
+        counts = np.ones(rgb_ref.shape[:2])
+        np.add.at(img_dists, (v_ref, u_ref), errors)
+        np.add.at(counts, (v_ref, u_ref), 1)
+
+        df_zones = shirt_zones.aggregate_by_zone(
+            zone_map[v_ref, u_ref], {"pixel_match_error_l2": errors}
+        )
 
-        img_dists_norm = np.divide(img_dists, counts)
-        #         img_dists_norm = dc_plotting.normalize_vec(img_dists_norm)
-        img_dists_norm = gaussian_filter(img_dists_norm, sigma=sigma)
-        img_dists_norm *= mask_ref
+        if plot:
+            img_dists_norm = np.divide(img_dists, counts)
+            #         img_dists_norm = dc_plotting.normalize_vec(img_dists_norm)
+            img_dists_norm = ndimage.gaussian_filter(img_dists_norm, sigma=sigma)
+            img_dists_norm *= mask_ref
 
-        plt.imshow(img_dists_norm, cmap="jet")
-        plt.colorbar()
-        plt.title("Heatmap of pixel distance to the best match")
+            plt.imshow(img_dists_norm, cmap="jet")
+            plt.colorbar()
+            plt.title("Heatmap of pixel distance to the best match")
+
+        return df_zones
 
     @staticmethod
     def evaluate_network_qualitative(
         dcn,
         dataset,
         type_of_analysis="single_match",
-        num_pairs=5
+        num_pairs=5,
+        backend=None,
     ):
         """Qualitative analysis of the network
         :param dcn: DenseCorrespondenceNetwork
         :param dataset: dataset
         :param type_of_analysis: ['general', 'single_match', 'circular', 'iterative', 'inverse_prediction']
         :param num_pairs: number of pairs of image to sample
+        :param backend: "numpy" or "torch", see DenseCorrespondenceNetwork.find_best_match()
         """
         dcn.eval()
         (
@@ -1157,16 +1407,16 @@ class DenseCorrespondenceEvaluation(object):
             )
             if type_of_analysis == "single_match":
                 DenseCorrespondenceEvaluation.single_match_qualitative_analysis(
-                    data, pca_plot=True
+                    data, pca_plot=True, backend=backend
                 )
             elif type_of_analysis == "general":
-                DenseCorrespondenceEvaluation.image_pair_qualitative_analysis(dcn, data)
+                DenseCorrespondenceEvaluation.image_pair_qualitative_analysis(dcn, data, backend=backend)
             elif type_of_analysis == "circular":
                 # deprecated
-                DenseCorrespondenceEvaluation.circular_qualitative_analysis(data)
+                DenseCorrespondenceEvaluation.circular_qualitative_analysis(data, backend=backend)
             elif type_of_analysis == "iterative":
                 # deprecated
-                DenseCorrespondenceEvaluation.iterative_qualitative_analysis(data)
+                DenseCorrespondenceEvaluation.iterative_qualitative_analysis(data, backend=backend)
             elif type_of_analysis == "inverse_prediction":
                 data = DenseCorrespondenceEvaluation.get_data(
                     dcn,
@@ -1177,7 +1427,7 @@ class DenseCorrespondenceEvaluation(object):
                     inverse=True,
                 )
                 DenseCorrespondenceEvaluation.single_match_qualitative_analysis(
-                    data, pca_plot=True
+                    data, pca_plot=True, backend=backend
                 )
 
     @staticmethod
@@ -1210,8 +1460,8 @@ class DenseCorrespondenceEvaluation(object):
         rgb_b_tensor = dataset.rgb_image_to_tensor(rgb_b)
 
         # these are Variables holding torch.FloatTensors, first grab the data, then convert to numpy
-        res_a = dcn.forward_single_image_tensor(rgb_a_tensor).data.cpu()
-        res_b = dcn.forward_single_image_tensor(rgb_b_tensor).data.cpu()
+        res_a, res_b = dcn.forward_single_image_tensor_pair(rgb_a_tensor, rgb_b_tensor)
+        res_a, res_b = res_a.data.cpu(), res_b.data.cpu()
 
         # get real matches
         if real_data:
@@ -1230,7 +1480,7 @@ class DenseCorrespondenceEvaluation(object):
             (
                 uv_a_vec,
                 uv_b_vec,
-            ) = correspondence_finder.batch_find_pixel_correspondences(
+            ) = correspondence_finder.find_pixel_correspondences(
                 img_a_knots, img_b_knots
             )
             total_matches = len(uv_a_vec[0])
@@ -1281,7 +1531,7 @@ class DenseCorrespondenceEvaluation(object):
         )
 
     @staticmethod
-    def image_pair_qualitative_analysis(dcn, data, num_matches=7):
+    def image_pair_qualitative_analysis(dcn, data, num_matches=7, backend=None):
         (
             rgb_a_array,
             rgb_b_array,
@@ -1322,7 +1572,7 @@ class DenseCorrespondenceEvaluation(object):
             # convert to (u,v) format
             pixel_a = [sampled_idx_list[1][i], sampled_idx_list[0][i]]
             best_match_uv, _, _ = DenseCorrespondenceNetwork.find_best_match(
-                pixel_a, res_a, res_b
+                pixel_a, res_a, res_b, backend=backend
             )
 
             # be careful, OpenCV format is  (u,v) = (right, down)
@@ -1356,7 +1606,7 @@ class DenseCorrespondenceEvaluation(object):
         plt.show()
 
     @staticmethod
-    def single_match_qualitative_analysis(data, pca_plot=False):
+    def single_match_qualitative_analysis(data, pca_plot=False, backend=None):
 
         (
             rgb_a_array,
@@ -1381,10 +1631,10 @@ class DenseCorrespondenceEvaluation(object):
         axes[0, 0].set_title("Img A: Queried pixel")
 
         uv_b, _, norm_diffs = DenseCorrespondenceNetwork.find_best_match(
-            pixel_a, res_a.numpy(), res_b.numpy()
+            pixel_a, res_a.numpy(), res_b.numpy(), backend=backend
         )
         uv_b_masked, _, _ = DenseCorrespondenceNetwork.find_best_match(
-            pixel_a, res_a.numpy(), res_b.numpy(), mask_b=mask_b
+            pixel_a, res_a.numpy(), res_b.numpy(), mask_b=mask_b, backend=backend
         )
 
         rgb_b_array = DenseCorrespondenceEvaluation.draw_a_circle(
@@ -1437,7 +1687,7 @@ class DenseCorrespondenceEvaluation(object):
         # Compute PCA of the canonical image
         if pca_plot:
             d = res_a.shape[-1]
-            pca = PCA(n_components=3)
+            pca = sklearn_decomposition.PCA(n_components=3)
             res_b_pc = pca.fit_transform(res_b.reshape((-1, d))).reshape(
                 res_b.shape[0], res_b.shape[1], -1
             )
@@ -1461,7 +1711,7 @@ class DenseCorrespondenceEvaluation(object):
         plt.show()
 
     @staticmethod
-    def circular_qualitative_analysis(data):
+    def circular_qualitative_analysis(data, backend=None):
 
         (
             rgb_a_array,
@@ -1495,7 +1745,7 @@ class DenseCorrespondenceEvaluation(object):
         axes[0].set_title("Queried pixel")
 
         uv_b_masked, _, _ = DenseCorrespondenceNetwork.find_best_match(
-            pixel_a, res_a.numpy(), res_b.numpy(), mask_b=mask_b
+            pixel_a, res_a.numpy(), res_b.numpy(), mask_b=mask_b, backend=backend
         )
         rgb_b_array = DenseCorrespondenceEvaluation.draw_a_circle(
             rgb_b_array, uv_b_masked, color=COLOR_BLUE
@@ -1505,7 +1755,7 @@ class DenseCorrespondenceEvaluation(object):
         )
         for pixel_a_random in pixels_around_a:
             uv_b_masked_random, _, _ = DenseCorrespondenceNetwork.find_best_match(
-                pixel_a_random, res_a.numpy(), res_b.numpy(), mask_b=mask_b
+                pixel_a_random, res_a.numpy(), res_b.numpy(), mask_b=mask_b, backend=backend
             )
             rgb_b_array = DenseCorrespondenceEvaluation.draw_a_circle(
                 rgb_b_array, uv_b_masked_random, color=COLOR_RED, radius=5
@@ -1514,7 +1764,7 @@ class DenseCorrespondenceEvaluation(object):
         axes[1].set_title("Best match")
 
     @staticmethod
-    def iterative_qualitative_analysis(data, num_iters=8):
+    def iterative_qualitative_analysis(data, num_iters=8, backend=None):
 
         (
             rgb_a_array,
@@ -1548,7 +1798,7 @@ class DenseCorrespondenceEvaluation(object):
 
         for iter in range(1, num_iters):
             uv_b, _, _ = DenseCorrespondenceNetwork.find_best_match(
-                pixel_a, res_a.numpy(), res_b.numpy(), mask_b=mask_b
+                pixel_a, res_a.numpy(), res_b.numpy(), mask_b=mask_b, backend=backend
             )
 
             axes[iter // ncols, iter % ncols].imshow(
@@ -1564,7 +1814,7 @@ class DenseCorrespondenceEvaluation(object):
             pixel_a = uv_b
 
     @staticmethod
-    def inverse_prediction_analysis(data):
+    def inverse_prediction_analysis(data, backend=None):
 
         (
             rgb_a_array,
@@ -1612,7 +1862,7 @@ class DenseCorrespondenceEvaluation(object):
 
         #         rgb_a_array = DenseCorrespondenceEvaluation.draw_a_circle(rgb_a_array, closest_pixel, color=COLOR_RED)
         closest_pixel_direct, _, _ = DenseCorrespondenceNetwork.find_best_match(
-            pixel_b, res_b.numpy(), res_a.numpy(), mask_b=mask_a
+            pixel_b, res_b.numpy(), res_a.numpy(), mask_b=mask_a, backend=backend
         )
         rgb_a_array = DenseCorrespondenceEvaluation.draw_a_circle(
             rgb_a_array, closest_pixel_direct, color=COLOR_BLUE
@@ -1622,13 +1872,36 @@ class DenseCorrespondenceEvaluation(object):
 
     @staticmethod
     def evaluate_match_quality(
-        dcn, dataset, num_image_pairs=100, logging_rate=5, kl_loss=False
+        dcn, dataset, num_image_pairs=100, logging_rate=5, kl_loss=False, benchmark_set=None, backend=None
     ):
-        """Evaluation of the quality of the matches as a classification problem"""
+        """Evaluation of the quality of the matches as a classification problem
+
+        :param benchmark_set: (optional) image pairs and matches of a benchmark set instead of
+            random ones
+        :type benchmark_set: BenchmarkSet or str (.npz file)
+        :param backend: "numpy" or "torch", see DenseCorrespondenceNetwork.find_best_match()
+        """
         DCE = DenseCorrespondenceEvaluation
         match_distances = []
         match_probabilities = []
 
+        benchmark_set = benchmark_set_module.load_benchmark_set(benchmark_set)
+        if benchmark_set is not None:
+            num_image_pairs = 0
+            for pair in benchmark_set:
+                DCE.single_image_match_quality(
+                    dcn,
+                    dataset,
+                    pair.scene_name,
+                    pair.img_a_idx,
+                    pair.img_b_idx,
+                    match_distances,
+                    match_probabilities,
+                    kl_loss=kl_loss,
+                    matches=(pair.uv_a, pair.uv_b),
+                    backend=backend,
+                )
+
         for i in range(0, num_image_pairs):
             scene_name = dataset.get_random_scene_name()
             idx_pair = DCE.get_image_pair_random(dataset, scene_name)
@@ -1642,6 +1915,7 @@ class DenseCorrespondenceEvaluation(object):
                 match_distances,
                 match_probabilities,
                 kl_loss=kl_loss,
+                backend=backend,
             )
 
         fig, ax = plt.subplots(nrows=1, ncols=1)
@@ -1657,8 +1931,8 @@ class DenseCorrespondenceEvaluation(object):
         fig, ax = plt.subplots(nrows=1, ncols=2, figsize=(11, 5))
         y = [int(i < 100) for i in match_distances]
         y_confidence = [-i for i in match_probabilities]
-        fpr, tpr, thresholds = roc_curve(y, y_confidence, pos_label=1)
-        auc_score = roc_auc_score(y, y_confidence)
+        fpr, tpr, thresholds = sklearn_metrics.roc_curve(y, y_confidence, pos_label=1)
+        auc_score = sklearn_metrics.roc_auc_score(y, y_confidence)
         ax[0].plot(fpr, tpr)
         ax[0].set_xlabel("False Positive Rate")
         ax[0].set_ylabel("True Positive Rate")
@@ -1666,8 +1940,8 @@ class DenseCorrespondenceEvaluation(object):
 
         best_thresh = 8.6
         y_pred = [int(i < best_thresh) for i in match_probabilities]
-        cf_matrix = confusion_matrix(y, y_pred)
-        cm_display = ConfusionMatrixDisplay(
+        cf_matrix = sklearn_metrics.confusion_matrix(y, y_pred)
+        cm_display = sklearn_metrics.ConfusionMatrixDisplay(
             confusion_matrix=cf_matrix, display_labels=["Non match", "Match"]
         )
         cm_display.plot(ax=ax[1], cmap="inferno")
@@ -1684,50 +1958,63 @@ class DenseCorrespondenceEvaluation(object):
         match_probabilities,
         num_matches=25,
         kl_loss=False,
+        matches=None,
+        backend=None,
     ):
+        """
+        :param matches: (optional) [N, 2] uv_a and uv_b ground truth matches to use, e.g. those
+            of a BenchmarkSet. num_matches random matches of the knots if None
+        :param backend: "numpy" or "torch", see DenseCorrespondenceNetwork.find_best_match()
+        """
 
         rgb_a, mask_a = dataset.get_rgb_mask(scene_name, img_a_idx)
-        rgb_b, mask_b = dataset.get_rgb_mask("shirt_canonical", img_b_idx)
+        rgb_b, _, mask_b = dataset.get_canonical_image_data(img_b_idx)
 
         knots_a = dataset.get_knots_info(scene_name)
-        knots_b = dataset.get_knots_info("shirt_canonical")
+        knots_b = dataset.get_knots_info(SpartanDataset.CANONICAL_SCENE_NAME)
 
         img_a_knots, img_b_knots = knots_a[str(img_a_idx)], knots_b[str(img_b_idx)]
 
         mask_a = np.array(mask_a)
         mask_b = np.array(mask_b)
 
-        # compute dense descriptors
+        # compute dense descriptors, those of the canonical image are cached
         rgb_a_tensor = dataset.rgb_image_to_tensor(rgb_a)
-        rgb_b_tensor = dataset.rgb_image_to_tensor(rgb_b)
 
         # these are Variables holding torch.FloatTensors, first grab the data, then convert to numpy
         res_a = dcn.forward_single_image_tensor(rgb_a_tensor).data.cpu().numpy()
-        res_b = dcn.forward_single_image_tensor(rgb_b_tensor).data.cpu().numpy()
+        res_b = descriptor_cache.get_default_cache().get_canonical_descriptors(dcn, dataset, img_b_idx).numpy()
 
         # find correspondences
-        (uv_a_vec, uv_b_vec) = correspondence_finder.batch_find_pixel_correspondences(
-            img_a_knots, img_b_knots
-        )
+        if matches is not None:
+            uv_a_list, uv_b_list = matches
+            uv_a_vec = (uv_a_list[:, 0], uv_a_list[:, 1])
+            uv_b_vec = (uv_b_list[:, 0], uv_b_list[:, 1])
+            match_list = range(len(uv_a_list))
+        else:
+            (uv_a_vec, uv_b_vec) = correspondence_finder.find_pixel_correspondences(
+                img_a_knots, img_b_knots
+            )
 
-        if uv_a_vec is None:
-            print("no matches found, returning")
-            return None
+            if uv_a_vec is None:
+                print("no matches found, returning")
+                return None
 
-        total_num_matches = len(uv_a_vec[0])
-        num_matches = min(num_matches, total_num_matches)
-        match_list = random.sample(range(0, total_num_matches), num_matches)
+            total_num_matches = len(uv_a_vec[0])
+            num_matches = min(num_matches, total_num_matches)
+            match_list = random.sample(range(0, total_num_matches), num_matches)
 
         image_height, image_width = dcn.image_shape
+        symmetry_map = HorizontalMirror(image_width, image_height)
 
         for i in match_list:
             uv_a = (uv_a_vec[0][i], uv_a_vec[1][i])
             uv_b = (uv_b_vec[0][i], uv_b_vec[1][i])
-            uv_b_sym = (image_width - 1 - uv_b[0], uv_b[1])
+            uv_b_sym = symmetry_map.map_uv(uv_b[0], uv_b[1])
 
             # compute best match
             uv_b_pred, _, norm_diffs = DenseCorrespondenceNetwork.find_best_match(
-                uv_a, res_a, res_b, mask_b=mask_b
+                uv_a, res_a, res_b, mask_b=mask_b, backend=backend
             )
 
             pixel_match_error_l2 = min(
@@ -1785,29 +2072,12 @@ class DenseCorrespondenceEvaluation(object):
         res_a = dcn.forward_single_image_tensor(rgb_a_tensor).data.cpu()
 
         d = res_a.shape[-1]
-        pca = PCA(n_components=3)
+        pca = sklearn_decomposition.PCA(n_components=3)
         res_a_pc = pca.fit_transform(res_a.reshape((-1, d)))
 
-        zones = np.zeros(mask_a.shape)
-        for i, j in itertools.product(range(zones.shape[0]), range(zones.shape[1])):
-            if mask_a[i][j] == 0:
-                zones[i][j] = 0
-            elif j < 270:
-                zones[i][j] = 1
-            elif j > 690:
-                zones[i][j] = 2
-            elif i > 300:
-                zones[i][j] = 3
-            else:
-                zones[i][j] = 4
-
-        translate = {
-            0: "background",
-            1: "left arm",
-            2: "right arm",
-            3: "upper torso",
-            4: "lower torso",
-        }
+        zones = shirt_zones.get_default_labeler().get_zone_map(
+            mask_a, key=("shirt_canonical", img_idx)
+        ).ravel()
 
         colors = sns.color_palette()
         df = pd.DataFrame(
@@ -1815,8 +2085,8 @@ class DenseCorrespondenceEvaluation(object):
                 "pc1": res_a_pc[:, 0],
                 "pc2": res_a_pc[:, 1],
                 "pc3": res_a_pc[:, 2],
-                "color": [colors[int(x)] for x in zones.ravel()],
-                "Shirt zone": [translate[x] for x in zones.ravel()],
+                "color": [colors[x] for x in zones.tolist()],
+                "Shirt zone": shirt_zones.zone_names(zones),
             }
         )
         if masking:
@@ -1842,7 +2112,7 @@ class DenseCorrespondenceEvaluation(object):
             ax[1].set_title("PCA of object descriptors by shirt zone")
             plt.show()
         elif pca_components == 3:
-            plotly.offline.init_notebook_mode()
+            plotly_offline.init_notebook_mode()
             fig = px.scatter_3d(
                 df,
                 x="pc1",
@@ -2117,7 +2387,9 @@ class DenseCorrespondenceEvaluationPlotter(object):
             plt.title("both things")
             plt.show()
 
-        :param path_to_df_csv: full path to csv file
+        :param path_to_df_csv: full path to csv file, or to the .parquet / .feather file
+            written next to it by metrics_accumulator.save_dataframe(), which is read
+            instead of the csv when there is one
         :type path_to_df_csv: string
         :param label: name that will show up labeling this line in the legend
         :type label: string
@@ -2133,7 +2405,7 @@ class DenseCorrespondenceEvaluationPlotter(object):
         if output_dir is None:
             output_dir = os.path.dirname(path_to_csv)
 
-        df = pd.read_csv(path_to_csv, index_col=0, parse_dates=True)
+        df = metrics_accumulator.load_dataframe(path_to_csv)
 
         if "is_valid_masked" not in df:
             use_masked_plots = False
@@ -2183,7 +2455,7 @@ class DenseCorrespondenceEvaluationPlotter(object):
         if output_dir is None:
             output_dir = os.path.dirname(path_to_csv)
 
-        df = pd.read_csv(path_to_csv, index_col=0, parse_dates=True)
+        df = metrics_accumulator.load_dataframe(path_to_csv)
 
         if previous_fig_axes == None:
             N = 1
@@ -0,0 +1,163 @@
+"""
+In-process foreground segmentation of the camera frames of the robot.
+
+Every masker is called on in-memory arrays,
+
+    masker(camera_color_img, camera_depth_img=None) ---> masked_img, mask
+
+with the output contract of correspondences_robot.masking(): masked_img is the
+color image with the background set to 0 and mask is a uint8 [H, W] image, 1 on
+the foreground, with its gaps closed by fill_gaps_mask(). Nothing is written to
+disk and the learned model is loaded once, when the masker is built.
+
+The latency of each stage of the last call, in seconds, is in masker.timings.
+"""
+
+import time
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+DEFAULT_MIN_DEPTH = 500
+DEFAULT_MAX_DEPTH = 930
+DEFAULT_CLOSE_KERNEL_SIZE = 10
+
+
+def fill_gaps_mask(mask, kernel_size=DEFAULT_CLOSE_KERNEL_SIZE):
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (kernel_size, kernel_size))
+    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel)
+    return mask
+
+
+def correct_mask_with_depth(original_mask, camera_depth_img, min_depth=DEFAULT_MIN_DEPTH,
+                            max_depth=DEFAULT_MAX_DEPTH):
+    # Delete from the original_mask those points with "infinite" depth
+    mask_depth = (camera_depth_img < max_depth).astype("uint8")
+    mask_depth *= (camera_depth_img > min_depth).astype("uint8")
+    return original_mask * mask_depth
+
+
+def apply_mask(camera_color_img, mask):
+    """
+    :return: camera_color_img with the pixels out of mask set to 0
+    """
+    return camera_color_img * mask.astype(camera_color_img.dtype)[:, :, np.newaxis]
+
+
+class ForegroundMasker(object):
+    """
+    Base class of the maskers, subclasses implement compute_mask()
+    """
+
+    def __init__(self, close_kernel_size=DEFAULT_CLOSE_KERNEL_SIZE):
+        """
+        :param close_kernel_size: size of the morphological close of the mask, no close if None
+        """
+        self._close_kernel_size = close_kernel_size
+        self._timings = OrderedDict()
+
+    @property
+    def timings(self):
+        """
+        OrderedDict stage name ---> seconds, of the last call
+        """
+        return self._timings
+
+    def _time_stage(self, name, start):
+        now = time.time()
+        self._timings[name] = now - start
+        return now
+
+    def compute_mask(self, camera_color_img, camera_depth_img=None):
+        """
+        :return: uint8 [H, W] mask before the close, 1 on the foreground
+        """
+        raise NotImplementedError
+
+    def __call__(self, camera_color_img, camera_depth_img=None):
+        """
+        :param camera_color_img: numpy.ndarray [H, W, 3] uint8, as given by the camera (BGR)
+        :param camera_depth_img: (optional) numpy.ndarray [H, W] depth image in millimeters
+        :return: masked_img numpy.ndarray [H, W, 3], mask numpy.ndarray [H, W] uint8
+        """
+        self._timings = OrderedDict()
+        start = call_start = time.time()
+        mask = self.compute_mask(camera_color_img, camera_depth_img)
+        start = self._time_stage("mask", start)
+
+        if self._close_kernel_size is not None:
+            mask = fill_gaps_mask(mask, self._close_kernel_size)
+            start = self._time_stage("close", start)
+
+        masked_img = apply_mask(camera_color_img, mask)
+        self._timings["total"] = self._time_stage("apply", start) - call_start
+        return masked_img, mask
+
+
+class DepthThresholdMasker(ForegroundMasker):
+    """
+    Foreground = pixels with a depth in (min_depth, max_depth), see correct_mask_with_depth()
+    """
+
+    def __init__(self, min_depth=DEFAULT_MIN_DEPTH, max_depth=DEFAULT_MAX_DEPTH,
+                 close_kernel_size=DEFAULT_CLOSE_KERNEL_SIZE):
+        super(DepthThresholdMasker, self).__init__(close_kernel_size)
+        self._min_depth = min_depth
+        self._max_depth = max_depth
+
+    def compute_mask(self, camera_color_img, camera_depth_img=None):
+        if camera_depth_img is None:
+            raise ValueError("DepthThresholdMasker needs the depth image")
+        mask = np.ones(camera_depth_img.shape[:2], dtype=np.uint8)
+        return correct_mask_with_depth(mask, camera_depth_img, self._min_depth, self._max_depth)
+
+
+class LearnedMasker(ForegroundMasker):
+    """
+    Salient object segmentation of backgroundremover (u2net), the model that the
+    backgroundremover command line tool loads on every call, loaded once here.
+    If a depth image is given, the mask is also corrected with correct_mask_with_depth().
+    """
+
+    def __init__(self, model_name="u2net", threshold=0, min_depth=DEFAULT_MIN_DEPTH, max_depth=DEFAULT_MAX_DEPTH,
+                 close_kernel_size=DEFAULT_CLOSE_KERNEL_SIZE):
+        """
+        :param model_name: u2net, u2netp or u2net_human_seg
+        :param threshold: pixels with a predicted alpha above threshold (0-255) are foreground
+        """
+        super(LearnedMasker, self).__init__(close_kernel_size)
+        # optional dependency, only needed by this masker
+        from backgroundremover import bg
+        from backgroundremover.u2net import detect
+        self._predict = detect.predict
+        self._model = bg.get_model(model_name)
+        self._threshold = threshold
+        self._min_depth = min_depth
+        self._max_depth = max_depth
+
+    def compute_mask(self, camera_color_img, camera_depth_img=None):
+        start = time.time()
+        rgb = cv2.cvtColor(camera_color_img, cv2.COLOR_BGR2RGB)
+        alpha = np.array(self._predict(self._model, rgb).convert("L"))
+        if alpha.shape != camera_color_img.shape[:2]:
+            alpha = cv2.resize(alpha, (camera_color_img.shape[1], camera_color_img.shape[0]))
+        mask = (alpha > self._threshold).astype("uint8")
+        start = self._time_stage("segmentation", start)
+
+        if camera_depth_img is not None:
+            mask = correct_mask_with_depth(mask, camera_depth_img, self._min_depth, self._max_depth)
+            self._time_stage("depth", start)
+        return mask
+
+
+def get_masker(masker_type="depth", **kwargs):
+    """
+    :param masker_type: "depth" for DepthThresholdMasker, "learned" for LearnedMasker
+    :rtype: ForegroundMasker
+    """
+    if masker_type == "depth":
+        return DepthThresholdMasker(**kwargs)
+    elif masker_type == "learned":
+        return LearnedMasker(**kwargs)
+    raise ValueError("unknown masker_type %s" % masker_type)
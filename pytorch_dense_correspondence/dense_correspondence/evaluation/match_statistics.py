@@ -0,0 +1,187 @@
+"""
+Batched descriptor match statistics, in torch.
+
+compute_match_statistics() computes the metrics of
+DenseCorrespondenceEvaluation.compute_descriptor_match_statistics() for all the
+matches (uv_a, uv_b) of an image pair at once, on the device of res_a:
+
+    - pixel_match_error_l2, pixel_match_error_l2_masked, pixel_match_error_l1
+    - fraction_pixels_closer_than_ground_truth(_masked)
+    - average_l2_distance_for_false_positives(_masked)
+
+The matches are processed in chunks of query_chunk_size, so that the memory used
+is [query_chunk_size, H, W]. The operations are those of the per-match code with
+the numpy find_best_match() backend (same dtypes, same 1e6 mask penalty, first
+index of ties), so the numbers are the same as the per-match ones, up to the
+summation order of the float descriptor distances. compare_with_per_match()
+checks it on a fixture:
+
+    python dense_correspondence/evaluation/match_statistics.py
+"""
+
+import sys
+from collections import OrderedDict
+
+import numpy as np
+import torch
+
+import dense_correspondence_manipulation.utils.utils as utils
+
+utils.add_dense_correspondence_to_python_path()
+from dense_correspondence.correspondence_tools.pixel_symmetry import HorizontalMirror
+from dense_correspondence.network.descriptor_matcher import to_tensor
+
+DEFAULT_QUERY_CHUNK_SIZE = 16
+
+STATISTICS_COLUMNS = [
+    "pixel_match_error_l2",
+    "pixel_match_error_l2_masked",
+    "pixel_match_error_l1",
+    "fraction_pixels_closer_than_ground_truth",
+    "fraction_pixels_closer_than_ground_truth_masked",
+    "average_l2_distance_for_false_positives",
+    "average_l2_distance_for_false_positives_masked",
+]
+
+
+def _l2(du, dv):
+    return (du * du + dv * dv).double().sqrt()
+
+
+def _l1(du, dv):
+    return (du.abs() + dv.abs()).double()
+
+
+def _average_distance_to(closer, u_grid, v_grid, u, v):
+    """
+    Average pixel distance of the pixels closer than ground truth to (u, v), 0 if there are none
+    :param closer: torch.BoolTensor [Q, H, W]
+    """
+    distances = ((u_grid - u[:, None, None]) ** 2 + (v_grid - v[:, None, None]) ** 2).double().sqrt()
+    count = closer.sum((1, 2))
+    total = (distances * closer).sum((1, 2))
+    return torch.where(count > 0, total / count.clamp(min=1), torch.zeros_like(total))
+
+
+def compute_match_statistics(uv_a, uv_b, res_a, res_b, mask_b, symmetry_map=None, device=None,
+                             query_chunk_size=DEFAULT_QUERY_CHUNK_SIZE):
+    """
+    Match statistics of Q matches of an image pair
+
+    :param uv_a: [Q, 2] (u, v) pixels of image a, clipped to the image
+    :param uv_b: [Q, 2] (u, v) ground truth pixels of image b, already clipped and rounded
+        as in DenseCorrespondenceEvaluation.clip_pixel_to_image_size_and_round()
+    :param res_a, res_b: [H, W, D] descriptor images, torch.Tensor or numpy.ndarray
+    :param mask_b: [H, W] mask of image b, as given to compute_descriptor_match_statistics()
+    :type mask_b: numpy.ndarray
+    :param symmetry_map: the pixel match errors are the minimum of those to uv_b and to its
+        symmetric pixel. HorizontalMirror if None
+    :type symmetry_map: PixelSymmetryMap
+    :param device: device of the computation if res_a is a numpy.ndarray, that of res_a otherwise
+    :return: OrderedDict with a numpy.ndarray [Q] for each of STATISTICS_COLUMNS
+    """
+    res_a = to_tensor(res_a, device)
+    device = res_a.device
+    res_b = to_tensor(res_b, device)
+    height, width, _ = res_a.shape
+    if symmetry_map is None:
+        symmetry_map = HorizontalMirror(width, height)
+
+    uv_a = to_tensor(uv_a, device).long().reshape(-1, 2)
+    u_a, v_a = uv_a[:, 0].clamp(max=width - 1), uv_a[:, 1].clamp(max=height - 1)
+    uv_b = to_tensor(uv_b, device).long().reshape(-1, 2)
+    u_b, v_b = uv_b[:, 0], uv_b[:, 1]
+    u_b_sym, v_b_sym = symmetry_map.map_uv(u_b, v_b)
+
+    # same penalty as the per-match code, with the numpy dtype promotion of the mask
+    if isinstance(mask_b, torch.Tensor):
+        mask_b = mask_b.cpu().numpy()
+    mask_b = np.asarray(mask_b)
+    mask_penalty = torch.from_numpy(np.asarray((1 - mask_b) * 1e6, dtype=np.float64)).to(device)
+    num_pixels_in_image = height * width
+    num_pixels_in_masked_image = np.count_nonzero(mask_b)
+
+    des_a = res_a[v_a, u_a]
+    norm_diff_descriptor_ground_truth = (des_a - res_b[v_b, u_b]).pow(2).sum(1).sqrt()
+    v_grid, u_grid = torch.meshgrid(torch.arange(height, device=device), torch.arange(width, device=device),
+                                    indexing="ij")
+
+    statistics = OrderedDict((column, []) for column in STATISTICS_COLUMNS)
+    for start in range(0, len(des_a), query_chunk_size):
+        chunk = slice(start, start + query_chunk_size)
+        ground_truth = norm_diff_descriptor_ground_truth[chunk][:, None, None]
+
+        # [q, H, W], as in the numpy find_best_match()
+        norm_diffs = (res_b.unsqueeze(0) - des_a[chunk][:, None, None, :]).pow(2).sum(-1).sqrt()
+        aux = norm_diffs.flatten(1).max(1, keepdim=True)[0] - norm_diffs.flatten(1)
+        best_match_idx = aux.argmax(1)
+        masked_norm_diffs = norm_diffs.double() + mask_penalty
+        best_match_idx_masked = masked_norm_diffs.flatten(1).argmin(1)
+
+        u_pred, v_pred = best_match_idx % width, torch.div(best_match_idx, width, rounding_mode="trunc")
+        u_pred_masked = best_match_idx_masked % width
+        v_pred_masked = torch.div(best_match_idx_masked, width, rounding_mode="trunc")
+
+        u_b_chunk, v_b_chunk = u_b[chunk], v_b[chunk]
+        u_b_sym_chunk, v_b_sym_chunk = u_b_sym[chunk], v_b_sym[chunk]
+        statistics["pixel_match_error_l2"].append(torch.minimum(
+            _l2(u_b_chunk - u_pred, v_b_chunk - v_pred), _l2(u_b_sym_chunk - u_pred, v_b_sym_chunk - v_pred)))
+        statistics["pixel_match_error_l2_masked"].append(torch.minimum(
+            _l2(u_b_chunk - u_pred_masked, v_b_chunk - v_pred_masked),
+            _l2(u_b_sym_chunk - u_pred_masked, v_b_sym_chunk - v_pred_masked)))
+        statistics["pixel_match_error_l1"].append(torch.minimum(
+            _l1(u_b_chunk - u_pred, v_b_chunk - v_pred), _l1(u_b_sym_chunk - u_pred, v_b_sym_chunk - v_pred)))
+
+        closer = norm_diffs < ground_truth
+        closer_masked = masked_norm_diffs < ground_truth.double()
+        statistics["fraction_pixels_closer_than_ground_truth"].append(
+            closer.sum((1, 2)).double() * 1.0 / num_pixels_in_image)
+        statistics["fraction_pixels_closer_than_ground_truth_masked"].append(
+            closer_masked.sum((1, 2)).double() * 1.0 / num_pixels_in_masked_image)
+        statistics["average_l2_distance_for_false_positives"].append(
+            _average_distance_to(closer, u_grid, v_grid, u_b_chunk, v_b_chunk))
+        statistics["average_l2_distance_for_false_positives_masked"].append(
+            _average_distance_to(closer_masked, u_grid, v_grid, u_b_chunk, v_b_chunk))
+
+    return OrderedDict((column, torch.cat(values).cpu().numpy() if values else np.zeros(0))
+                       for column, values in statistics.items())
+
+
+def compare_with_per_match(num_matches=50, image_shape=(48, 64), descriptor_dimension=3, seed=0, device=None):
+    """
+    Regression fixture: random descriptor images, mask and matches, with duplicated
+    descriptors so that there are ties. Runs the per-match and the batched statistics.
+
+    :return: dict with the max absolute difference of each of STATISTICS_COLUMNS
+    """
+    from dense_correspondence.evaluation.evaluation import DenseCorrespondenceEvaluation
+
+    DCE = DenseCorrespondenceEvaluation
+    height, width = image_shape
+    rng = np.random.RandomState(seed)
+    res_a = rng.randn(height, width, descriptor_dimension).astype(np.float32)
+    res_b = rng.randn(height, width, descriptor_dimension).astype(np.float32)
+    res_b[:, width // 2:] = res_b[:, :width - width // 2]
+    mask_b = np.zeros(image_shape, dtype=np.uint8)
+    mask_b[height // 4: 3 * height // 4, width // 4: 3 * width // 4] = 1
+    uv_a = np.stack((rng.randint(0, width, num_matches), rng.randint(0, height, num_matches)), 1)
+    uv_b = np.stack((rng.randint(0, width, num_matches), rng.randint(0, height, num_matches)), 1)
+
+    df = DCE.compute_descriptor_match_statistics_batch(None, mask_b, uv_a, uv_b, res_a, res_b, device=device)
+    differences = dict()
+    for column in STATISTICS_COLUMNS:
+        per_match = [DCE.compute_descriptor_match_statistics(
+            None, mask_b, tuple(uv_a[i]), tuple(uv_b[i]), res_a, res_b).get_value(column).iloc[0]
+            for i in range(num_matches)]
+        differences[column] = float(np.max(np.abs(np.asarray(per_match) - df[column].values)))
+    return differences
+
+
+if __name__ == "__main__":
+    devices = ["cpu"] + (["cuda"] if torch.cuda.is_available() else [])
+    ok = True
+    for device in devices:
+        for column, difference in compare_with_per_match(device=device).items():
+            ok = ok and difference < 1e-6
+            print("%-6s %-50s %.3g" % (device, column, difference))
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,176 @@
+"""
+Columnar accumulator of evaluation metrics.
+
+The evaluation used to build a one-row pandas DataFrame per match and concatenate
+them at the end. MetricsAccumulator keeps one numpy array per column instead,
+grown geometrically, and builds the DataFrame once:
+
+    accumulator = MetricsAccumulator(DCNEvaluationPandaTemplate.columns)
+    accumulator.append(scene_name="shirt_hanging", pixel_match_error_l2=3.0)  # one row
+    accumulator.extend(scene_name="shirt_hanging", pixel_match_error_l2=errors)  # len(errors) rows
+    df = accumulator.to_dataframe()
+
+save_dataframe() writes the csv file of the analysis folder and, next to it, a
+Parquet (or Feather) file with the same data, which load_dataframe() reads instead
+of the csv. Parquet and Feather need pyarrow, the csv file is written anyway.
+"""
+
+import os
+import logging
+from collections import OrderedDict
+
+import numpy as np
+
+import dense_correspondence_manipulation.utils.utils as utils
+
+pd = utils.LazyModule("pandas")
+
+COLUMNAR_FORMATS = ("parquet", "feather")
+DEFAULT_INITIAL_CAPACITY = 1024
+
+
+class MetricsAccumulator(object):
+
+    def __init__(self, columns, initial_capacity=DEFAULT_INITIAL_CAPACITY):
+        """
+        :param columns: names of the columns, in the order of the DataFrame
+        :type columns: list of str
+        :param initial_capacity: number of rows allocated at first, doubled when full
+        """
+        self._columns = list(columns)
+        self._capacity = max(1, initial_capacity)
+        self._num_rows = 0
+        # arrays are allocated on the first values of their column: float64 for
+        # numbers (nan if missing), object otherwise (None if missing)
+        self._arrays = OrderedDict()
+
+    @property
+    def columns(self):
+        return self._columns
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    def __len__(self):
+        return self._num_rows
+
+    def _allocate(self, column, values):
+        if np.asarray(values).dtype.kind in "biuf":
+            array = np.full(self._capacity, np.nan, dtype=np.float64)
+        else:
+            array = np.full(self._capacity, None, dtype=object)
+        self._arrays[column] = array
+        return array
+
+    def _reserve(self, num_rows):
+        if num_rows <= self._capacity:
+            return
+        capacity = self._capacity
+        while capacity < num_rows:
+            capacity *= 2
+        for column, array in self._arrays.items():
+            grown = np.full(capacity, np.nan if array.dtype != object else None, dtype=array.dtype)
+            grown[:self._num_rows] = array[:self._num_rows]
+            self._arrays[column] = grown
+        self._capacity = capacity
+
+    def extend(self, num_rows=None, **values):
+        """
+        Adds rows. Each value is a sequence with a value per row, or a scalar for all the rows.
+        The columns without values are missing (nan) in the new rows.
+
+        :param num_rows: number of rows, the length of the sequences if None
+        """
+        for column in values:
+            if column not in self._columns:
+                raise KeyError("%s is not in the columns" % (column))
+        if num_rows is None:
+            lengths = [len(v) for v in values.values() if np.ndim(v) > 0]
+            num_rows = lengths[0] if lengths else 1
+
+        start = self._num_rows
+        self._reserve(start + num_rows)
+        for column, value in values.items():
+            if np.ndim(value) > 0 and len(value) != num_rows:
+                raise ValueError("%s has %d values, expected %d" % (column, len(value), num_rows))
+            array = self._arrays.get(column)
+            if array is None:
+                array = self._allocate(column, value)
+            array[start:start + num_rows] = value
+        self._num_rows += num_rows
+
+    def append(self, **values):
+        """
+        Adds one row, values are scalars
+        """
+        self.extend(num_rows=1, **values)
+
+    def to_dataframe(self):
+        """
+        :return: DataFrame with the rows added so far, indexed 0..len(self) - 1
+        :rtype: pandas.DataFrame
+        """
+        data = OrderedDict()
+        for column in self._columns:
+            array = self._arrays.get(column)
+            if array is None:
+                data[column] = np.full(self._num_rows, np.nan)
+            else:
+                data[column] = array[:self._num_rows].copy()
+        return pd.DataFrame(data, columns=self._columns)
+
+
+def get_columnar_filename(path_to_csv, file_format):
+    return os.path.splitext(path_to_csv)[0] + "." + file_format
+
+
+def save_dataframe(df, path_to_csv, formats=("parquet",)):
+    """
+    Writes df to path_to_csv and, with the same name, to each of the columnar formats.
+    A format is skipped (with a warning) if its dependencies are not installed.
+
+    :param formats: subset of COLUMNAR_FORMATS
+    :return: the written files
+    :rtype: list of str
+    """
+    df.to_csv(path_to_csv)
+    filenames = [path_to_csv]
+
+    # columnar formats only support the default index and string column names
+    columnar_df = df.reset_index(drop=True)
+    for file_format in formats:
+        if file_format not in COLUMNAR_FORMATS:
+            raise ValueError("format must be one of %s, got %s" % (COLUMNAR_FORMATS, file_format))
+        filename = get_columnar_filename(path_to_csv, file_format)
+        try:
+            getattr(columnar_df, "to_" + file_format)(filename)
+        except ImportError as e:
+            logging.warning("not writing %s: %s" % (filename, e))
+            continue
+        filenames.append(filename)
+    return filenames
+
+
+def load_dataframe(path, prefer_columnar=True):
+    """
+    Reads a DataFrame written by save_dataframe()
+
+    :param path: .csv, .parquet or .feather file
+    :param prefer_columnar: for a .csv file, read the Parquet / Feather file next to it instead,
+        if there is one at least as recent as the csv
+    :rtype: pandas.DataFrame
+    """
+    extension = os.path.splitext(path)[1].lstrip(".")
+    if extension in COLUMNAR_FORMATS:
+        return getattr(pd, "read_" + extension)(path)
+
+    if prefer_columnar:
+        for file_format in COLUMNAR_FORMATS:
+            filename = get_columnar_filename(path, file_format)
+            if os.path.isfile(filename) and os.path.getmtime(filename) >= os.path.getmtime(path):
+                try:
+                    return getattr(pd, "read_" + file_format)(filename)
+                except ImportError:
+                    break
+    return pd.read_csv(path, index_col=0, parse_dates=True)
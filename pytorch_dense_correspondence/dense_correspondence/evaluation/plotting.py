@@ -165,3 +165,57 @@ def draw_reticle_cv2(img, u, v, label_color):
     cv2.line(img, (u, v - 1), (u, v - 3), white, 1)
     cv2.line(img, (u - 1, v), (u - 3, v), white, 1)
     return img
+
+
+def plot_correspondence_analysis(fig, rgb_a, rgb_b, pixel_a, pixel_b, res_a, res_b, p_b):
+    """
+    Draws the matched pixels, the PCA of the descriptors and the heatmap of the match
+    on fig. Only uses the figure object, so it can be called outside of the main thread
+    with a matplotlib.figure.Figure
+    :param rgb_a, rgb_b: numpy.ndarray [H,W,3], not modified
+    :param res_a, res_b: numpy.ndarray [H,W,D] descriptors
+    :param p_b: numpy.ndarray [H,W] softmax of the descriptor distances to pixel_a
+    """
+    from sklearn.decomposition import PCA
+
+    rgb_b_array = rgb_b
+    ax = fig.subplots(2, 3)
+    # Plot original images
+    rgb_a = cv2.circle(np.array(rgb_a), tuple(pixel_a), 10, (255, 0, 0), -1)
+    rgb_b = cv2.circle(np.array(rgb_b), tuple(pixel_b), 10, (255, 0, 0), -1)
+    ax[0, 0].imshow(rgb_a)
+    ax[0, 0].set_title("Img A")
+    ax[0, 1].imshow(rgb_b)
+    ax[0, 1].set_title("Img B")
+
+    # PCA plots
+    d = res_a.shape[-1]
+    res_shape = res_a.shape
+    pca = PCA(n_components=3)
+
+    res_b_pc = pca.fit_transform(res_b.reshape((-1, d)))
+    res_b_pc = res_b_pc.reshape(res_shape[0], res_shape[1], -1)
+    res_b_pc = normalize_descriptor(res_b_pc)
+    ax[1, 1].imshow(res_b_pc)
+    ax[1, 1].set_title("Img B: PCA plot DOD")
+
+    res_a_pc = pca.transform(res_a.reshape((-1, d)))
+    res_a_pc = res_a_pc.reshape(res_shape[0], res_shape[1], -1)
+    res_a_pc = normalize_descriptor(res_a_pc)
+    ax[1, 0].imshow(res_a_pc)
+    ax[1, 0].set_title("Img A: PCA plot DOD")
+
+    # Heatmap plots
+    data_sorted = np.sort(p_b.ravel())
+    p = 1.0 * np.arange(len(p_b.ravel())) / (len(p_b.ravel()) - 1)
+    ax[1, 2].plot(p, data_sorted)
+    ax[1, 2].set_ylabel("Probability across pixels")
+    ax[1, 2].set_xlabel("Percentage of image pixels")
+
+    im1 = ax[0, 2].imshow(p_b, cmap="jet", alpha=0.95)  # , vmin=0, vmax=0.005)
+    im2 = ax[0, 2].imshow(rgb_b_array, alpha=0.15)
+    fig.colorbar(im1, ax=ax[0, 2], fraction=0.046, pad=0.04)
+    ax[0, 2].set_title("Img B: Best match heatmap")
+
+    fig.tight_layout()
+    return fig
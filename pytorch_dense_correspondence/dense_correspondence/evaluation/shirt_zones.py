@@ -0,0 +1,127 @@
+"""
+Zones of the shirt in the canonical images, and aggregation of match errors by zone.
+
+ZoneLabeler labels every pixel of a mask with its zone, from column and row cut lines:
+
+    0 background    pixels outside the mask
+    1 left arm      columns < left_arm_col
+    2 right arm     columns > right_arm_col
+    3 upper torso   rows > torso_row
+    4 lower torso   the rest
+
+(the default cuts are those of the canonical shirt images, 960 x 720). The zone
+maps are computed with numpy and cached by image key, e.g. ("shirt_canonical", 3).
+
+aggregate_by_zone() groups the metrics of the matches by the zone of their ground
+truth pixel in the canonical image, in a single pandas groupby.
+"""
+
+from collections import OrderedDict
+
+import numpy as np
+
+import dense_correspondence_manipulation.utils.utils as utils
+
+pd = utils.LazyModule("pandas")
+
+BACKGROUND, LEFT_ARM, RIGHT_ARM, UPPER_TORSO, LOWER_TORSO = range(5)
+
+ZONE_NAMES = OrderedDict([
+    (BACKGROUND, "background"),
+    (LEFT_ARM, "left arm"),
+    (RIGHT_ARM, "right arm"),
+    (UPPER_TORSO, "upper torso"),
+    (LOWER_TORSO, "lower torso"),
+])
+
+DEFAULT_LEFT_ARM_COL = 270
+DEFAULT_RIGHT_ARM_COL = 690
+DEFAULT_TORSO_ROW = 300
+
+
+class ZoneLabeler(object):
+
+    def __init__(self, left_arm_col=DEFAULT_LEFT_ARM_COL, right_arm_col=DEFAULT_RIGHT_ARM_COL,
+                 torso_row=DEFAULT_TORSO_ROW):
+        """
+        :param left_arm_col: the columns before it are the left arm
+        :param right_arm_col: the columns after it are the right arm
+        :param torso_row: the rows after it, between the arms, are the upper torso
+        """
+        self._left_arm_col = left_arm_col
+        self._right_arm_col = right_arm_col
+        self._torso_row = torso_row
+        self._zone_maps = dict()
+
+    @property
+    def cuts(self):
+        return self._left_arm_col, self._right_arm_col, self._torso_row
+
+    def clear(self):
+        self._zone_maps = dict()
+
+    def label(self, mask):
+        """
+        :param mask: [H, W] mask, non-zero pixels are the shirt
+        :return: [H, W] numpy.ndarray of zone ids, see ZONE_NAMES
+        :rtype: numpy.ndarray
+        """
+        mask = np.asarray(mask)
+        height, width = mask.shape
+        rows, cols = np.arange(height), np.arange(width)
+
+        # from the lowest to the highest priority
+        zones = np.full((height, width), LOWER_TORSO, dtype=np.int64)
+        zones[rows > self._torso_row, :] = UPPER_TORSO
+        zones[:, cols > self._right_arm_col] = RIGHT_ARM
+        zones[:, cols < self._left_arm_col] = LEFT_ARM
+        zones[mask == 0] = BACKGROUND
+        return zones
+
+    def get_zone_map(self, mask, key=None):
+        """
+        label(mask), cached by key if not None
+        :param key: hashable key of the image, e.g. (scene_name, img_idx)
+        """
+        if key is None:
+            return self.label(mask)
+        if key not in self._zone_maps:
+            self._zone_maps[key] = self.label(mask)
+        return self._zone_maps[key]
+
+
+_default_labeler = None
+
+
+def get_default_labeler():
+    """
+    ZoneLabeler with the default cuts, shared by the evaluation functions
+    :rtype: ZoneLabeler
+    """
+    global _default_labeler
+    if _default_labeler is None:
+        _default_labeler = ZoneLabeler()
+    return _default_labeler
+
+
+def zone_names(zone_ids):
+    """
+    :param zone_ids: numpy.ndarray of zone ids
+    :return: numpy.ndarray of the zone names, same shape
+    """
+    return np.asarray(list(ZONE_NAMES.values()))[np.asarray(zone_ids)]
+
+
+def aggregate_by_zone(zone_ids, metrics, statistics=("count", "mean", "median")):
+    """
+    Statistics of each metric over the matches of each zone
+
+    :param zone_ids: [N] zone of each match, e.g. zone_map[v_b, u_b]
+    :param metrics: dict metric name -> [N] values, or a pandas.DataFrame with N rows
+    :param statistics: pandas aggregations
+    :return: DataFrame indexed by zone name, with a column (metric, statistic) per metric and statistic
+    :rtype: pandas.DataFrame
+    """
+    df = pd.DataFrame(dict(metrics)) if not isinstance(metrics, pd.DataFrame) else metrics.reset_index(drop=True)
+    df["zone"] = pd.Categorical(zone_names(zone_ids), categories=list(ZONE_NAMES.values()))
+    return df.groupby("zone", observed=True).agg(list(statistics))
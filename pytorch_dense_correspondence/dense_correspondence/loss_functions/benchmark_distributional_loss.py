@@ -0,0 +1,89 @@
+"""
+Benchmark of PixelwiseDistributionalLoss.get_loss().
+
+Compares the per-match loop of distributional_loss_single_match() against the
+batched get_loss() on random descriptors of 640x480 images, and checks that both
+give the same loss, up to the truncation of the targets of GaussianTargetBank.
+Needs a GPU.
+
+To run it from terminal (from pytorch_dense_correspondence/):
+    python dense_correspondence/loss_functions/benchmark_distributional_loss.py
+"""
+
+import argparse
+import time
+import torch
+
+import dense_correspondence_manipulation.utils.utils as utils
+
+utils.add_dense_correspondence_to_python_path()
+from dense_correspondence.loss_functions.pixelwise_distributional_loss import PixelwiseDistributionalLoss
+
+
+def legacy_get_loss(pixelwise_loss, img_a, img_b, image_a_pred, image_b_pred, matches_a, matches_b, image_b_mask,
+                    sigma, symmetry):
+    """
+    get_loss() of a single pair before being vectorized, on all the matches, used as reference
+    """
+    masked_indices_b = pixelwise_loss.flattened_mask_indices(image_b_mask, inverse=True)
+    loss = 0.0
+    for i, (match_a, match_b) in enumerate(zip(matches_a, matches_b)):
+        loss += pixelwise_loss.distributional_loss_single_match(i, img_b, img_a, image_b_pred, image_a_pred,
+                                                                match_b.view(1), match_a.view(1),
+                                                                masked_indices=masked_indices_b, sigma=sigma,
+                                                                symmetry=symmetry)
+    return loss / len(matches_a)
+
+
+def timed(function, number):
+    torch.cuda.synchronize()
+    start = time.time()
+    for _ in range(number):
+        result = function()
+    torch.cuda.synchronize()
+    return result, (time.time() - start) / number
+
+
+def run_benchmark(num_matches=50, descriptor_dim=3, image_width=640, image_height=480, sigma=3, symmetry=True,
+                  number=5):
+    torch.manual_seed(0)
+    num_pixels = image_width * image_height
+    pixelwise_loss = PixelwiseDistributionalLoss((image_height, image_width), config=dict())
+
+    img_a = torch.rand(1, 3, image_height, image_width).cuda()
+    img_b = torch.rand(1, 3, image_height, image_width).cuda()
+    image_a_pred = torch.nn.functional.normalize(torch.randn(1, num_pixels, descriptor_dim), dim=2).cuda()
+    image_b_pred = torch.nn.functional.normalize(torch.randn(1, num_pixels, descriptor_dim), dim=2).cuda()
+
+    image_b_mask = torch.zeros(1, image_height, image_width, dtype=torch.long)
+    image_b_mask[:, image_height // 4:3 * image_height // 4, image_width // 4:3 * image_width // 4] = 1
+    foreground_b = image_b_mask.view(-1).nonzero().squeeze(1)
+    matches_a = torch.randperm(num_pixels)[:num_matches].cuda()
+    matches_b = foreground_b[torch.randperm(len(foreground_b))[:num_matches]].cuda()
+    image_b_mask = image_b_mask.cuda()
+
+    def legacy():
+        return legacy_get_loss(pixelwise_loss, img_a, img_b, image_a_pred, image_b_pred, matches_a, matches_b,
+                               image_b_mask[0], sigma, symmetry)
+
+    def batched():
+        return pixelwise_loss.get_loss(img_a, img_b, image_a_pred, image_b_pred, matches_a, matches_b,
+                                       None, image_b_mask, sigma=sigma, symmetry=symmetry,
+                                       num_matches_per_pair=num_matches)
+
+    legacy_loss, legacy_time = timed(legacy, number)
+    batched_loss, batched_time = timed(batched, number)
+    print("%d matches, %dx%d images" % (num_matches, image_width, image_height))
+    print("%-20s loss %.6f   %8.3f ms" % ("legacy", legacy_loss.item(), 1e3 * legacy_time))
+    print("%-20s loss %.6f   %8.3f ms" % ("batched", batched_loss.item(), 1e3 * batched_time))
+    print("x%.1f faster" % (legacy_time / batched_time))
+    assert abs(legacy_loss.item() - batched_loss.item()) <= 1e-3 * max(abs(legacy_loss.item()), 1.0)
+
+
+if __name__ == '__main__':
+    argParser = argparse.ArgumentParser()
+    argParser.add_argument("-n", "--num_matches", type=int, default=50)
+    argParser.add_argument("--sigma", type=float, default=3)
+    args = argParser.parse_args()
+
+    run_benchmark(num_matches=args.num_matches, sigma=args.sigma)
@@ -0,0 +1,136 @@
+"""
+Truncated gaussian targets of the distributional loss.
+
+The target of a match at (u, v) is a 2D gaussian, averaged with a gaussian at its
+symmetric pixel if symmetry (see pixel_symmetry), that is zero outside of the mask
+of the image. Each gaussian is separable,
+
+    G(x, y) = g_u(x) * g_v(y)
+
+so GaussianTargetBank precomputes, once per sigma, the 1D gaussians of every
+possible center truncated at truncate * sigma pixels, and builds the targets as
+sparse (flat pixel index, value) pairs on their support only. Memory and time
+per target scale with the size of the support, (2R+1)^2 with R = ceil(truncate * sigma),
+not with the size of the image.
+
+The 1D gaussians are evaluated on the same np.linspace() pixel coordinates as
+PixelwiseDistributionalLoss.gauss_2d_distribution().
+"""
+
+import math
+import torch
+
+from dense_correspondence.correspondence_tools.pixel_symmetry import get_symmetry_map
+
+DEFAULT_TRUNCATE = 4.0
+
+
+class GaussianTargetBank(object):
+
+    def __init__(self, image_width, image_height, truncate=DEFAULT_TRUNCATE):
+        """
+        :param image_width, image_height: size of the images
+        :param truncate: the targets are truncated at truncate * sigma pixels from their center
+        :type truncate: float
+        """
+        self._image_width = image_width
+        self._image_height = image_height
+        self._truncate = truncate
+        self._kernels = dict()
+
+    @property
+    def truncate(self):
+        return self._truncate
+
+    def get_radius(self, sigma):
+        return int(math.ceil(self._truncate * sigma))
+
+    def clear_cache(self):
+        self._kernels = dict()
+
+    def _kernel_table(self, size, sigma, device):
+        """
+        1D gaussians of all the centers c = 0, ..., size - 1, evaluated at the pixels c - R, ..., c + R
+        :return: torch.LongTensor [size, 2R+1] pixel indices, torch.FloatTensor [size, 2R+1] values,
+            0 for the pixels out of the image
+        """
+        radius = self.get_radius(sigma)
+        coordinates = torch.linspace(0, size, size, device=device)
+        centers = torch.arange(size, device=device).unsqueeze(1)
+        indices = centers + torch.arange(-radius, radius + 1, device=device).unsqueeze(0)
+        inside = (indices >= 0) & (indices < size)
+        indices = indices.clamp(0, size - 1)
+        values = torch.exp(-(coordinates[indices] - centers.float()).pow(2) / (2.0 * sigma ** 2))
+        return indices, values * inside.float()
+
+    def get_kernels(self, sigma, device):
+        """
+        Tables of 1D gaussians for x and y, see _kernel_table(). Cached per sigma and device.
+        """
+        key = (float(sigma), str(device))
+        if key not in self._kernels:
+            self._kernels[key] = (self._kernel_table(self._image_width, sigma, device),
+                                  self._kernel_table(self._image_height, sigma, device))
+        return self._kernels[key]
+
+    def _window(self, u, v, sigma):
+        """
+        2D gaussians of K centers on their (2R+1) x (2R+1) window
+        :return: torch.LongTensor [K, 2R+1, 2R+1] flat pixel indices, torch.FloatTensor [K, 2R+1, 2R+1] values
+        """
+        (x_indices, x_values), (y_indices, y_values) = self.get_kernels(sigma, u.device)
+        indices = y_indices[v].unsqueeze(2) * self._image_width + x_indices[u].unsqueeze(1)
+        values = y_values[v].unsqueeze(2) * x_values[u].unsqueeze(1)
+        return indices, values
+
+    def get_targets(self, uv, sigma, mask=None, symmetry=True):
+        """
+        Normalized targets of K matches, as sparse pairs over their support.
+
+        :param uv: torch.LongTensor [K, 2] with the (u, v) center of each target
+        :param sigma: standard deviation of the gaussians, in pixels
+        :param mask: (optional) bool torch.Tensor [H*W], pixels where the targets can be non-zero.
+            Targets with no pixel of the mask in their support are not masked
+        :param symmetry: add a gaussian at the symmetric pixel of the center
+        :type symmetry: bool or PixelSymmetryMap, see pixel_symmetry.get_symmetry_map()
+        :return: indices torch.LongTensor [K, S] flat pixel indices of the support,
+            q torch.FloatTensor [K, S] values of the targets, summing 1,
+            log_q torch.FloatTensor [K, S] log of the values, 0 where q is 0
+        """
+        u = uv[:, 0].long()
+        v = uv[:, 1].long()
+        num_targets = len(uv)
+
+        indices, values = self._window(u, v, sigma)
+        indices = indices.reshape(num_targets, -1)
+        values = values.reshape(num_targets, -1)
+
+        symmetry_map = get_symmetry_map(symmetry, self._image_width, self._image_height)
+        if symmetry_map is not None:
+            # the symmetric gaussian is added to the pixels it shares with the window at (u, v),
+            # and appended on the rest
+            radius = self.get_radius(sigma)
+            window_size = 2 * radius + 1
+            u_sym, v_sym = symmetry_map.map_uv(u, v)
+            sym_indices, sym_values = self._window(u_sym.long(), v_sym.long(), sigma)
+            sym_indices = sym_indices.reshape(num_targets, -1)
+            sym_values = sym_values.reshape(num_targets, -1)
+
+            column_offsets = sym_indices % self._image_width - (u.unsqueeze(1) - radius)
+            row_offsets = torch.div(sym_indices, self._image_width, rounding_mode="trunc") - (v.unsqueeze(1) - radius)
+            shared = (column_offsets >= 0) & (column_offsets < window_size) & \
+                     (row_offsets >= 0) & (row_offsets < window_size) & (sym_values > 0)
+            offsets = (row_offsets * window_size + column_offsets).clamp(0, window_size ** 2 - 1)
+            values = values.scatter_add(1, offsets, sym_values * shared.float())
+
+            indices = torch.cat((indices, sym_indices), 1)
+            values = 0.5 * torch.cat((values, sym_values * (~shared).float()), 1)
+
+        if mask is not None:
+            masked_values = values * mask[indices].float()
+            in_mask = masked_values.sum(1, keepdim=True) > 0
+            values = torch.where(in_mask, masked_values, values)
+
+        q = values / values.sum(1, keepdim=True)
+        log_q = torch.where(q > 0, q, torch.ones_like(q)).log()
+        return indices, q, log_q
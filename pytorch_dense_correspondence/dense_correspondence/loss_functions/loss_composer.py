@@ -1,8 +1,8 @@
 import torch
 from torch.autograd import Variable
-import matplotlib.pyplot as plt
 
 from dense_correspondence.dataset.spartan_dataset_masked import SpartanDataset, SpartanDatasetDataType
+from dense_correspondence.dataset.batch_collate import flatten_batch_descriptors
 
 
 # +
@@ -19,6 +19,9 @@ def get_contrastive_loss(pixelwise_contrastive_loss, match_type,
     - parsing different types of matches / non matches..
     - into different pixelwise contrastive loss functions
 
+    For a batch of N image pairs, image_a_pred and image_b_pred have shape [N, H*W, D] and the
+    matches / non-matches are the flat indices offset by pair of batch_collate.collate_image_pairs()
+
     :return args: loss, match_loss, masked_non_match_loss, \
                 background_non_match_loss, blind_non_match_loss
     :rtypes: each pytorch Variables
@@ -27,6 +30,8 @@ def get_contrastive_loss(pixelwise_contrastive_loss, match_type,
     pcl = pixelwise_contrastive_loss
     
     image_height, image_width = img_a.shape[2:]
+    image_a_pred = flatten_batch_descriptors(image_a_pred)
+    image_b_pred = flatten_batch_descriptors(image_b_pred)
     
 #     plt.imshow(img_a.cpu())
 #     plt.imshow(img_b.cpu())
@@ -107,9 +112,10 @@ def get_distributional_loss(pixelwise_distributional_loss,
     - parsing different types of matches / non matches..
     - into different pixelwise contrastive loss functions
 
-    :return args: loss, match_loss, masked_non_match_loss, \
-                background_non_match_loss, blind_non_match_loss
-    :rtypes: each pytorch Variables
+    For a batch of N image pairs, see get_contrastive_loss()
+
+    :return args: loss
+    :rtypes: pytorch Variable
 
     """
     
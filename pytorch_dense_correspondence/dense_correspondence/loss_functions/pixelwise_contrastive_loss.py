@@ -1,5 +1,7 @@
 import torch
 
+from dense_correspondence.correspondence_tools.pixel_symmetry import get_symmetry_map
+
 
 class PixelwiseContrastiveLoss(object):
 
@@ -81,7 +83,8 @@ class PixelwiseContrastiveLoss(object):
         if use_l2_pixel_loss is None:
             use_l2_pixel_loss = self._config['use_l2_pixel_loss_on_masked_non_matches']
         
-        match_loss, _, _ = PCL.match_loss(image_a_pred, image_b_pred, matches_a, matches_b, image_width, symmetry)
+        match_loss, _, _ = PCL.match_loss(image_a_pred, image_b_pred, matches_a, matches_b, image_width, symmetry,
+                                          image_height=image_height)
 
         if use_l2_pixel_loss:
             non_match_loss, num_hard_negatives = \
@@ -99,7 +102,7 @@ class PixelwiseContrastiveLoss(object):
         
 
     @staticmethod
-    def match_loss(image_a_pred, image_b_pred, matches_a, matches_b, image_width, symmetry):
+    def match_loss(image_a_pred, image_b_pred, matches_a, matches_b, image_width, symmetry, image_height=None):
         """
         Computes the match loss given by
 
@@ -113,6 +116,9 @@ class PixelwiseContrastiveLoss(object):
         to (u,v) ---> image_width * v + u, this matches the shape of one dimension of image_a_pred
         :type matches_a: torch.Variable(torch.FloatTensor)
         :param matches_b: same as matches_b
+        :param symmetry: average the loss of the matches with that of their symmetric matches in image b
+        :type symmetry: bool or PixelSymmetryMap, see pixel_symmetry.get_symmetry_map()
+        :param image_height: needed if symmetry is a lookup table
 
         :return: match_loss, matches_a_descriptors, matches_b_descriptors
         :rtype: torch.Variable(),
@@ -132,9 +138,9 @@ class PixelwiseContrastiveLoss(object):
             matches_a_descriptors = matches_a_descriptors.unsqueeze(0)
             matches_b_descriptors = matches_b_descriptors.unsqueeze(0)
             
-        if symmetry:
-            matches_b_sym = torch.Tensor([match_b.item() - 2 * (match_b.item()%image_width) + (image_width-1)
-                                          for match_b in matches_b]).to(torch.int32).cuda()
+        symmetry_map = get_symmetry_map(symmetry, image_width, image_height)
+        if symmetry_map is not None:
+            matches_b_sym = symmetry_map.map_flat(matches_b)
             matches_b_descriptors_sym = torch.index_select(image_b_pred, 1, matches_b_sym)
             if len(matches_a) == 1:
                 matches_b_descriptors_sym = matches_b_descriptors_sym.unsqueeze(0)
@@ -4,7 +4,8 @@ import numpy as np
 import time
 import random
 import math
-import matplotlib.pyplot as plt
+
+from dense_correspondence.loss_functions.gaussian_target_bank import GaussianTargetBank, DEFAULT_TRUNCATE
 
 class PixelwiseDistributionalLoss(object):
 
@@ -19,6 +20,8 @@ class PixelwiseDistributionalLoss(object):
 
         self._debug = False
 
+        self._target_bank = None
+
     @property
     def debug(self):
         return self._debug
@@ -90,13 +93,77 @@ class PixelwiseDistributionalLoss(object):
 #             plt.show()
         return loss
 
-    def get_loss(self, img_a, img_b, image_a_pred, image_b_pred, matches_a, matches_b, image_a_mask, image_b_mask, sigma=1, symmetry=True):
+    @property
+    def target_bank(self):
+        """
+        GaussianTargetBank of the image size, truncated at the "gaussian_target_truncate" of the
+        config (4 sigma by default)
+        """
+        if self._target_bank is None:
+            truncate = DEFAULT_TRUNCATE
+            if self._config is not None:
+                truncate = self._config.get("gaussian_target_truncate", DEFAULT_TRUNCATE)
+            self._target_bank = GaussianTargetBank(self.image_width, self.image_height, truncate=truncate)
+        return self._target_bank
+
+    def get_loss(self, img_a, img_b, image_a_pred, image_b_pred, matches_a, matches_b, image_a_mask, image_b_mask,
+                 sigma=1, symmetry=True, num_matches_per_pair=50):
+        """
+        Distributional loss of a batch of N image pairs, averaged over up to num_matches_per_pair
+        random matches of each pair.
+
+        For each match, the distribution over image b given by the softmax of the descriptor distances
+        to match_a is compared, with the KL divergence, to a gaussian centered at match_b (and at its
+        symmetric pixel if symmetry) that is zero outside of the mask of image b. The targets are truncated,
+        see GaussianTargetBank, so that the KL divergence is only computed on their support:
+
+            KL(q || p) = sum_s q_s * (log q_s + d_s) + log sum_j exp(-d_j)
+
+        where d are the squared descriptor distances. All the matches of a pair are computed at once,
+        in float32.
+
+        :param img_a, img_b: torch.Tensor [N, 3, H, W]
+        :param image_a_pred, image_b_pred: torch.Tensor [N, H*W, D]
+        :param matches_a, matches_b: flat indices offset by pair, see batch_collate.collate_image_pairs()
+        :param image_a_mask, image_b_mask: torch.Tensor [N, H, W]
+        :param symmetry: bool or PixelSymmetryMap, see pixel_symmetry.get_symmetry_map()
+        """
+        image_height, image_width = img_a.shape[2:]
+        num_pixels = image_height * image_width
+        num_pairs = image_a_pred.shape[0]
+        device = image_b_pred.device
+        image_b_mask = image_b_mask.reshape(num_pairs, num_pixels).to(device) != 0
+
+        matches_a = matches_a.to(device)
+        matches_b = matches_b.to(device)
+        pairs = torch.div(matches_a, num_pixels, rounding_mode="trunc")
+
         loss = 0.0
-        masked_indices_a = self.flattened_mask_indices(image_a_mask, inverse=True)
-        masked_indices_b = self.flattened_mask_indices(image_b_mask, inverse=True)
-        matches_lists = list(zip(matches_a, matches_b))
-        matches_lists = random.sample(matches_lists, min(50, len(matches_lists)))
-        for i, (match_a, match_b) in enumerate(matches_lists):
-            loss += self.distributional_loss_single_match(i, img_b, img_a, image_b_pred, image_a_pred, match_b, match_a, 
-                                                          masked_indices=masked_indices_b, sigma=sigma, symmetry=symmetry)
-        return loss/len(matches_lists)
+        num_matches = 0
+        for pair in range(num_pairs):
+            pair_matches = (pairs == pair).nonzero().squeeze(1)
+            if len(pair_matches) == 0:
+                continue
+            sampled = torch.randperm(len(pair_matches), device=device)[:num_matches_per_pair]
+            pair_matches = pair_matches[sampled]
+            match_a = matches_a[pair_matches] % num_pixels
+            match_b = matches_b[pair_matches] % num_pixels
+
+            # squared descriptor distances from every match_a to all the pixels of image b, [K, H*W]
+            descriptors_a = image_a_pred[pair].float().index_select(0, match_a)  # [K, D]
+            descriptors_b = image_b_pred[pair].float()  # [H*W, D]
+            norm_diffs = (descriptors_a.pow(2).sum(1, keepdim=True) + descriptors_b.pow(2).sum(1).unsqueeze(0)
+                          - 2.0 * torch.mm(descriptors_a, descriptors_b.t())).clamp(min=0)
+            log_partition = torch.logsumexp(-norm_diffs, dim=1)
+
+            with torch.no_grad():
+                uv_b = torch.stack((match_b % image_width,
+                                    torch.div(match_b, image_width, rounding_mode="trunc")), dim=1)
+                support, q_b, log_q_b = self.target_bank.get_targets(uv_b, sigma, mask=image_b_mask[pair],
+                                                                     symmetry=symmetry)
+
+            support_diffs = norm_diffs.gather(1, support)
+            loss = loss + (q_b * (log_q_b + support_diffs)).sum() + log_partition.sum()
+            num_matches += len(match_a)
+
+        return loss / max(num_matches, 1)
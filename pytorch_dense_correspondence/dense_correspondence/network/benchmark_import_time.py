@@ -0,0 +1,124 @@
+"""
+Import time of the modules needed at inference time (network, matcher, robot service).
+
+Each module is imported in a fresh interpreter with python -X importtime, after
+torch, torchvision and numpy, which every module needs. The benchmark reports the
+remaining import time of the module and its heaviest imports, and fails if
+
+    - the import time of a core module is over the budget, or
+    - a core module imports one of the plotting / analysis packages, which must
+      only be imported by the functions that use them (see utils.LazyModule)
+
+To run it from terminal (from pytorch_dense_correspondence):
+    python dense_correspondence/network/benchmark_import_time.py
+"""
+
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+import dense_correspondence_manipulation.utils.utils as utils
+
+CORE_MODULES = [
+    "dense_correspondence.network.dense_correspondence_network",
+    "dense_correspondence.network.descriptor_matcher",
+    "dense_correspondence.network.descriptor_cache",
+    "dense_correspondence.network.correspondence_tracker",
+    "dense_correspondence.network.inference_engine",
+    "dense_correspondence.correspondence_tools.pixel_symmetry",
+    "dense_correspondence.evaluation.evaluation",
+    "dense_correspondence.evaluation.correspondence_service",
+]
+
+# imported before the module, not counted
+BASELINE_MODULES = ["numpy", "torch", "torchvision"]
+
+FORBIDDEN_PACKAGES = ["matplotlib", "pandas", "scipy", "sklearn", "seaborn", "plotly"]
+
+# seconds, on top of the baseline modules
+DEFAULT_BUDGET = 0.5
+
+
+def get_python_path():
+    source_dir = utils.getDenseCorrespondenceSourceDir()
+    paths = [source_dir, os.path.join(source_dir, "modules"), os.path.join(source_dir, "external")]
+    if os.environ.get("PYTHONPATH"):
+        paths.append(os.environ["PYTHONPATH"])
+    return os.pathsep.join(paths)
+
+
+def parse_importtime(stderr):
+    """
+    :param stderr: output of python -X importtime
+    :return: list of (package, level, self_us, cumulative_us), in the order of the output
+    """
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        fields = line[len("import time:"):].split("|")
+        self_us, cumulative_us, name = int(fields[0]), int(fields[1]), fields[2]
+        level = (len(name) - len(name.lstrip()) - 1) // 2
+        entries.append((name.strip(), level, self_us, cumulative_us))
+    return entries
+
+
+def benchmark_module(module_name):
+    """
+    :return: dict with the import time of module_name in seconds, its 10 heaviest imports
+        and the forbidden packages it imports
+    """
+    code = "import %s; import %s; import sys, json; print(json.dumps(sorted(sys.modules)))" % (
+        ", ".join(BASELINE_MODULES), module_name)
+    env = dict(os.environ, PYTHONPATH=get_python_path())
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", code], env=env,
+                             cwd=utils.getDenseCorrespondenceSourceDir(), stdout=subprocess.PIPE,
+                             stderr=subprocess.PIPE, universal_newlines=True)
+    if process.returncode != 0:
+        raise RuntimeError("importing %s failed:\n%s" % (module_name, process.stderr[-2000:]))
+
+    entries = parse_importtime(process.stderr)
+    imported = json.loads(process.stdout.strip().splitlines()[-1])
+    module_entries = [e for e in entries if e[0] == module_name and e[1] == 0]
+    import_time = module_entries[-1][3] * 1e-6 if module_entries else 0.0
+
+    # entries after the baseline modules, i.e. imported by module_name
+    baseline_end = max(i for i, e in enumerate(entries) if e[1] == 0 and e[0] in BASELINE_MODULES)
+    heaviest = sorted(entries[baseline_end + 1:], key=lambda e: -e[2])[:10]
+    forbidden = sorted(set(name.split(".")[0] for name in imported) & set(FORBIDDEN_PACKAGES))
+    return dict(module=module_name, import_time=import_time,
+                heaviest=[(e[0], e[2] * 1e-6) for e in heaviest], forbidden=forbidden)
+
+
+def run(modules=CORE_MODULES, budget=DEFAULT_BUDGET, verbose=False):
+    """
+    :return: True if all the modules are within the budget and import no forbidden package
+    :rtype: bool
+    """
+    ok = True
+    print("%-60s %10s  %s" % ("module", "time [s]", "status"))
+    for module_name in modules:
+        result = benchmark_module(module_name)
+        status = []
+        if result["import_time"] > budget:
+            status.append("over budget (%.2f s)" % budget)
+        if result["forbidden"]:
+            status.append("imports %s" % ", ".join(result["forbidden"]))
+        ok = ok and not status
+        print("%-60s %10.3f  %s" % (module_name, result["import_time"], "; ".join(status) or "ok"))
+        if verbose or status:
+            for name, seconds in result["heaviest"]:
+                print("    %-56s %10.3f" % (name, seconds))
+    return ok
+
+
+if __name__ == "__main__":
+    argParser = argparse.ArgumentParser()
+    argParser.add_argument("modules", nargs="*", default=CORE_MODULES)
+    argParser.add_argument("--budget", type=float, default=DEFAULT_BUDGET,
+                           help="seconds per module, on top of %s" % ", ".join(BASELINE_MODULES))
+    argParser.add_argument("-v", "--verbose", action="store_true", help="print the heaviest imports of every module")
+    args = argParser.parse_args()
+    sys.exit(0 if run(args.modules, budget=args.budget, verbose=args.verbose) else 1)
@@ -0,0 +1,160 @@
+"""
+Streaming tracking of fixed keypoints of a reference image across camera frames.
+
+During an episode the same keypoints of the canonical image are matched against
+every new frame. CorrespondenceTracker computes the descriptors of the keypoints
+once, only runs the network on the incoming frames, and searches the match of
+each keypoint in a (2R+1) x (2R+1) window around its previous match. When the
+confidence of a match drops below min_confidence (or for the first frame) the
+keypoint is searched again in the whole image, see descriptor_matcher.
+
+The confidence of a match is the probability of the match under the softmax of
+the descriptor distances to the keypoint, over the window around the match, so
+it has the same meaning for windowed and global matches.
+"""
+
+import torch
+
+import dense_correspondence.network.descriptor_matcher as descriptor_matcher
+
+DEFAULT_WINDOW_RADIUS = 30
+DEFAULT_MIN_CONFIDENCE = 0.05
+
+
+class CorrespondenceTracker(object):
+
+    def __init__(self, dcn, res_a, pixels_a, window_radius=DEFAULT_WINDOW_RADIUS,
+                 min_confidence=DEFAULT_MIN_CONFIDENCE):
+        """
+        :param dcn: network used to compute the descriptors of the frames
+        :type dcn: DenseCorrespondenceNetwork
+        :param res_a: descriptors [H, W, D] of the reference image, e.g. from descriptor_cache
+        :param pixels_a: list of Q (u, v) keypoints of the reference image
+        :param window_radius: R, the matches are searched in a (2R+1) x (2R+1) window around the previous match
+        :param min_confidence: keypoints with a lower confidence are searched in the whole next frame
+        """
+        self._dcn = dcn
+        res_a = descriptor_matcher.to_tensor(res_a)
+        self._pixels_a = descriptor_matcher.to_tensor(pixels_a).long().reshape(-1, 2)
+        self._descriptors_a = descriptor_matcher.descriptors_at_pixels(res_a, self._pixels_a).float()
+        self._window_radius = window_radius
+        self._min_confidence = min_confidence
+        self._window_offsets = dict()
+        self.reset()
+
+    @property
+    def pixels_a(self):
+        return self._pixels_a
+
+    @property
+    def num_frames(self):
+        return len(self._uv_history)
+
+    def reset(self):
+        """
+        Forgets the previous matches, the next frame is searched globally
+        """
+        self._uv_history = []
+        self._confidence_history = []
+        self._global_history = []
+
+    def _get_window_offsets(self, device):
+        key = str(device)
+        if key not in self._window_offsets:
+            r = torch.arange(-self._window_radius, self._window_radius + 1, device=device)
+            dv, du = torch.meshgrid(r, r, indexing="ij")
+            self._window_offsets[key] = (du.reshape(-1), dv.reshape(-1))
+        return self._window_offsets[key]
+
+    def _window_search(self, descriptors_a, res_b, centers, mask_b=None):
+        """
+        Best match of each descriptor in the window around its center
+
+        :param descriptors_a: [K, D]
+        :param res_b: [H, W, D]
+        :param centers: torch.LongTensor [K, 2] (u, v) centers of the windows
+        :param mask_b: (optional) bool [H*W] mask, pixels out of the mask are not matched
+        :return: uv torch.LongTensor [K, 2], confidence torch.Tensor [K]
+        """
+        height, width, descriptor_dimension = res_b.shape
+        du, dv = self._get_window_offsets(res_b.device)
+        u = centers[:, 0:1] + du.unsqueeze(0)
+        v = centers[:, 1:2] + dv.unsqueeze(0)
+        valid = (u >= 0) & (u < width) & (v >= 0) & (v < height)
+        indices = v.clamp(0, height - 1) * width + u.clamp(0, width - 1)  # [K, S]
+        if mask_b is not None:
+            in_mask = valid & mask_b[indices]
+            # windows with no pixel of the mask are searched without it
+            valid = torch.where(in_mask.any(1, keepdim=True), in_mask, valid)
+
+        descriptors_b = res_b.reshape(-1, descriptor_dimension)[indices].float()  # [K, S, D]
+        norm_diffs = (descriptors_b - descriptors_a.unsqueeze(1)).norm(2, dim=-1)
+        norm_diffs = norm_diffs.masked_fill(~valid, float("inf"))
+
+        best = norm_diffs.argmin(1)
+        log_p = -norm_diffs.gather(1, best.unsqueeze(1)).squeeze(1) - torch.logsumexp(-norm_diffs, dim=1)
+        uv = torch.stack((u.gather(1, best.unsqueeze(1)), v.gather(1, best.unsqueeze(1))), -1).squeeze(1)
+        return uv, log_p.exp()
+
+    def track_descriptors(self, res_b, mask_b=None):
+        """
+        Matches of the keypoints in a frame, from its descriptors
+
+        :param res_b: descriptors [H, W, D] of the frame
+        :type res_b: torch.Tensor
+        :param mask_b: (optional) [H, W] mask of the frame, non-zero pixels are foreground
+        :return: uv torch.LongTensor [Q, 2] (u, v) matches, confidence torch.Tensor [Q],
+            is_global torch.BoolTensor [Q], True for the keypoints searched in the whole image
+        """
+        res_b = descriptor_matcher.to_tensor(res_b)
+        device = res_b.device
+        descriptors_a = self._descriptors_a.to(device)
+        if mask_b is not None:
+            mask_b = descriptor_matcher.to_tensor(mask_b, device).reshape(-1) != 0
+
+        if self._uv_history:
+            previous_uv = self._uv_history[-1].to(device)
+            uv, confidence = self._window_search(descriptors_a, res_b, previous_uv, mask_b)
+            is_global = (self._confidence_history[-1].to(device) < self._min_confidence) | \
+                        (confidence < self._min_confidence)
+        else:
+            uv = torch.zeros(len(descriptors_a), 2, dtype=torch.long, device=device)
+            confidence = torch.zeros(len(descriptors_a), device=device)
+            is_global = torch.ones(len(descriptors_a), dtype=torch.bool, device=device)
+
+        if is_global.any():
+            global_indices = is_global.nonzero().squeeze(1)
+            matches = descriptor_matcher.find_best_matches(descriptors_a[global_indices], res_b, mask_b=mask_b)
+            global_uv = matches.masked_uv if mask_b is not None else matches.uv
+            global_uv, global_confidence = self._window_search(descriptors_a[global_indices], res_b, global_uv,
+                                                               mask_b)
+            uv[global_indices] = global_uv
+            confidence[global_indices] = global_confidence
+
+        self._uv_history.append(uv.cpu())
+        self._confidence_history.append(confidence.cpu())
+        self._global_history.append(is_global.cpu())
+        return uv, confidence, is_global
+
+    def track(self, rgb_b_tensor, mask_b=None):
+        """
+        Matches of the keypoints in a new frame, see track_descriptors()
+
+        :param rgb_b_tensor: torch.FloatTensor [3, H, W] normalized frame, as given by
+            dataset.rgb_image_to_tensor()
+        """
+        with torch.no_grad():
+            res_b = self._dcn.forward_single_image_tensor(rgb_b_tensor).data
+        return self.track_descriptors(res_b, mask_b)
+
+    def get_trajectories(self):
+        """
+        :return: uv torch.LongTensor [num_frames, Q, 2], confidence torch.Tensor [num_frames, Q],
+            is_global torch.BoolTensor [num_frames, Q]
+        """
+        if not self._uv_history:
+            num_keypoints = len(self._pixels_a)
+            return (torch.zeros(0, num_keypoints, 2, dtype=torch.long), torch.zeros(0, num_keypoints),
+                    torch.zeros(0, num_keypoints, dtype=torch.bool))
+        return (torch.stack(self._uv_history), torch.stack(self._confidence_history),
+                torch.stack(self._global_history))
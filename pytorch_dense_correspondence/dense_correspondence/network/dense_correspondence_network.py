@@ -9,14 +9,12 @@ import dense_correspondence_manipulation.utils.utils as utils
 utils.add_dense_correspondence_to_python_path()
 
 
-from PIL import Image
-
 import torch
 import torch.nn as nn
 from torchvision import transforms
 from torch.autograd import Variable
 import pytorch_segmentation_detection.models.resnet_dilated as resnet_dilated
-from dense_correspondence.dataset.spartan_dataset_masked import SpartanDataset
+import dense_correspondence.network.descriptor_matcher as descriptor_matcher
 
 
 class DenseCorrespondenceNetwork(nn.Module):
@@ -26,6 +24,9 @@ class DenseCorrespondenceNetwork(nn.Module):
         ]
     )
 
+    # backend of find_best_match(), "numpy" or "torch"
+    MATCHER_BACKEND = "numpy"
+
     def __init__(
         self,
         fcn,
@@ -189,7 +190,7 @@ class DenseCorrespondenceNetwork(nn.Module):
         img_tensor = DenseCorrespondenceNetwork.IMAGE_TO_TENSOR(img)
 
         if cuda:
-            img_tensor.cuda()
+            img_tensor = img_tensor.cuda()
 
         return self.forward(img_tensor)
 
@@ -230,11 +231,30 @@ class DenseCorrespondenceNetwork(nn.Module):
         res = self.fcn(img_tensor)
         if self._normalize:
             #             print("normalizing descriptor norm")
-            norm = torch.norm(res, 2, 1)  # [N,1,H,W]
+            norm = torch.norm(res, 2, 1, keepdim=True)  # [N,1,H,W]
             res = res / norm
 
         return res
 
+    def forward_pair(self, img_a_tensor, img_b_tensor):
+        """
+        Forward pass of the images a and b of a batch of image pairs.
+
+        Both images are concatenated along the batch dimension and go through the
+        fcn in a single pass, as a batch of 2N images.
+
+        :param img_a_tensor: input tensor with shape [N, 3, H, W]
+        :type img_a_tensor: torch.Variable or torch.Tensor
+        :param img_b_tensor: input tensor with shape [N, 3, H, W]
+        :type img_b_tensor: torch.Variable or torch.Tensor
+        :return: image_a_pred, image_b_pred with shape [N, H*W, D], as process_network_output()
+        :rtype: torch.Variable, torch.Variable
+        """
+        N = img_a_tensor.shape[0]
+        res = self.forward(torch.cat((img_a_tensor, img_b_tensor), 0))  # shape [2N,D,H,W]
+        res = self.process_network_output(res, 2 * N)  # shape [2N,H*W,D]
+        return res[:N], res[N:]
+
     def forward_single_image_tensor(self, img_tensor):
         """
         Simple forward pass on the network.
@@ -268,6 +288,28 @@ class DenseCorrespondenceNetwork(nn.Module):
 
         return res
 
+    def forward_single_image_tensor_pair(self, img_a_tensor, img_b_tensor):
+        """
+        Same as forward_single_image_tensor() on img_a_tensor and img_b_tensor, with a
+        single forward pass on the network
+
+        :param img_a_tensor: torch.FloatTensor with shape [3,H,W]
+        :param img_b_tensor: torch.FloatTensor with shape [3,H,W]
+        :return: res_a, res_b torch.FloatTensor with shape [H, W, D]
+        :rtype:
+        """
+
+        assert len(img_a_tensor.shape) == 3 and len(img_b_tensor.shape) == 3
+
+        # transform to shape [2,3,H,W]
+        img_tensor = torch.stack((img_a_tensor, img_b_tensor), 0)
+        img_tensor = Variable(img_tensor, requires_grad=False)
+        res = self.forward(img_tensor)  # shape [2,D,H,W]
+
+        res = res.permute(0, 2, 3, 1)  # shape [2,H,W,D]
+
+        return res[0], res[1]
+
     def process_network_output(self, image_pred, N):
         """
         Processes the network output into a new shape
@@ -304,6 +346,8 @@ class DenseCorrespondenceNetwork(nn.Module):
         :return: a dataset object, loaded with the config as set in the dataset.yaml
         :rtype: SpartanDataset
         """
+        # the dataset is not needed for inference, only imported here
+        from dense_correspondence.dataset.spartan_dataset_masked import SpartanDataset
 
         network_params_folder = self.path_to_network_params_folder
         network_params_folder = utils.convert_to_absolute_path(network_params_folder)
@@ -378,7 +422,7 @@ class DenseCorrespondenceNetwork(nn.Module):
 
     @staticmethod
     def from_model_folder(
-        model_folder, load_stored_params=True, model_param_file=None, iteration=None
+        model_folder, load_stored_params=True, model_param_file=None, iteration=None, quantized=False
     ):
         """
         Loads a DenseCorrespondenceNetwork from a model folder
@@ -389,12 +433,33 @@ class DenseCorrespondenceNetwork(nn.Module):
             - training.yaml
 
         :type model_folder:
+        :param quantized: load the int8 params of the quantized/ subfolder, see quantization.py.
+            The network is then on the cpu, in eval mode. A model_param_file (e.g. 003500.pth)
+            selects the quantized params of the same iteration
+        :type quantized: bool
         :return: a DenseCorrespondenceNetwork objecc t
         :rtype:
         """
 
         model_folder = utils.convert_to_absolute_path(model_folder)
 
+        if quantized:
+            import dense_correspondence.network.quantization as quantization
+
+            if model_param_file is not None:
+                if iteration is not None:
+                    raise ValueError("give either model_param_file or iteration, not both")
+                iteration_str = os.path.splitext(os.path.basename(model_param_file))[0]
+                if not iteration_str.isdigit():
+                    raise ValueError("can't get the iteration of %s" % (model_param_file))
+                iteration = int(iteration_str)
+
+            training_config = utils.getDictFromYamlFilename(os.path.join(model_folder, "training.yaml"))
+            config = training_config["dense_correspondence_network"]
+            config["path_to_network_params_folder"] = model_folder
+            dcn = DenseCorrespondenceNetwork.from_config(config, load_stored_params=False)
+            return quantization.load_quantized_params(dcn, model_folder, iteration=iteration)
+
         if model_param_file is None:
             model_param_file, _, _ = utils.get_model_param_file_from_directory(
                 model_folder, iteration=iteration
@@ -416,7 +481,7 @@ class DenseCorrespondenceNetwork(nn.Module):
         return dcn
 
     @staticmethod
-    def find_best_match(pixel_a, res_a, res_b, debug=False, k=1, mask_b=None):
+    def find_best_match(pixel_a, res_a, res_b, debug=False, k=1, mask_b=None, backend=None):
         """
         Compute the correspondences between the pixel_a location in image_a
         and image_b
@@ -425,10 +490,19 @@ class DenseCorrespondenceNetwork(nn.Module):
         :param res_a: array of dense descriptors res_a.shape = [H,W,D]
         :param res_b: array of dense descriptors
         :param pixel_b: Ground truth . . .
+        :param backend: "numpy" or "torch" (see descriptor_matcher, runs on the device of res_b).
+            DenseCorrespondenceNetwork.MATCHER_BACKEND if None
+        :type backend: str
         :return: (best_match_uv, best_match_diff, norm_diffs)
         best_match_idx is again in (u,v) = (right, down) coordinates
+        If k > 1, best_match_uv and best_match_diff are lists with the k best matches
 
         """
+        if backend is None:
+            backend = DenseCorrespondenceNetwork.MATCHER_BACKEND
+        if backend == "torch":
+            return DenseCorrespondenceNetwork._find_best_match_torch(pixel_a, res_a, res_b, k=k, mask_b=mask_b)
+
         height, width, _ = res_a.shape
         u = min(pixel_a[0], width - 1)
         v = min(pixel_a[1], height - 1)
@@ -450,6 +524,7 @@ class DenseCorrespondenceNetwork(nn.Module):
             ]
             best_matches_diffs = [norm_diffs[xy] for xy in best_matches_xys]
             best_matches_uvs = [(xy[1], xy[0]) for xy in best_matches_xys]
+            return best_matches_uvs, best_matches_diffs, norm_diffs
         else:
             aux = np.max(norm_diffs) - norm_diffs
             if mask_b is not None:
@@ -461,6 +536,26 @@ class DenseCorrespondenceNetwork(nn.Module):
 
         return best_match_uv, best_match_diff, norm_diffs
 
+    @staticmethod
+    def _find_best_match_torch(pixel_a, res_a, res_b, k=1, mask_b=None):
+        """
+        find_best_match() with descriptor_matcher, same return values
+        """
+        matches = descriptor_matcher.find_best_matches_for_pixels([pixel_a], res_a, res_b, k=k, mask_b=mask_b,
+                                                                  return_norm_diffs=True)
+        norm_diffs = matches.norm_diffs[0].cpu().numpy()
+
+        if k > 1:
+            best_matches_uvs = [tuple(uv) for uv in matches.topk_uv[0].tolist()]
+            best_matches_diffs = matches.topk_distance[0].tolist()
+            return best_matches_uvs, best_matches_diffs, norm_diffs
+
+        if mask_b is not None:
+            best_match_uv, best_match_diff = matches.masked_uv[0], matches.masked_distance[0]
+        else:
+            best_match_uv, best_match_diff = matches.uv[0], matches.distance[0]
+        return tuple(best_match_uv.tolist()), best_match_diff.item(), norm_diffs
+
     def evaluate_descriptor_at_keypoints(self, res, keypoint_list):
         """
 
@@ -488,3 +583,18 @@ class DenseCorrespondenceNetwork(nn.Module):
         # cast to float32, need this in order to use cv2.BFMatcher() with bf.knnMatch
         des = np.array(des, dtype=np.float32)
         return des
+
+    def create_tracker(self, img_a_tensor, pixels_a, **kwargs):
+        """
+        Streaming tracker of pixels_a of img_a across frames, see correspondence_tracker
+
+        :param img_a_tensor: torch.FloatTensor [3,H,W] normalized reference image
+        :param pixels_a: list of (u,v) keypoints of the reference image
+        :param kwargs: window_radius, min_confidence of CorrespondenceTracker
+        :rtype: CorrespondenceTracker
+        """
+        from dense_correspondence.network.correspondence_tracker import CorrespondenceTracker
+
+        with torch.no_grad():
+            res_a = self.forward_single_image_tensor(img_a_tensor).data
+        return CorrespondenceTracker(self, res_a, pixels_a, **kwargs)
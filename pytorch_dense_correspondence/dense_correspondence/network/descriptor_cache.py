@@ -0,0 +1,152 @@
+"""
+Cache of the descriptor images of fixed images, e.g. those of the canonical scene.
+
+The evaluation and the robot code compare new images against the same few
+canonical images, and used to run the network on them every time. DescriptorCache
+keeps the [H, W, D] descriptors of each (network weights, image) in memory and,
+optionally, on disk as
+
+    <cache_dir>/<checkpoint hash>/<image key>.npy
+
+The checkpoint hash is a hash of the network weights, so the cached descriptors
+of a network are not used anymore as soon as its weights change.
+"""
+
+import os
+import hashlib
+import weakref
+import numpy as np
+import torch
+
+
+class DescriptorCache(object):
+
+    def __init__(self, cache_dir=None):
+        """
+        :param cache_dir: (optional) folder to store the descriptors on disk. Memory only if None
+        :type cache_dir: str
+        """
+        self._cache_dir = cache_dir
+        self._descriptors = dict()
+        self._checkpoint_hashes = dict()
+
+    @property
+    def cache_dir(self):
+        return self._cache_dir
+
+    @cache_dir.setter
+    def cache_dir(self, value):
+        self._cache_dir = value
+
+    def clear(self):
+        self._descriptors = dict()
+        self._checkpoint_hashes = dict()
+
+    @staticmethod
+    def _weights_versions(dcn):
+        """
+        Version counters of the weights of dcn: the in-place updates of the optimizer and
+        load_state_dict() bump them
+        """
+        return tuple(p._version for p in dcn.state_dict(keep_vars=True).values())
+
+    def _forget(self, dcn_ref):
+        """
+        Called when a network is freed: its entry must not be found by another network,
+        which may get the same id and the same memory blocks
+        """
+        self._checkpoint_hashes.pop(dcn_ref, None)
+        self._purge_descriptors()
+
+    def _purge_descriptors(self):
+        # the descriptors in memory that no network uses anymore (they stay on disk)
+        current_hashes = set(sha1 for _, sha1 in self._checkpoint_hashes.values())
+        self._descriptors = {k: v for k, v in self._descriptors.items() if k[0] in current_hashes}
+
+    def checkpoint_hash(self, dcn):
+        """
+        sha1 of the weights (and buffers) of the network. Only recomputed when they change.
+        :type dcn: DenseCorrespondenceNetwork
+        :rtype: str
+        """
+        # a weak reference is equal to (and hashes as) the other live references to dcn
+        dcn_ref = weakref.ref(dcn)
+        versions = DescriptorCache._weights_versions(dcn)
+        entry = self._checkpoint_hashes.get(dcn_ref)
+        if entry is None or entry[0] != versions:
+            sha1 = hashlib.sha1()
+            for name, tensor in sorted(dcn.state_dict().items()):
+                sha1.update(name.encode("utf-8"))
+                sha1.update(tensor.detach().cpu().contiguous().numpy().tobytes())
+
+            self._checkpoint_hashes.pop(dcn_ref, None)
+            self._checkpoint_hashes[weakref.ref(dcn, self._forget)] = (versions, sha1.hexdigest())
+            self._purge_descriptors()
+        return self._checkpoint_hashes[dcn_ref][1]
+
+    def get_filename(self, checkpoint_hash, image_key):
+        image_key = "-".join(str(k) for k in image_key) if isinstance(image_key, tuple) else str(image_key)
+        return os.path.join(self._cache_dir, checkpoint_hash, image_key.replace(os.sep, "_") + ".npy")
+
+    def get_descriptors(self, dcn, image_key, rgb_tensor):
+        """
+        Descriptors of an image, from the cache if they have been computed with the same weights.
+        The network must be in eval mode, in train mode the descriptors are not cached.
+
+        :param dcn: network
+        :type dcn: DenseCorrespondenceNetwork
+        :param image_key: hashable id of the image, e.g. (scene_name, img_idx)
+        :param rgb_tensor: torch.FloatTensor [3, H, W] normalized image, as given by
+            dataset.rgb_image_to_tensor(), or a function returning it, only called if not cached
+        :return: torch.FloatTensor [H, W, D], on the cpu
+        """
+        if dcn.training:
+            return self._forward(dcn, rgb_tensor)
+
+        checkpoint_hash = self.checkpoint_hash(dcn)
+        key = (checkpoint_hash, image_key)
+        if key in self._descriptors:
+            return self._descriptors[key]
+
+        filename = None
+        if self._cache_dir is not None:
+            filename = self.get_filename(checkpoint_hash, image_key)
+            if os.path.isfile(filename):
+                self._descriptors[key] = torch.from_numpy(np.load(filename))
+                return self._descriptors[key]
+
+        res = self._forward(dcn, rgb_tensor)
+        self._descriptors[key] = res
+
+        if filename is not None:
+            if not os.path.isdir(os.path.dirname(filename)):
+                os.makedirs(os.path.dirname(filename))
+            np.save(filename, res.numpy())
+        return res
+
+    @staticmethod
+    def _forward(dcn, rgb_tensor):
+        if callable(rgb_tensor):
+            rgb_tensor = rgb_tensor()
+        with torch.no_grad():
+            return dcn.forward_single_image_tensor(rgb_tensor).data.cpu()
+
+    def get_canonical_descriptors(self, dcn, dataset, img_idx):
+        """
+        Descriptors of an image of the canonical scene, see SpartanDataset.get_canonical_image_data()
+        :type dataset: SpartanDataset
+        :return: torch.FloatTensor [H, W, D]
+        """
+        return self.get_descriptors(dcn, (dataset.CANONICAL_SCENE_NAME, str(img_idx)),
+                                    lambda: dataset.get_canonical_image_data(img_idx)[1])
+
+
+_default_cache = DescriptorCache()
+
+
+def get_default_cache():
+    """
+    DescriptorCache shared by the evaluation and the robot code
+    :rtype: DescriptorCache
+    """
+    return _default_cache
@@ -0,0 +1,138 @@
+"""
+Batched best match search in descriptor space, in torch.
+
+find_best_matches() finds, for Q query descriptors at once, their best match in
+a descriptor image res_b [H, W, D], optionally their k best matches and their
+best match inside a mask. The squared distances are computed with
+
+    ||a - b||^2 = ||a||^2 + ||b||^2 - 2 a.b
+
+as one matmul per chunk of pixels of res_b, keeping a running top-k, so that the
+memory used is [Q, chunk_size] and not [Q, H, W]. It runs on the device of res_b.
+
+DenseCorrespondenceNetwork.find_best_match() uses it with backend="torch".
+"""
+
+from collections import namedtuple
+
+import torch
+
+DEFAULT_CHUNK_SIZE = 65536
+
+BestMatches = namedtuple("BestMatches", ["uv", "distance", "topk_uv", "topk_distance",
+                                         "masked_uv", "masked_distance", "norm_diffs"])
+
+
+def to_tensor(array, device=None):
+    if not isinstance(array, torch.Tensor):
+        array = torch.as_tensor(array)
+    if device is not None:
+        array = array.to(device)
+    return array
+
+
+def descriptors_at_pixels(res, pixels):
+    """
+    :param res: descriptor image [H, W, D]
+    :type res: torch.Tensor
+    :param pixels: [Q, 2] (u, v) pixel coordinates, clipped to the image as in find_best_match()
+    :return: torch.Tensor [Q, D]
+    """
+    height, width, _ = res.shape
+    pixels = to_tensor(pixels, res.device).long().reshape(-1, 2)
+    u = pixels[:, 0].clamp(max=width - 1)
+    v = pixels[:, 1].clamp(max=height - 1)
+    return res[v, u]
+
+
+def _merge_topk(distances, indices, chunk_distances, chunk_indices, k):
+    """
+    Running top-k (smallest) of the distances seen so far and those of a new chunk
+    """
+    if distances is not None:
+        chunk_distances = torch.cat((distances, chunk_distances), 1)
+        chunk_indices = torch.cat((indices, chunk_indices), 1)
+    k = min(k, chunk_distances.shape[1])
+    distances, positions = torch.topk(chunk_distances, k, dim=1, largest=False, sorted=True)
+    return distances, chunk_indices.gather(1, positions)
+
+
+def find_best_matches(query_descriptors, res_b, k=1, mask_b=None, chunk_size=DEFAULT_CHUNK_SIZE,
+                      return_norm_diffs=False):
+    """
+    Best matches in res_b of Q query descriptors.
+
+    :param query_descriptors: [Q, D] descriptors, e.g. from descriptors_at_pixels()
+    :type query_descriptors: torch.Tensor or numpy.ndarray
+    :param res_b: descriptor image [H, W, D]
+    :type res_b: torch.Tensor or numpy.ndarray
+    :param k: number of best matches in topk_uv and topk_distance. Only the best match if 1
+    :param mask_b: (optional) [H, W] mask, non-zero pixels are foreground. Adds the best match inside the mask
+    :param chunk_size: number of pixels of res_b compared at once
+    :param return_norm_diffs: also return the [Q, H, W] descriptor distances to all the pixels of res_b
+    :return: BestMatches with
+        - uv: torch.LongTensor [Q, 2] (u, v) of the best matches
+        - distance: torch.Tensor [Q] descriptor distance of the best matches
+        - topk_uv, topk_distance: [Q, k, 2] and [Q, k], sorted by distance. None if k is 1
+        - masked_uv, masked_distance: same as uv and distance inside mask_b. None if no mask_b
+        - norm_diffs: torch.Tensor [Q, H, W]. None if not return_norm_diffs
+    """
+    res_b = to_tensor(res_b)
+    device = res_b.device
+    height, width, descriptor_dimension = res_b.shape
+    descriptors_b = res_b.reshape(-1, descriptor_dimension).float()
+    query_descriptors = to_tensor(query_descriptors, device).reshape(-1, descriptor_dimension).float()
+    num_pixels = descriptors_b.shape[0]
+
+    if mask_b is not None:
+        mask_b = to_tensor(mask_b, device).reshape(-1) != 0
+
+    query_norms = query_descriptors.pow(2).sum(1, keepdim=True)  # [Q, 1]
+    topk_distances, topk_indices = None, None
+    masked_distances, masked_indices = None, None
+    norm_diffs = []
+
+    for start in range(0, num_pixels, chunk_size):
+        chunk = descriptors_b[start:start + chunk_size]
+        chunk_indices = torch.arange(start, start + len(chunk), device=device).unsqueeze(0).expand(
+            len(query_descriptors), -1)
+
+        # squared distances [Q, chunk_size]
+        distances = (query_norms + chunk.pow(2).sum(1).unsqueeze(0)
+                     - 2.0 * torch.mm(query_descriptors, chunk.t())).clamp(min=0)
+        if return_norm_diffs:
+            norm_diffs.append(distances.sqrt())
+
+        topk_distances, topk_indices = _merge_topk(topk_distances, topk_indices, distances, chunk_indices, k)
+        if mask_b is not None:
+            distances = distances.masked_fill(~mask_b[start:start + chunk_size].unsqueeze(0), float("inf"))
+            masked_distances, masked_indices = _merge_topk(masked_distances, masked_indices, distances,
+                                                           chunk_indices, 1)
+
+    def to_uv(indices):
+        return torch.stack((indices % width, torch.div(indices, width, rounding_mode="trunc")), dim=-1)
+
+    def exact_distances(indices):
+        # the matmul trick loses precision for close descriptors, recompute the distances of the matches
+        return (descriptors_b[indices] - query_descriptors.unsqueeze(1)).norm(2, dim=-1)
+
+    topk_distances = exact_distances(topk_indices)
+    result = dict(uv=to_uv(topk_indices[:, 0]), distance=topk_distances[:, 0],
+                  topk_uv=None, topk_distance=None, masked_uv=None, masked_distance=None, norm_diffs=None)
+    if k > 1:
+        result["topk_uv"] = to_uv(topk_indices)
+        result["topk_distance"] = topk_distances
+    if mask_b is not None:
+        result["masked_uv"] = to_uv(masked_indices[:, 0])
+        result["masked_distance"] = exact_distances(masked_indices)[:, 0]
+    if return_norm_diffs:
+        result["norm_diffs"] = torch.cat(norm_diffs, 1).reshape(-1, height, width)
+    return BestMatches(**result)
+
+
+def find_best_matches_for_pixels(pixels_a, res_a, res_b, **kwargs):
+    """
+    find_best_matches() of the descriptors of res_a at pixels_a, see descriptors_at_pixels()
+    """
+    res_a = to_tensor(res_a)
+    return find_best_matches(descriptors_at_pixels(res_a, pixels_a), res_b, **kwargs)
@@ -0,0 +1,159 @@
+"""
+Export of a trained DenseCorrespondenceNetwork as a self-contained TorchScript or ONNX file.
+
+The exported graph is traced for a fixed image size and includes the whole
+preprocessing, so that it can be run without this repository, see exported_network.py:
+
+    uint8 RGB [N, H, W, 3] ---> /255, (x - image_mean) / image_std_dev ---> fcn
+        ---> descriptor normalization (if the network normalizes) ---> [N, H, W, D]
+
+To export a network from terminal (from pytorch_dense_correspondence):
+    python dense_correspondence/network/export_network.py <model_folder> --format onnx
+"""
+
+import os
+import json
+import argparse
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+import dense_correspondence_manipulation.utils.utils as utils
+import dense_correspondence_manipulation.utils.constants as constants
+
+utils.add_dense_correspondence_to_python_path()
+from dense_correspondence.network.dense_correspondence_network import DenseCorrespondenceNetwork
+from dense_correspondence.network.exported_network import METADATA_KEY, ExportedDescriptorNetwork
+
+EXPORT_FOLDER_NAME = "exported"
+EXPORT_FORMATS = ("torchscript", "onnx")
+ONNX_OPSET_VERSION = 11
+
+
+class RGBDescriptorNetwork(nn.Module):
+    """
+    dcn with the image normalization of the dataset in front of it
+    """
+
+    def __init__(self, dcn, image_mean, image_std_dev):
+        super(RGBDescriptorNetwork, self).__init__()
+        self.dcn = dcn
+        self.register_buffer("image_mean", torch.tensor(image_mean, dtype=torch.float32).view(1, 3, 1, 1))
+        self.register_buffer("image_std_dev", torch.tensor(image_std_dev, dtype=torch.float32).view(1, 3, 1, 1))
+
+    def forward(self, rgb):
+        """
+        :param rgb: torch.ByteTensor [N, H, W, 3]
+        :return: torch.FloatTensor [N, H, W, D]
+        """
+        img = rgb.permute(0, 3, 1, 2).float() / 255.0
+        img = (img - self.image_mean) / self.image_std_dev
+        res = self.dcn.forward(img)  # [N, D, H, W]
+        return res.permute(0, 2, 3, 1)
+
+
+def get_normalization(dcn):
+    """
+    image_mean, image_std_dev of the network config, those of the dataset
+    (constants.DEFAULT_IMAGE_MEAN / DEFAULT_IMAGE_STD_DEV) if not set
+    """
+    image_mean = dcn.config.get("image_mean", constants.DEFAULT_IMAGE_MEAN)
+    image_std_dev = dcn.config.get("image_std_dev", constants.DEFAULT_IMAGE_STD_DEV)
+    return [float(x) for x in image_mean], [float(x) for x in image_std_dev]
+
+
+def get_metadata(dcn):
+    image_mean, image_std_dev = get_normalization(dcn)
+    image_height, image_width = dcn.image_shape
+    return dict(image_width=image_width, image_height=image_height,
+                descriptor_dimension=dcn.descriptor_dimension,
+                image_mean=image_mean, image_std_dev=image_std_dev,
+                model_param_file=os.path.basename(dcn.config.get("model_param_file", "")))
+
+
+def export_network(dcn, filename, export_format="torchscript"):
+    """
+    :param dcn: trained network
+    :type dcn: DenseCorrespondenceNetwork
+    :param filename: output file, .pt or .onnx
+    :param export_format: one of EXPORT_FORMATS
+    :return: metadata of the export
+    :rtype: dict
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError("export_format must be one of %s, got %s" % (EXPORT_FORMATS, export_format))
+
+    dcn.cpu()
+    dcn.eval()
+    metadata = get_metadata(dcn)
+    model = RGBDescriptorNetwork(dcn, metadata["image_mean"], metadata["image_std_dev"])
+    model.eval()
+    example_input = torch.zeros(1, metadata["image_height"], metadata["image_width"], 3, dtype=torch.uint8)
+
+    if not os.path.isdir(os.path.dirname(os.path.abspath(filename))):
+        os.makedirs(os.path.dirname(os.path.abspath(filename)))
+
+    with torch.no_grad():
+        if export_format == "torchscript":
+            traced = torch.jit.trace(model, example_input)
+            torch.jit.save(traced, filename, _extra_files={METADATA_KEY: json.dumps(metadata)})
+        else:
+            import onnx
+
+            torch.onnx.export(model, example_input, filename, input_names=["rgb"], output_names=["descriptors"],
+                              dynamic_axes={"rgb": {0: "batch"}, "descriptors": {0: "batch"}},
+                              opset_version=ONNX_OPSET_VERSION)
+            onnx_model = onnx.load(filename)
+            entry = onnx_model.metadata_props.add()
+            entry.key = METADATA_KEY
+            entry.value = json.dumps(metadata)
+            onnx.save(onnx_model, filename)
+    return metadata
+
+
+def check_export(dcn, filename, rgb=None):
+    """
+    Max absolute difference of the descriptors of the exported network and of dcn
+    :param rgb: (optional) uint8 [H, W, 3] RGB image, random if None
+    :rtype: float
+    """
+    image_height, image_width = dcn.image_shape
+    if rgb is None:
+        rgb = np.random.randint(0, 256, size=(image_height, image_width, 3), dtype=np.uint8)
+    image_mean, image_std_dev = get_normalization(dcn)
+    model = RGBDescriptorNetwork(dcn, image_mean, image_std_dev).eval()
+    with torch.no_grad():
+        expected = model(torch.from_numpy(rgb).unsqueeze(0))[0].numpy()
+    exported = ExportedDescriptorNetwork(filename).forward_rgb(rgb)
+    return float(np.abs(exported - expected).max())
+
+
+if __name__ == "__main__":
+    argParser = argparse.ArgumentParser()
+    argParser.add_argument("model_folder", help="model folder, absolute or relative to pdc/trained_models")
+    argParser.add_argument("--iteration", type=int, default=None)
+    argParser.add_argument("--format", default="torchscript", choices=EXPORT_FORMATS)
+    argParser.add_argument("--quantized", action="store_true",
+                           help="export the int8 network of quantized/, torchscript only")
+    argParser.add_argument("--output", default=None,
+                           help="output file, <model_folder>/exported/<iteration>.pt or .onnx if None")
+    args = argParser.parse_args()
+
+    if args.quantized and args.format != "torchscript":
+        raise ValueError("the quantized networks can only be exported to torchscript")
+
+    model_folder = utils.convert_to_absolute_path(args.model_folder)
+    dcn = DenseCorrespondenceNetwork.from_model_folder(model_folder, iteration=args.iteration,
+                                                       quantized=args.quantized)
+
+    output = args.output
+    if output is None:
+        extension = ".pt" if args.format == "torchscript" else ".onnx"
+        name = os.path.splitext(os.path.basename(dcn.config["model_param_file"]))[0]
+        if args.quantized:
+            name += "_int8"
+        output = os.path.join(model_folder, EXPORT_FOLDER_NAME, name + extension)
+
+    print("exported", output, export_network(dcn, output, export_format=args.format))
+    print("max descriptor difference with the network:", check_export(dcn, output))
@@ -0,0 +1,90 @@
+"""
+Minimal loader of the descriptor networks exported by export_network.py.
+
+Only needs numpy and torch (TorchScript) or onnxruntime (ONNX), not the rest of
+the repository, the dataset or the yaml configs: this file can be copied as is to
+the robot. The exported network takes the raw RGB images and does the image
+normalization and the descriptor normalization itself,
+
+    uint8 [N, H, W, 3] RGB ---> float32 [N, H, W, D] descriptors
+
+for the fixed H, W of the export.
+
+    network = ExportedDescriptorNetwork("000500.pt")  # or "000500.onnx"
+    res = network.forward_rgb(rgb)  # [H, W, D]
+"""
+
+import json
+
+import numpy as np
+
+METADATA_KEY = "dense_correspondence_metadata"
+
+
+class ExportedDescriptorNetwork(object):
+
+    def __init__(self, filename, num_threads=None):
+        """
+        :param filename: .pt TorchScript or .onnx file written by export_network.py
+        :param num_threads: (optional) number of cpu threads
+        """
+        self._filename = filename
+        if filename.endswith(".onnx"):
+            import onnxruntime
+
+            options = onnxruntime.SessionOptions()
+            if num_threads is not None:
+                options.intra_op_num_threads = num_threads
+            self._session = onnxruntime.InferenceSession(filename, sess_options=options,
+                                                         providers=["CPUExecutionProvider"])
+            self._metadata = json.loads(self._session.get_modelmeta().custom_metadata_map[METADATA_KEY])
+            self._module = None
+        else:
+            import torch
+
+            if num_threads is not None:
+                torch.set_num_threads(num_threads)
+            extra_files = {METADATA_KEY: ""}
+            self._module = torch.jit.load(filename, map_location="cpu", _extra_files=extra_files)
+            self._module.eval()
+            self._metadata = json.loads(extra_files[METADATA_KEY])
+            self._session = None
+
+    @property
+    def metadata(self):
+        """
+        dict with image_width, image_height, descriptor_dimension, image_mean, image_std_dev
+        """
+        return self._metadata
+
+    @property
+    def image_shape(self):
+        return [self._metadata["image_height"], self._metadata["image_width"]]
+
+    @property
+    def descriptor_dimension(self):
+        return self._metadata["descriptor_dimension"]
+
+    def forward(self, rgb_batch):
+        """
+        :param rgb_batch: numpy.ndarray uint8 [N, H, W, 3] RGB images
+        :return: numpy.ndarray float32 [N, H, W, D]
+        """
+        rgb_batch = np.ascontiguousarray(rgb_batch, dtype=np.uint8)
+        assert list(rgb_batch.shape[1:3]) == self.image_shape, "the network was exported for %s images" % (
+            self.image_shape,)
+
+        if self._session is not None:
+            return self._session.run(None, {"rgb": rgb_batch})[0]
+
+        import torch
+
+        with torch.no_grad():
+            return self._module(torch.from_numpy(rgb_batch)).numpy()
+
+    def forward_rgb(self, rgb):
+        """
+        :param rgb: numpy.ndarray uint8 [H, W, 3] RGB image
+        :return: numpy.ndarray float32 [H, W, D]
+        """
+        return self.forward(np.asarray(rgb)[np.newaxis])[0]
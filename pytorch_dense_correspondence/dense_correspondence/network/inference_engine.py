@@ -0,0 +1,209 @@
+"""
+Inference engine of DenseCorrespondenceNetwork for fixed size images.
+
+    engine = InferenceEngine(dcn, precision="bf16")
+    res = engine.forward_single_image_tensor(img_tensor)  # [H, W, D] float32
+
+Compared to dcn.forward_single_image_tensor() it
+    - runs under torch.inference_mode() (torch.no_grad() on older torch)
+    - runs in the selected precision:
+        "fp32": float32
+        "bf16": bfloat16 autocast, on cpu and cuda
+        "fp16": float16 autocast, cuda only
+    - uses the channels_last memory format for the convolutions
+    - copies the inputs and outputs into buffers allocated once for the
+      [batch_size, 3, H, W] shape, 640x480 by default
+
+The descriptors are always returned as float32. validate_precisions() compares
+the best matches of every precision with those of fp32 on held-out image pairs.
+"""
+
+import time
+from contextlib import contextmanager
+
+import torch
+
+import dense_correspondence.network.descriptor_matcher as descriptor_matcher
+
+PRECISIONS = ("fp32", "bf16", "fp16")
+AUTOCAST_DTYPES = {"bf16": torch.bfloat16, "fp16": torch.float16}
+
+
+def get_inference_mode():
+    if hasattr(torch, "inference_mode"):
+        return torch.inference_mode()
+    return torch.no_grad()
+
+
+class InferenceEngine(object):
+
+    def __init__(self, dcn, precision="fp32", device=None, channels_last=True, batch_size=1,
+                 image_width=None, image_height=None):
+        """
+        :param dcn: network, put in eval mode. Its parameters are moved to device and, if
+            channels_last, converted to the channels_last memory format, in place
+        :type dcn: DenseCorrespondenceNetwork
+        :param precision: one of PRECISIONS
+        :param device: torch device, the device of dcn if None
+        :param channels_last: use the channels_last memory format
+        :param batch_size: max number of images per forward pass
+        :param image_width, image_height: size of the images, those of dcn if None
+        """
+        if precision not in PRECISIONS:
+            raise ValueError("precision must be one of %s, got %s" % (PRECISIONS, precision))
+        if device is None:
+            device = next(dcn.parameters()).device
+        self._device = torch.device(device)
+        if precision == "fp16" and self._device.type != "cuda":
+            raise ValueError("fp16 inference is only available on cuda")
+
+        self._dcn = dcn
+        self._precision = precision
+        self._channels_last = channels_last
+        self._memory_format = torch.channels_last if channels_last else torch.contiguous_format
+
+        self._dcn.to(self._device)
+        if channels_last:
+            self._dcn.to(memory_format=torch.channels_last)
+        self._dcn.eval()
+
+        if image_width is None or image_height is None:
+            image_height, image_width = dcn.image_shape
+        self._image_shape = (image_height, image_width)
+        self._input_buffer = torch.empty(batch_size, 3, image_height, image_width, device=self._device)
+        self._input_buffer = self._input_buffer.contiguous(memory_format=self._memory_format)
+        self._output_buffer = torch.empty(batch_size, image_height, image_width, dcn.descriptor_dimension,
+                                          device=self._device)
+
+    @property
+    def precision(self):
+        return self._precision
+
+    @property
+    def device(self):
+        return self._device
+
+    @property
+    def batch_size(self):
+        return self._input_buffer.shape[0]
+
+    @contextmanager
+    def _precision_context(self):
+        if self._precision == "fp32":
+            yield
+        else:
+            with torch.autocast(self._device.type, dtype=AUTOCAST_DTYPES[self._precision]):
+                yield
+
+    def forward(self, img_tensor):
+        """
+        :param img_tensor: torch.FloatTensor [N, 3, H, W] normalized images, N <= batch_size
+        :return: torch.FloatTensor [N, H, W, D] descriptors. It is a view of the output buffer,
+            overwritten by the next call: clone() it to keep it
+        """
+        num_images = img_tensor.shape[0]
+        assert num_images <= self.batch_size, "batch of %d images, the engine has %d" % (
+            num_images, self.batch_size)
+        assert tuple(img_tensor.shape[2:]) == self._image_shape
+
+        with get_inference_mode():
+            input_tensor = self._input_buffer[:num_images]
+            input_tensor.copy_(img_tensor)
+            with self._precision_context():
+                res = self._dcn.forward(input_tensor)  # [N, D, H, W]
+            output = self._output_buffer[:num_images]
+            output.copy_(res.permute(0, 2, 3, 1))
+        return output
+
+    def forward_single_image_tensor(self, img_tensor):
+        """
+        Same as DenseCorrespondenceNetwork.forward_single_image_tensor()
+
+        :param img_tensor: torch.FloatTensor [3, H, W]
+        :return: torch.FloatTensor [H, W, D], see forward()
+        """
+        assert len(img_tensor.shape) == 3
+        return self.forward(img_tensor.unsqueeze(0))[0]
+
+
+def _sample_matches(matches_a, matches_b, num_matches, image_width):
+    indices = torch.randperm(len(matches_a))[:num_matches]
+    matches_a = matches_a[indices]
+    matches_b = matches_b[indices]
+    uv_a = torch.stack((matches_a % image_width, torch.div(matches_a, image_width, rounding_mode="trunc")), 1)
+    uv_b = torch.stack((matches_b % image_width, torch.div(matches_b, image_width, rounding_mode="trunc")), 1)
+    return uv_a, uv_b
+
+
+def validate_precisions(dcn, dataset, precisions=("fp32", "bf16"), device=None, channels_last=True, num_pairs=20,
+                        num_matches_per_pair=100):
+    """
+    Match error of each precision compared to fp32, on held-out (test mode) image pairs of dataset.
+
+    For each precision, the best matches in image b of num_matches_per_pair ground truth
+    matches of image a are compared to those of fp32 and to the ground truth.
+
+    :param dcn: network
+    :type dcn: DenseCorrespondenceNetwork
+    :param dataset: dataset of the held-out pairs, set to test mode
+    :type dataset: SpartanDataset
+    :param precisions: precisions to validate, see PRECISIONS
+    :return: pandas.DataFrame with one row per precision:
+        - fraction_same_match: fraction of best matches equal to those of fp32
+        - mean_pixel_diff_fp32: mean pixel distance to the best matches of fp32
+        - mean_pixel_error: mean pixel distance to the ground truth matches
+        - max_descriptor_diff: max absolute difference of the descriptors with those of fp32
+        - time_per_image: seconds per forward pass
+    :rtype: pandas.DataFrame
+    """
+    import pandas as pd
+
+    image_height, image_width = dcn.image_shape
+    dataset.set_test_mode()
+    reference_engine = InferenceEngine(dcn, precision="fp32", device=device, channels_last=False, batch_size=2)
+    engines = [InferenceEngine(dcn, precision=p, device=device, channels_last=channels_last, batch_size=2)
+               for p in precisions]
+
+    stats = {p: dict(num_same=0, pixel_diff=0.0, pixel_error=0.0, descriptor_diff=0.0, time=0.0)
+             for p in precisions}
+    num_matches = 0
+    num_valid_pairs = 0
+    for i in range(num_pairs):
+        match_type, img_a, img_b, _, _, matches_a, matches_b = dataset[i][:7]
+        if match_type == -1 or dataset.is_empty(matches_a):
+            continue
+        num_valid_pairs += 1
+
+        uv_a, uv_b_true = _sample_matches(matches_a, matches_b, num_matches_per_pair, image_width)
+        img_pair = torch.stack((img_a, img_b))
+        reference = reference_engine.forward(img_pair).clone()
+        reference_matches = descriptor_matcher.find_best_matches_for_pixels(uv_a, reference[0], reference[1])
+        num_matches += len(uv_a)
+
+        for engine in engines:
+            if engine.device.type == "cuda":
+                torch.cuda.synchronize()
+            start = time.time()
+            res = engine.forward(img_pair)
+            if engine.device.type == "cuda":
+                torch.cuda.synchronize()
+
+            s = stats[engine.precision]
+            s["time"] += (time.time() - start) / 2.0
+            matches = descriptor_matcher.find_best_matches_for_pixels(uv_a, res[0], res[1])
+            s["num_same"] += (matches.uv == reference_matches.uv).all(1).sum().item()
+            s["pixel_diff"] += (matches.uv - reference_matches.uv).float().norm(2, dim=1).sum().item()
+            s["pixel_error"] += (matches.uv.cpu() - uv_b_true).float().norm(2, dim=1).sum().item()
+            s["descriptor_diff"] = max(s["descriptor_diff"], (res - reference).abs().max().item())
+
+    num_valid_pairs = max(num_valid_pairs, 1)
+    rows = []
+    for precision in precisions:
+        s = stats[precision]
+        rows.append(dict(precision=precision,
+                         fraction_same_match=s["num_same"] / float(max(num_matches, 1)),
+                         mean_pixel_diff_fp32=s["pixel_diff"] / float(max(num_matches, 1)),
+                         mean_pixel_error=s["pixel_error"] / float(max(num_matches, 1)),
+                         max_descriptor_diff=s["descriptor_diff"],
+                         time_per_image=s["time"] / num_valid_pairs))
+    return pd.DataFrame(rows)
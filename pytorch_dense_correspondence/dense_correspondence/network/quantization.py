@@ -0,0 +1,255 @@
+"""
+Post-training int8 quantization of the Resnet*_8s descriptor networks, for cpu inference.
+
+The resnet of the fcn (resnet34_8s, resnet50_8s or resnet101_8s) is quantized with
+FX graph mode static quantization:
+    - prepare: conv-bn(-relu) are fused and observers are inserted
+    - calibration: forward passes on images of a SpartanDataset
+    - convert: int8 weights and activations
+The bilinear upsampling of the fcn and the normalization of the descriptors stay in
+float. The quantized params are saved in the model folder as
+
+    <model_folder>/quantized/003500.pth
+    <model_folder>/quantized/quantization.yaml
+
+and loaded with DenseCorrespondenceNetwork.from_model_folder(model_folder, quantized=True).
+
+To quantize a network from terminal (from pytorch_dense_correspondence):
+    python dense_correspondence/network/quantization.py <model_folder> --num_calibration_images 300
+"""
+
+import os
+import copy
+import time
+import fnmatch
+import argparse
+
+import torch
+
+import dense_correspondence_manipulation.utils.utils as utils
+
+utils.add_dense_correspondence_to_python_path()
+
+QUANTIZED_FOLDER_NAME = "quantized"
+QUANTIZATION_CONFIG_FILENAME = "quantization.yaml"
+RESNET_ATTRIBUTE_NAMES = ("resnet34_8s", "resnet50_8s", "resnet101_8s")
+DEFAULT_BACKEND = "fbgemm"  # x86, use "qnnpack" on arm
+
+
+def get_resnet_attribute_name(fcn):
+    for name in RESNET_ATTRIBUTE_NAMES:
+        if hasattr(fcn, name):
+            return name
+    raise ValueError("only the Resnet*_8s networks of resnet_dilated can be quantized")
+
+
+def _example_input(dcn):
+    image_height, image_width = dcn.image_shape
+    return torch.zeros(1, 3, image_height, image_width)
+
+
+def prepare_network(dcn, backend=DEFAULT_BACKEND):
+    """
+    Fuses conv-bn-relu and inserts the observers in the resnet of dcn, in place
+    :type dcn: DenseCorrespondenceNetwork
+    """
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import prepare_fx
+
+    torch.backends.quantized.engine = backend
+    dcn.cpu()
+    dcn.eval()
+    name = get_resnet_attribute_name(dcn.fcn)
+    prepared = prepare_fx(getattr(dcn.fcn, name), get_default_qconfig_mapping(backend),
+                          example_inputs=(_example_input(dcn),))
+    setattr(dcn.fcn, name, prepared)
+    return dcn
+
+
+def convert_network(dcn):
+    """
+    Converts the prepared (and calibrated) resnet of dcn to int8, in place
+    :type dcn: DenseCorrespondenceNetwork
+    """
+    from torch.ao.quantization.quantize_fx import convert_fx
+
+    name = get_resnet_attribute_name(dcn.fcn)
+    setattr(dcn.fcn, name, convert_fx(getattr(dcn.fcn, name)))
+    return dcn
+
+
+def calibrate(dcn, dataset, num_images=200, batch_size=4):
+    """
+    Forward passes of the prepared network on the images a and b of dataset
+
+    :type dataset: SpartanDataset
+    :param num_images: number of calibration images
+    """
+    images = []
+    num_calibrated = 0
+    with torch.no_grad():
+        for i in range(2 * num_images):
+            if num_calibrated + len(images) >= num_images:
+                break
+            match_type, img_a, img_b = dataset[i][:3]
+            if match_type == -1:
+                continue
+            images += [img_a, img_b]
+            if len(images) >= batch_size:
+                dcn.forward(torch.stack(images))
+                num_calibrated += len(images)
+                images = []
+        if images:
+            dcn.forward(torch.stack(images))
+            num_calibrated += len(images)
+    print("calibrated on %d images" % num_calibrated)
+
+
+def quantize_network(dcn, dataset, num_calibration_images=200, backend=DEFAULT_BACKEND, batch_size=4):
+    """
+    :param dcn: float network, not modified
+    :type dcn: DenseCorrespondenceNetwork
+    :param dataset: calibration images
+    :type dataset: SpartanDataset
+    :return: int8 copy of dcn, on the cpu, in eval mode
+    :rtype: DenseCorrespondenceNetwork
+    """
+    quantized_dcn = prepare_network(copy.deepcopy(dcn).cpu(), backend=backend)
+    calibrate(quantized_dcn, dataset, num_images=num_calibration_images, batch_size=batch_size)
+    return convert_network(quantized_dcn)
+
+
+def get_quantized_folder(model_folder):
+    return os.path.join(utils.convert_to_absolute_path(model_folder), QUANTIZED_FOLDER_NAME)
+
+
+def save_quantized_network(quantized_dcn, model_folder, model_param_file, backend=DEFAULT_BACKEND,
+                           num_calibration_images=None):
+    """
+    Saves the params of quantized_dcn in <model_folder>/quantized/, with the same filename
+    as the float params model_param_file
+    :return: filename of the quantized params
+    :rtype: str
+    """
+    quantized_folder = get_quantized_folder(model_folder)
+    if not os.path.isdir(quantized_folder):
+        os.makedirs(quantized_folder)
+
+    quantized_param_file = os.path.join(quantized_folder, os.path.basename(model_param_file))
+    torch.save(quantized_dcn.state_dict(), quantized_param_file)
+
+    quantization_config = dict(backend=backend, float_model_param_file=os.path.basename(model_param_file),
+                               num_calibration_images=num_calibration_images)
+    utils.saveToYaml(quantization_config, os.path.join(quantized_folder, QUANTIZATION_CONFIG_FILENAME))
+    return quantized_param_file
+
+
+def get_quantized_param_file(model_folder, iteration=None):
+    """
+    :param iteration: e.g. 3500, the latest one if None
+    """
+    quantized_folder = get_quantized_folder(model_folder)
+    if iteration is None:
+        model_param_file = sorted(fnmatch.filter(os.listdir(quantized_folder), "*.pth"))[-1]
+    else:
+        model_param_file = utils.getPaddedString(iteration, width=6) + ".pth"
+    return os.path.join(quantized_folder, model_param_file)
+
+
+def load_quantized_params(dcn, model_folder, iteration=None):
+    """
+    Converts the float dcn built from the config of model_folder to int8 and loads the
+    quantized params, in place. The network is left in eval mode, on the cpu.
+    :type dcn: DenseCorrespondenceNetwork
+    """
+    quantized_folder = get_quantized_folder(model_folder)
+    quantization_config = utils.getDictFromYamlFilename(
+        os.path.join(quantized_folder, QUANTIZATION_CONFIG_FILENAME))
+    quantized_param_file = get_quantized_param_file(model_folder, iteration=iteration)
+
+    # no calibration needed, the observed ranges are in the saved params. One forward pass
+    # so that the observers have a range to convert
+    prepare_network(dcn, backend=quantization_config["backend"])
+    with torch.no_grad():
+        dcn.forward(_example_input(dcn))
+    convert_network(dcn)
+    dcn.load_state_dict(torch.load(quantized_param_file, map_location="cpu"))
+    dcn.eval()
+    dcn.config["model_param_file"] = quantized_param_file
+    dcn.config["quantization"] = quantization_config
+    return dcn
+
+
+def _time_per_image(dcn, images):
+    with torch.no_grad():
+        dcn.forward_single_image_tensor(images[0])  # warm up
+        start = time.time()
+        for img in images:
+            dcn.forward_single_image_tensor(img)
+    return (time.time() - start) / len(images)
+
+
+def quantization_report(float_dcn, quantized_dcn, dataset, num_image_pairs=25, num_matches_per_image_pair=100,
+                        num_timing_images=10, benchmark_set=None):
+    """
+    Cpu latency and DenseCorrespondenceEvaluation.evaluate_network() pixel match errors
+    of the float and int8 networks, on the same image pairs
+
+    :param benchmark_set: (optional) BenchmarkSet or .npz file of the image pairs
+
+    :return: pandas.DataFrame with rows float, int8 and delta (int8 - float)
+    :rtype: pandas.DataFrame
+    """
+    import pandas as pd
+    from dense_correspondence.evaluation.evaluation import DenseCorrespondenceEvaluation
+
+    float_dcn = copy.deepcopy(float_dcn).cpu().eval()
+    images = []
+    while len(images) < num_timing_images:
+        images.append(dataset[len(images)][1])
+
+    rows = []
+    for label, dcn in (("float", float_dcn), ("int8", quantized_dcn)):
+        _, df = DenseCorrespondenceEvaluation.evaluate_network(
+            dcn, dataset, num_image_pairs=num_image_pairs, num_matches_per_image_pair=num_matches_per_image_pair,
+            benchmark_set=benchmark_set)
+        rows.append(dict(model=label,
+                         time_per_image=_time_per_image(dcn, images),
+                         pixel_match_error_l2_mean=df["pixel_match_error_l2"].mean(),
+                         pixel_match_error_l2_median=df["pixel_match_error_l2"].median(),
+                         pixel_match_error_l2_masked_mean=df["pixel_match_error_l2_masked"].mean(),
+                         pixel_match_error_l2_masked_median=df["pixel_match_error_l2_masked"].median()))
+
+    report = pd.DataFrame(rows).set_index("model")
+    report.loc["delta"] = report.loc["int8"] - report.loc["float"]
+    return report
+
+
+if __name__ == "__main__":
+    from dense_correspondence.network.dense_correspondence_network import DenseCorrespondenceNetwork
+
+    argParser = argparse.ArgumentParser()
+    argParser.add_argument("model_folder", help="model folder, absolute or relative to pdc/trained_models")
+    argParser.add_argument("--iteration", type=int, default=None)
+    argParser.add_argument("--num_calibration_images", type=int, default=200)
+    argParser.add_argument("--backend", default=DEFAULT_BACKEND)
+    argParser.add_argument("--num_image_pairs", type=int, default=25,
+                           help="image pairs of the report, no report if 0")
+    argParser.add_argument("--benchmark", default=None, help=".npz benchmark set of the report, see benchmark_set.py")
+    args = argParser.parse_args()
+
+    model_param_file, _, _ = utils.get_model_param_file_from_directory(args.model_folder, iteration=args.iteration)
+    dcn = DenseCorrespondenceNetwork.from_model_folder(args.model_folder, model_param_file=model_param_file)
+    dcn.eval()
+    dataset = dcn.load_training_dataset()
+
+    quantized_dcn = quantize_network(dcn, dataset, num_calibration_images=args.num_calibration_images,
+                                     backend=args.backend)
+    print("saved", save_quantized_network(quantized_dcn, dcn.path_to_network_params_folder, model_param_file,
+                                          backend=args.backend,
+                                          num_calibration_images=args.num_calibration_images))
+
+    if args.num_image_pairs > 0:
+        dataset.set_test_mode()
+        print(quantization_report(dcn, quantized_dcn, dataset, num_image_pairs=args.num_image_pairs,
+                                  benchmark_set=args.benchmark))
@@ -19,6 +19,7 @@ from torch.autograd import Variable
 utils.add_dense_correspondence_to_python_path()
 
 from dense_correspondence.dataset.spartan_dataset_masked import SpartanDataset, SpartanDatasetDataType
+from dense_correspondence.dataset.batch_collate import collate_image_pairs
 from dense_correspondence.network.dense_correspondence_network import DenseCorrespondenceNetwork
 
 from dense_correspondence.loss_functions.pixelwise_contrastive_loss import PixelwiseContrastiveLoss
@@ -78,7 +79,8 @@ class DenseCorrespondenceTraining(object):
         self._dataset.set_parameters_from_training_config(self._config)
 
         self._data_loader = torch.utils.data.DataLoader(self._dataset, batch_size=batch_size,
-                                                        shuffle=True, num_workers=num_workers, drop_last=True)
+                                                        shuffle=True, num_workers=num_workers, drop_last=True,
+                                                        collate_fn=collate_image_pairs)
 
         # create a test dataset
         if self._config["training"]["compute_test_loss"]:
@@ -89,7 +91,8 @@ class DenseCorrespondenceTraining(object):
             self._dataset_test.set_parameters_from_training_config(self._config)
 
             self._data_loader_test = torch.utils.data.DataLoader(self._dataset_test, batch_size=batch_size,
-                                                                 shuffle=True, num_workers=2, drop_last=True)
+                                                                 shuffle=True, num_workers=2, drop_last=True,
+                                                                 collate_fn=collate_image_pairs)
 
     def load_dataset_from_config(self, config):
         """
@@ -236,7 +239,6 @@ class DenseCorrespondenceTraining(object):
         dcn.train()
 
         optimizer = self._optimizer
-        batch_size = self._data_loader.batch_size
         loss_type = self._config['dense_correspondence_network']['loss_type']
 
         if loss_type == 'contrastive':
@@ -295,34 +297,31 @@ class DenseCorrespondenceTraining(object):
                 data_type = metadata["type"][0]
 
                 # transform variables in proper format and move them to cuda
+                # the matches and non-matches of all the pairs come flattened by collate_image_pairs()
                 img_a = Variable(img_a.cuda(), requires_grad=False)
                 img_b = Variable(img_b.cuda(), requires_grad=False)
                 
-                matches_a = Variable(matches_a.cuda().squeeze(0), requires_grad=False)
-                matches_b = Variable(matches_b.cuda().squeeze(0), requires_grad=False)
+                matches_a = Variable(matches_a.cuda(), requires_grad=False)
+                matches_b = Variable(matches_b.cuda(), requires_grad=False)
                 
                 if matches_a.size()[0] == 0:
                     print("\n no matches \n")
                     continue
                 
-                masked_non_matches_a = Variable(masked_non_matches_a.cuda().squeeze(0), requires_grad=False)
-                masked_non_matches_b = Variable(masked_non_matches_b.cuda().squeeze(0), requires_grad=False)
+                masked_non_matches_a = Variable(masked_non_matches_a.cuda(), requires_grad=False)
+                masked_non_matches_b = Variable(masked_non_matches_b.cuda(), requires_grad=False)
 
-                background_non_matches_a = Variable(background_non_matches_a.cuda().squeeze(0), requires_grad=False)
-                background_non_matches_b = Variable(background_non_matches_b.cuda().squeeze(0), requires_grad=False)
+                background_non_matches_a = Variable(background_non_matches_a.cuda(), requires_grad=False)
+                background_non_matches_b = Variable(background_non_matches_b.cuda(), requires_grad=False)
 
-                blind_non_matches_a = Variable(blind_non_matches_a.cuda().squeeze(0), requires_grad=False)
-                blind_non_matches_b = Variable(blind_non_matches_b.cuda().squeeze(0), requires_grad=False)
+                blind_non_matches_a = Variable(blind_non_matches_a.cuda(), requires_grad=False)
+                blind_non_matches_b = Variable(blind_non_matches_b.cuda(), requires_grad=False)
 
                 optimizer.zero_grad()
                 self.adjust_learning_rate(optimizer, loss_current_iteration)
 
                 # run both images through the network
-                image_a_pred = dcn.forward(img_a)
-                image_a_pred = dcn.process_network_output(image_a_pred, batch_size)
-
-                image_b_pred = dcn.forward(img_b)
-                image_b_pred = dcn.process_network_output(image_b_pred, batch_size)
+                image_a_pred, image_b_pred = dcn.forward_pair(img_a, img_b)
 
                 # get loss
                 if loss_type == 'contrastive':
@@ -454,6 +453,7 @@ class DenseCorrespondenceTraining(object):
                         DCE.compute_loss_on_dataset(dcn,
                                                     self._data_loader_test,
                                                     self._config['loss_function'],
+                                                    symmetry=self._config['dense_correspondence_network']['symmetry'],
                                                     num_iterations=self._config['training']['test_loss_num_iterations'])
 
                     # delete these variables so we can free GPU memory
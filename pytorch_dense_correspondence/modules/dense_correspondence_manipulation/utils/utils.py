@@ -10,11 +10,39 @@ import socket
 import getpass
 import fnmatch
 import random
+import importlib
 import torch
 
 import dense_correspondence_manipulation.utils.transformations as transformations
 
 
+class LazyModule(object):
+    """
+    Module imported on the first access to one of its attributes. For the plotting and
+    analysis dependencies of modules that are also imported at inference time
+
+        plt = LazyModule("matplotlib.pyplot")
+    """
+
+    def __init__(self, name):
+        object.__setattr__(self, "_name", name)
+        object.__setattr__(self, "_module", None)
+
+    def _load(self):
+        if self._module is None:
+            object.__setattr__(self, "_module", importlib.import_module(self._name))
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._load(), attr, value)
+
+    def __repr__(self):
+        return "<LazyModule %s%s>" % (self._name, "" if self._module is None else ", loaded")
+
+
 def getDictFromJSONFilename(filename):
     with open(filename, "r") as stream:
         return json.load(stream)
@@ -261,7 +261,8 @@ class HeatmapVisualization(object):
             res_a = self._res_a[network_name]
             res_b = self._res_b[network_name]
             best_match_uv, best_match_diff, norm_diffs = \
-                DenseCorrespondenceNetwork.find_best_match((u, v), res_a, res_b)
+                DenseCorrespondenceNetwork.find_best_match((u, v), res_a, res_b,
+                                                           backend=self._dce.matcher_backend)
             print "\n\n"
             print "network_name:", network_name
             self._res_uv[network_name] = dict()